@@ -0,0 +1,54 @@
+import sys
+import argparse
+import importlib
+
+# =========================
+# STAGES
+# =========================
+
+# Subcommand -> (module, summary). Modules are imported only when their
+# subcommand runs, and keep their own heavy imports inside functions, so
+# `acm_ai --help` and the light stages start without loading models.
+STAGES = {
+    "extract": ("classroom_api_extraction", "Fetch courses and materials from Google Classroom"),
+    "normalize": ("normalize_classroom", "Upsert the Classroom dump into PostgreSQL"),
+    "parse": ("parse_documents", "Download and parse Drive documents"),
+    "roles": ("infer_document_roles", "Classify document roles with an LLM"),
+    "topics": ("infer_units_topics", "Extract syllabus units and topics with an LLM"),
+    "chunk": ("chunk_documents", "Chunk documents and map chunks to topics"),
+    "search": ("retrieval", "Build, update and query the chunk vector index"),
+    "export": ("export_chunks_for_colab", "Export chunks as JSONL"),
+    "run": ("pipeline", "Run parse → roles → topics → chunk incrementally"),
+    "serve": ("model_server", "Serve the models over localhost HTTP"),
+    "bench": ("benchmark", "Benchmark the stages on a synthetic corpus"),
+}
+
+# =========================
+# MAIN
+# =========================
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+
+    parser = argparse.ArgumentParser(
+        prog="acm_ai",
+        description="ACM AI pipeline",
+        epilog="stages:\n" + "\n".join(
+            f"  {name:<10} {summary}" for name, (_, summary) in STAGES.items()
+        ) + "\n\nRun `acm_ai <stage> --help` for the options of a stage.",
+        formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("stage", choices=STAGES, metavar="stage", help="one of the stages below")
+    parser.add_argument("args", nargs=argparse.REMAINDER, help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    module_name, _ = STAGES[args.stage]
+    module = importlib.import_module(module_name)
+
+    # Stage parsers take their program name from argv[0]
+    sys.argv[0] = f"acm_ai {args.stage}"
+    return module.main(args.args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,640 @@
+import os
+import re
+import sys
+import json
+import time
+import zlib
+import random
+import shutil
+import argparse
+import platform
+import tempfile
+import multiprocessing
+from datetime import datetime, timezone
+
+import numpy as np
+
+from jsonl_io import JsonlWriter, ShardedJsonlWriter, iter_records
+
+# =========================
+# CONFIG
+# =========================
+
+RESULTS_PATH = "bench_results.json"
+BASELINE_PATH = "bench_baseline.json"
+
+DEFAULT_COURSES = 10
+DOCS_PER_COURSE = 6  # one syllabus + study material
+PARAGRAPHS_PER_DOC = 40
+UNITS_PER_SYLLABUS = 5
+TOPICS_PER_UNIT = 6
+VOCAB_SIZE = 5000
+SEED = 0
+
+STAGES = ("normalize", "parse", "chunk", "map", "export")
+
+# Stage counts as regressed when throughput drops, or p95 latency or peak
+# RSS grows, by more than this fraction of the baseline
+REGRESSION_TOLERANCE = 0.15
+
+STUB_EMBED_DIM = 384
+EXPORT_SHARD_SIZE = 50000
+
+# =========================
+# SYNTHETIC CORPUS
+# =========================
+
+SUBJECTS = [
+    ("Quantum Mechanics", "PHY"), ("Data Structures", "CSE"), ("Linear Algebra", "MAT"),
+    ("Organic Chemistry", "CHE"), ("Digital Electronics", "ECE"), ("Thermodynamics", "MEC"),
+    ("Operating Systems", "CSE"), ("Probability and Statistics", "MAT"),
+]
+
+
+def make_vocab(rng, size=VOCAB_SIZE):
+    syllables = ["ka", "lo", "mi", "ter", "quan", "tum", "ro", "sen", "vi", "dal",
+                 "pha", "gen", "tor", "ix", "ana", "cor", "lu", "mer", "sta", "ble"]
+    words = set()
+    while len(words) < size:
+        words.add("".join(rng.choice(syllables) for _ in range(rng.randint(2, 4))))
+    return sorted(words)
+
+
+def make_sentence(rng, vocab, n_words=None):
+    words = [rng.choice(vocab) for _ in range(n_words or rng.randint(8, 24))]
+    return words[0].capitalize() + " " + " ".join(words[1:]) + "."
+
+
+def make_paragraph(rng, vocab):
+    # One in twenty paragraphs is oversize, to exercise the splitter
+    n_sentences = rng.randint(30, 50) if rng.random() < 0.05 else rng.randint(2, 7)
+    return " ".join(make_sentence(rng, vocab) for _ in range(n_sentences))
+
+
+def wrap(text, width=90):
+    """Text-layer lines, as a PDF would lay the paragraph out."""
+    lines = []
+    current = ""
+    for word in text.split():
+        if current and len(current) + 1 + len(word) > width:
+            lines.append(current)
+            current = word
+        else:
+            current = f"{current} {word}" if current else word
+    if current:
+        lines.append(current)
+    return lines
+
+
+def make_syllabus(rng, vocab, course_name, code):
+    """Syllabus text-layer lines plus its unit → topic outline."""
+    lines = [course_name, f"Course Code {code} Course Category CC", ""]
+    topics = []
+
+    for unit in range(1, UNITS_PER_SYLLABUS + 1):
+        unit_name = f"Unit {unit} " + " ".join(rng.choice(vocab) for _ in range(3)).title()
+        lines.append(unit_name)
+
+        for _ in range(TOPICS_PER_UNIT):
+            topic_name = " ".join(rng.choice(vocab) for _ in range(rng.randint(2, 4)))
+            lines.extend(wrap(f"{topic_name.capitalize()}: {make_sentence(rng, vocab)}"))
+            topics.append(f"{unit_name} → {topic_name}")
+
+    return lines, topics
+
+
+def make_document(rng, vocab, title, paragraphs):
+    lines = [title]
+    for i in range(paragraphs):
+        if i and i % 8 == 0:
+            lines.append(" ".join(rng.choice(vocab) for _ in range(3)).title())
+        lines.extend(wrap(make_paragraph(rng, vocab)))
+    return lines
+
+
+def pdf_escape(line):
+    return line.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+
+def make_pdf(lines, lines_per_page=50):
+    """Minimal PDF with a Helvetica text layer, one text line per line."""
+    pages = [lines[i:i + lines_per_page] for i in range(0, len(lines), lines_per_page)] or [[]]
+    kids = [4 + 2 * i for i in range(len(pages))]
+
+    objects = {
+        1: b"<< /Type /Catalog /Pages 2 0 R >>",
+        2: f"<< /Type /Pages /Kids [{' '.join(f'{k} 0 R' for k in kids)}] /Count {len(pages)} >>".encode(),
+        3: b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding /WinAnsiEncoding >>",
+    }
+
+    for page_id, page_lines in zip(kids, pages):
+        content = "\n".join(
+            ["BT /F1 9 Tf 11 TL 40 800 Td"]
+            + [f"({pdf_escape(line)}) Tj T*" for line in page_lines]
+            + ["ET"]
+        ).encode("latin-1", "replace")
+
+        objects[page_id] = (
+            f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] "
+            f"/Resources << /Font << /F1 3 0 R >> >> /Contents {page_id + 1} 0 R >>"
+        ).encode()
+        objects[page_id + 1] = b"<< /Length %d >>\nstream\n%s\nendstream" % (len(content), content)
+
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number in range(1, len(objects) + 1):
+        offsets.append(len(out))
+        out += b"%d 0 obj\n%s\nendobj\n" % (number, objects[number])
+
+    xref = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    for offset in offsets:
+        out += b"%010d 00000 n \n" % offset
+    out += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref)
+
+    return bytes(out)
+
+
+def generate_corpus(root, n_courses, docs_per_course=DOCS_PER_COURSE,
+                    paragraphs=PARAGRAPHS_PER_DOC, seed=SEED):
+    """
+    Write a synthetic Classroom dump (classroom_dump.jsonl), the Drive
+    files it references (drive/<file_id>: PDF, text/<file_id>: its text
+    layer) and each course's syllabus outline (topics.jsonl).
+    """
+    rng = random.Random(seed)
+    vocab = make_vocab(rng)
+
+    for folder in ("drive", "text"):
+        os.makedirs(os.path.join(root, folder), exist_ok=True)
+
+    n_documents = 0
+
+    with JsonlWriter(os.path.join(root, "classroom_dump.jsonl")) as dump, \
+            JsonlWriter(os.path.join(root, "topics.jsonl")) as topics_out:
+
+        for c in range(n_courses):
+            subject, prefix = SUBJECTS[c % len(SUBJECTS)]
+            gc_course_id = str(700000000000 + c)
+            code = f"{prefix} {100 + c % 400}"
+            course_name = f"2024 - {subject.upper()} - {code}"
+
+            materials = []
+            for d in range(docs_per_course):
+                file_id = f"bench-{c}-{d}"
+
+                if d == 0:
+                    title = f"{subject.replace(' ', '_')}_Syllabus.pdf"
+                    lines, topics = make_syllabus(rng, vocab, course_name, code)
+                    topics_out.write({"gc_course_id": gc_course_id, "topics": topics})
+                else:
+                    title = f"Unit_{(d - 1) % UNITS_PER_SYLLABUS + 1}_Lecture_{d}.pdf"
+                    lines = make_document(rng, vocab, title[:-4].replace("_", " "), paragraphs)
+
+                with open(os.path.join(root, "drive", file_id), "wb") as f:
+                    f.write(make_pdf(lines))
+                with open(os.path.join(root, "text", file_id), "w", encoding="utf-8") as f:
+                    f.write("\n".join(lines))
+
+                materials.append({
+                    "courseId": gc_course_id,
+                    "id": f"{gc_course_id}{d:03d}",
+                    "title": title,
+                    "materials": [{"driveFile": {"driveFile": {"id": file_id, "title": title}}}],
+                    "updateTime": f"2026-01-{d % 28 + 1:02d}T10:00:00.000Z",
+                })
+                n_documents += 1
+
+            dump.write({
+                "course": {
+                    "id": gc_course_id,
+                    "name": course_name,
+                    "section": "Sem : IV : CSE : I",
+                    "courseState": "ACTIVE",
+                },
+                "materials": materials,
+                "coursework": [
+                    {
+                        "id": f"{gc_course_id}9{w:02d}",
+                        "title": f"Assignment {w + 1}",
+                        "workType": "ASSIGNMENT",
+                        "maxPoints": 10,
+                        "dueDate": {"year": 2026, "month": 3, "day": w + 1},
+                    }
+                    for w in range(4)
+                ],
+                "announcements": [
+                    {"id": f"{gc_course_id}8{a:02d}", "text": text}
+                    for a, text in enumerate([
+                        "Slides for this week are uploaded",
+                        "Class test on unit 2 next Monday",
+                        "Mid semester exam syllabus: units 1-3",
+                    ])
+                ],
+            })
+
+    return {"courses": n_courses, "documents": n_documents}
+
+# =========================
+# STUB MODELS
+# =========================
+
+class StubEncoder:
+    """
+    Whitespace tokenizer with the tiktoken calls the chunker uses: one
+    token per word (with its leading whitespace), reversible.
+    """
+
+    def __init__(self):
+        self.vocab = {}
+        self.pieces = []
+
+    def _id(self, piece):
+        token = self.vocab.get(piece)
+        if token is None:
+            token = self.vocab[piece] = len(self.pieces)
+            self.pieces.append(piece)
+        return token
+
+    def encode_ordinary(self, text):
+        return [self._id(piece) for piece in re.findall(r"\s*\S+|\s+$", text)]
+
+    def encode_ordinary_batch(self, texts, num_threads=8):
+        return [self.encode_ordinary(text) for text in texts]
+
+    def decode_with_offsets(self, tokens):
+        offsets = []
+        position = 0
+        for token in tokens:
+            offsets.append(position)
+            position += len(self.pieces[token])
+        return "".join(self.pieces[token] for token in tokens), offsets
+
+
+class HashEmbedder:
+    """Signed feature-hashing bag of words: lexical similarity, no model."""
+
+    def __init__(self, dim=STUB_EMBED_DIM):
+        self.dim = dim
+
+    def encode(self, texts, batch_size=32, normalize_embeddings=False, **kwargs):
+        out = np.zeros((len(texts), self.dim), dtype=np.float32)
+
+        for i, text in enumerate(texts):
+            for word in text.lower().split():
+                h = zlib.crc32(word.encode("utf-8"))
+                out[i, h % self.dim] += 1.0 if h & 0x80000000 else -1.0
+
+        if normalize_embeddings:
+            out /= np.maximum(np.linalg.norm(out, axis=1, keepdims=True), 1e-12)
+        return out
+
+
+def load_encoder(kind):
+    if kind == "stub":
+        return StubEncoder()
+
+    import tiktoken
+    return tiktoken.get_encoding("cl100k_base")
+
+
+def load_bench_embedder(kind):
+    if kind == "stub":
+        return HashEmbedder()
+
+    from chunk_documents import load_embedder
+    return load_embedder(None)
+
+# =========================
+# STAGES (RUN IN A FRESH PROCESS EACH)
+# =========================
+
+def bench_normalize(root, options):
+    """Dump → course / document / assessment rows (the pure part of the upsert)."""
+    from normalize_classroom import build_rows, diff_rows
+
+    latencies = []
+    n_assessments = 0
+
+    with JsonlWriter(os.path.join(root, "documents.jsonl")) as out:
+        for block in iter_records(os.path.join(root, "classroom_dump.jsonl")):
+            start = time.perf_counter()
+            rows = build_rows([block])
+            diff_rows(rows["documents"], {}, ["title", "file_type"])
+            latencies.append(time.perf_counter() - start)
+
+            n_assessments += len(rows["assessments"])
+            gc_course_id = block["course"]["id"]
+            for doc in rows["documents"].values():
+                out.write({**doc, "gc_course_id": gc_course_id})
+
+    return latencies, {"assessments": n_assessments}
+
+
+def bench_parse(root, options):
+    """Fetch through the fake Drive (with retries) and parse each file."""
+    from document_parsers import elements_to_text, lines_to_elements, parse_bytes
+    from drive_download import with_retries
+    from fake_google import LocalDrive
+
+    drive = LocalDrive(os.path.join(root, "drive"), latency=options["drive_latency"])
+    latencies = []
+    n_chars = 0
+
+    with JsonlWriter(os.path.join(root, "parsed.jsonl")) as out:
+        for doc in iter_records(os.path.join(root, "documents.jsonl")):
+            start = time.perf_counter()
+            file_bytes = with_retries(drive, doc["drive_file_id"])
+
+            if options["parser"] == "stub":
+                # The text layer pdfplumber would return, minus PDF decoding
+                with open(os.path.join(root, "text", doc["drive_file_id"]), encoding="utf-8") as f:
+                    lines = f.read().splitlines()
+                raw_text = elements_to_text(lines_to_elements(lines))
+            else:
+                raw_text = parse_bytes(doc["file_type"], file_bytes)
+            latencies.append(time.perf_counter() - start)
+
+            n_chars += len(raw_text)
+            out.write({
+                "document_id": doc["id"],
+                "course_id": doc["course_id"],
+                "gc_course_id": doc["gc_course_id"],
+                "title": doc["title"],
+                "raw_text": raw_text,
+            })
+
+    return latencies, {"chars": n_chars}
+
+
+def bench_chunk(root, options):
+    import chunk_documents
+
+    encoder = load_encoder(options["tokenizer"])
+    chunk_documents.get_encoder = lambda: encoder
+
+    latencies = []
+    n_chunks = 0
+    n_tokens = 0
+
+    with JsonlWriter(os.path.join(root, "chunks.jsonl")) as out:
+        for doc in iter_records(os.path.join(root, "parsed.jsonl")):
+            start = time.perf_counter()
+            chunks = list(chunk_documents.chunk_text(doc["raw_text"]))
+            latencies.append(time.perf_counter() - start)
+
+            n_chunks += len(chunks)
+            n_tokens += sum(tokens for _, tokens in chunks)
+            out.write({
+                "document_id": doc["document_id"],
+                "course_id": doc["course_id"],
+                "gc_course_id": doc["gc_course_id"],
+                "syllabus": doc["title"].endswith("_Syllabus.pdf"),
+                "chunks": chunks,
+            })
+
+    return latencies, {"chunks": n_chunks, "tokens": n_tokens}
+
+
+def bench_map(root, options):
+    """Embed each course's topics once, then every document's chunks against them."""
+    from chunk_documents import map_chunks_to_topics
+
+    embedder = load_bench_embedder(options["embedder"])
+    topics = {
+        record["gc_course_id"]: record["topics"]
+        for record in iter_records(os.path.join(root, "topics.jsonl"))
+    }
+
+    # Documents arrive grouped by course: keep only the current course's topics
+    course = topic_embeds = None
+    latencies = []
+    n_mapped = 0
+
+    for doc in iter_records(os.path.join(root, "chunks.jsonl")):
+        if doc["syllabus"]:
+            continue
+
+        start = time.perf_counter()
+        if doc["gc_course_id"] != course:
+            course = doc["gc_course_id"]
+            topic_embeds = embedder.encode(topics[course], normalize_embeddings=True)
+
+        selections = map_chunks_to_topics(
+            embedder, [text for text, _ in doc["chunks"]], topic_embeds
+        )
+        latencies.append(time.perf_counter() - start)
+        n_mapped += sum(1 for selected in selections if selected)
+
+    return latencies, {"mapped_chunks": n_mapped}
+
+
+def bench_export(root, options):
+    """Write the export_chunks_for_colab.py records (the JSONL side of the export)."""
+    path = os.path.join(root, "export", "exported_chunks.jsonl")
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    latencies = []
+
+    with ShardedJsonlWriter(path, EXPORT_SHARD_SIZE) as writer:
+        for doc in iter_records(os.path.join(root, "chunks.jsonl")):
+            start = time.perf_counter()
+            for chunk_index, (text, _) in enumerate(doc["chunks"]):
+                writer.write({
+                    "chunk_id": f"{doc['document_id']}:{chunk_index}",
+                    "course_id": doc["course_id"],
+                    "document_id": doc["document_id"],
+                    "chunk_index": chunk_index,
+                    "text": text,
+                })
+            latencies.append(time.perf_counter() - start)
+
+    size = sum(os.path.getsize(p) for p in writer.paths)
+    return latencies, {"records": writer.count, "bytes": size}
+
+
+STAGE_RUNNERS = {
+    "normalize": bench_normalize,
+    "parse": bench_parse,
+    "chunk": bench_chunk,
+    "map": bench_map,
+    "export": bench_export,
+}
+
+
+def peak_rss_mb():
+    import resource
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def run_stage(stage, root, options):
+    """Entry point of the per-stage worker process."""
+    start = time.perf_counter()
+    latencies, extra = STAGE_RUNNERS[stage](root, options)
+    wall = time.perf_counter() - start
+
+    return summarize(latencies, wall, peak_rss_mb(), extra)
+
+
+def summarize(latencies, wall, peak_rss, extra):
+    latencies_ms = np.asarray(latencies) * 1000 if latencies else np.zeros(1)
+
+    return {
+        "items": len(latencies),
+        "wall_s": round(wall, 4),
+        "throughput_per_s": round(len(latencies) / wall, 2) if wall else None,
+        "p50_ms": round(float(np.percentile(latencies_ms, 50)), 3),
+        "p95_ms": round(float(np.percentile(latencies_ms, 95)), 3),
+        "peak_rss_mb": round(peak_rss, 1),
+        **extra,
+    }
+
+# =========================
+# BASELINE COMPARISON
+# =========================
+
+def compare(results, baseline, tolerance=REGRESSION_TOLERANCE):
+    """Regressions of `results` against `baseline` as readable lines."""
+    regressions = []
+
+    for stage, current in results["stages"].items():
+        before = baseline.get("stages", {}).get(stage)
+        if not before:
+            continue
+
+        checks = [
+            ("throughput_per_s", -1, "throughput"),
+            ("p95_ms", 1, "p95 latency"),
+            ("peak_rss_mb", 1, "peak RSS"),
+        ]
+        for key, direction, label in checks:
+            old, new = before.get(key), current.get(key)
+            if not old or new is None:
+                continue
+
+            change = (new - old) / old
+            if direction * change > tolerance:
+                regressions.append(f"{stage}: {label} {old} → {new} ({change:+.0%})")
+
+    return regressions
+
+
+def print_table(results, baseline=None):
+    print(f"\n{'stage':<10} {'items':>8} {'items/s':>10} {'p50 ms':>10} {'p95 ms':>10} {'RSS MB':>8}")
+
+    for stage, r in results["stages"].items():
+        line = (
+            f"{stage:<10} {r['items']:>8} {r['throughput_per_s']:>10} "
+            f"{r['p50_ms']:>10} {r['p95_ms']:>10} {r['peak_rss_mb']:>8}"
+        )
+        before = (baseline or {}).get("stages", {}).get(stage)
+        if before and before.get("throughput_per_s"):
+            change = r["throughput_per_s"] / before["throughput_per_s"] - 1
+            line += f"   ({change:+.0%} throughput vs baseline)"
+        print(line)
+
+# =========================
+# MAIN
+# =========================
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Benchmark the pipeline stages on a synthetic corpus"
+    )
+    parser.add_argument("--courses", type=int, default=DEFAULT_COURSES, help="synthetic courses (10 - 10000)")
+    parser.add_argument("--docs-per-course", type=int, default=DOCS_PER_COURSE)
+    parser.add_argument("--paragraphs", type=int, default=PARAGRAPHS_PER_DOC, help="paragraphs per document")
+    parser.add_argument("--stages", nargs="+", choices=STAGES, default=list(STAGES))
+    parser.add_argument("--parser", choices=["pdf", "stub"], default="pdf",
+                        help="pdf: real pdfplumber fast tier; stub: read the text layer directly")
+    parser.add_argument("--tokenizer", choices=["tiktoken", "stub"], default="tiktoken")
+    parser.add_argument("--embedder", choices=["stub", "minilm"], default="stub")
+    parser.add_argument("--drive-latency", type=float, default=0.0, help="seconds added per fake Drive request")
+    parser.add_argument("--workdir", help="keep the corpus and stage outputs here (default: temp dir, removed)")
+    parser.add_argument("--output", default=RESULTS_PATH)
+    parser.add_argument("--baseline", default=BASELINE_PATH, help="compare against this results file if it exists")
+    parser.add_argument("--save-baseline", action="store_true", help="also store these results as the baseline")
+    parser.add_argument("--tolerance", type=float, default=REGRESSION_TOLERANCE)
+    args = parser.parse_args(argv)
+
+    options = {
+        "parser": args.parser,
+        "tokenizer": args.tokenizer,
+        "embedder": args.embedder,
+        "drive_latency": args.drive_latency,
+    }
+    config = {
+        "courses": args.courses,
+        "docs_per_course": args.docs_per_course,
+        "paragraphs": args.paragraphs,
+        "seed": SEED,
+        **options,
+    }
+
+    root = args.workdir or tempfile.mkdtemp(prefix="acm_ai_bench_")
+    os.makedirs(root, exist_ok=True)
+
+    try:
+        start = time.perf_counter()
+        counts = generate_corpus(root, args.courses, args.docs_per_course, args.paragraphs)
+        print(f"✔ Generated {counts['courses']} courses, {counts['documents']} documents "
+              f"in {time.perf_counter() - start:.1f}s ({root})")
+
+        # Stages read the previous stage's output, so run them in order
+        stages = [stage for stage in STAGES if stage in args.stages]
+        results = {
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "config": config,
+            "machine": {
+                "platform": platform.platform(),
+                "python": platform.python_version(),
+                "cpus": os.cpu_count(),
+            },
+            "stages": {},
+        }
+
+        # A fresh process per stage: its peak RSS is the stage's own
+        context = multiprocessing.get_context("spawn")
+        for stage in stages:
+            with context.Pool(1) as pool:
+                results["stages"][stage] = pool.apply(run_stage, (stage, root, options))
+            print(f"✔ {stage}: {results['stages'][stage]['wall_s']}s")
+    finally:
+        if not args.workdir:
+            shutil.rmtree(root, ignore_errors=True)
+
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+
+    baseline = None
+    if args.baseline and os.path.exists(args.baseline) and not args.save_baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+        if baseline.get("config") != config:
+            print(f"\nBaseline {args.baseline} used a different config; not comparing")
+            baseline = None
+
+    print_table(results, baseline)
+    print(f"\nResults written to {args.output}")
+
+    if args.save_baseline:
+        shutil.copyfile(args.output, args.baseline)
+        print(f"✔ Stored as baseline {args.baseline}")
+
+    if baseline is not None:
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            print(f"\nRegressions beyond {args.tolerance:.0%}:")
+            for line in regressions:
+                print(f"  {line}")
+            return 1
+        print(f"\n✔ No regressions beyond {args.tolerance:.0%} against {args.baseline}")
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,12 +1,18 @@
+import re
 import uuid
-import psycopg2
+import bisect
+import argparse
+import functools
+import itertools
 from datetime import datetime
-import tiktoken
+
 import numpy as np
-from sentence_transformers import SentenceTransformer
-import os 
-import cohere 
-from sklearn.metrics.pairwise import cosine_similarity
+import psycopg2
+from psycopg2.extras import execute_values
+
+from embedding_store import CachedEmbedder, ensure_embeddings_table
+from lexical_index import LEXICAL_INDEX_PATH, index_rows, open_lexical_index
+from model_client import MODEL_SERVER_URL, ModelClient
 
 # =========================
 # CONFIG
@@ -20,185 +26,466 @@ DB_CONFIG = {
     "port": 5432,
 }
 
+EMBED_MODEL_NAME = "sentence-transformers/all-MiniLM-L6-v2"
+
 TARGET_TOKENS = 350
-MAX_TOKENS = 500
+MAX_TOKENS = 500  # longer paragraphs are split into sentences, then token runs
+
+# Section starts (from parse_documents.elements_to_text) and, optionally,
+# drops in adjacent-unit embedding similarity close a chunk early, but
+# only once it holds MIN_CHUNK_TOKENS
+SECTION_MARKERS = ("[TITLE]", "[TABLE]")
+MIN_CHUNK_TOKENS = 100
+SEMANTIC_SPLIT_THRESHOLD = 0.3
+
+SENTENCE_RE = re.compile(r"(?<=[.!?])\s+")
 
 TOPIC_TOP_1_THRESHOLD = 0.58
 TOPIC_TOP_2_THRESHOLD = 0.46
 DELTA_THRESHOLD = 0.05
 MAX_TOPICS_PER_CHUNK = 2
 
+# Only these document roles are mapped to syllabus topics
+TOPIC_MAPPED_ROLES = ("study_material", "unknown")
+
+EMBED_BATCH_SIZE = 64
+TOKENIZE_BATCH_SIZE = 256  # paragraphs per encode_ordinary_batch call
+INSERT_BATCH_SIZE = 500  # buffered chunk rows per bulk INSERT
+
 # =========================
-# TOKENIZER
+# TOKENIZER / EMBEDDER
 # =========================
 
-client = cohere.ClientV2(api_key= os.getenv("COHERE_API_KEY"))
+@functools.lru_cache(maxsize=None)
+def get_encoder():
+    import tiktoken
+    return tiktoken.get_encoding("cl100k_base")
 
-encoder = tiktoken.get_encoding("cl100k_base")
 
 def count_tokens(text: str) -> int:
-    return len(encoder.encode(text))
+    return len(get_encoder().encode_ordinary(text))
 
 
-embedder = SentenceTransformer("sentence-transformers/all-MiniLM-L6-v2")
+@functools.lru_cache(maxsize=None)
+def load_embedder(server_url=MODEL_SERVER_URL):
+    """A running model_server.py serves the same model without loading it here."""
+    if server_url:
+        return ModelClient(server_url)
 
-# =========================
-# DB CONNECTION
-# =========================
-
-conn = psycopg2.connect(**DB_CONFIG)
-cur = conn.cursor()
+    from sentence_transformers import SentenceTransformer
+    return SentenceTransformer(EMBED_MODEL_NAME)
 
 # =========================
 # LOAD TOPICS (CACHE PER COURSE)
 # =========================
 
-cur.execute("""
-    SELECT t.id, t.course_id, u.name, t.name
-    FROM topics t
-    JOIN units u ON t.unit_id = u.id
-""")
-
-topics_by_course = {}
-
-for topic_id, course_id, unit_name, topic_name in cur.fetchall():
-    rep = f"{unit_name} → {topic_name}"
-    topics_by_course.setdefault(course_id, []).append({
-        "topic_id": topic_id,
-        "text": rep
-    })
-
-# Precompute topic embeddings
-topic_embeddings = {}
-for course_id, topics in topics_by_course.items():
-    texts = [t["text"] for t in topics]
-    embeds = embedder.encode(texts, normalize_embeddings=True)
-    topic_embeddings[course_id] = embeds
-
-print("✔ Topics loaded and embedded")
+def load_topics(cur, embedder, course_id=None):
+    """
+    Topics of every course (or just `course_id`) as
+    {course_id: [{"topic_id", "text"}]}, plus their precomputed,
+    L2-normalized embeddings per course.
+    """
+    cur.execute("""
+        SELECT t.id, t.course_id, u.name, t.name
+        FROM topics t
+        JOIN units u ON t.unit_id = u.id
+        WHERE %(course_id)s IS NULL OR t.course_id = %(course_id)s
+        ORDER BY t.course_id, u.order_index, t.order_index, t.id
+    """, {"course_id": course_id})
+
+    topics_by_course = {}
+
+    for topic_id, course_id, unit_name, topic_name in cur.fetchall():
+        rep = f"{unit_name} → {topic_name}"
+        topics_by_course.setdefault(course_id, []).append({
+            "topic_id": topic_id,
+            "text": rep
+        })
+
+    topic_embeddings = {}
+    for course_id, topics in topics_by_course.items():
+        texts = [t["text"] for t in topics]
+        topic_embeddings[course_id] = embedder.encode(texts, normalize_embeddings=True)
+
+    return topics_by_course, topic_embeddings
 
 # =========================
-# FETCH DOCUMENTS
+# TOPIC MAPPING
 # =========================
 
-cur.execute("""
-    SELECT id, course_id, role, raw_text
-    FROM documents
-    WHERE parsed = TRUE
-      AND raw_text IS NOT NULL
-""")
+def select_topics(sims):
+    """
+    Apply the top-1 / top-2 threshold rules to a (chunks x topics)
+    similarity matrix. Returns one list of (topic_idx, score) per chunk.
+    """
+    n_topics = sims.shape[1]
+
+    if n_topics > 1:
+        # Unordered top-2 per row, then order the pair by score
+        top2 = np.argpartition(-sims, 1, axis=1)[:, :2]
+        top2_scores = np.take_along_axis(sims, top2, axis=1)
+        order = np.argsort(-top2_scores, axis=1)
+        top2 = np.take_along_axis(top2, order, axis=1)
+        top2_scores = np.take_along_axis(top2_scores, order, axis=1)
+    else:
+        top2 = np.zeros((sims.shape[0], 1), dtype=int)
+        top2_scores = sims[:, :1]
+
+    selections = []
+
+    for idxs, scores in zip(top2, top2_scores):
+        selected = []
+
+        if scores[0] >= TOPIC_TOP_1_THRESHOLD:
+            selected.append((int(idxs[0]), float(scores[0])))
+
+        if (
+            len(scores) > 1
+            and scores[1] >= TOPIC_TOP_2_THRESHOLD
+            and abs(scores[0] - scores[1]) <= DELTA_THRESHOLD
+        ):
+            selected.append((int(idxs[1]), float(scores[1])))
+
+        selections.append(selected[:MAX_TOPICS_PER_CHUNK])
+
+    return selections
+
+
+def map_chunks_to_topics(embedder, chunk_texts, topic_embeds):
+    """
+    Embed all chunks of a document in one batched call and score them
+    against the cached topic embeddings of the course.
+    """
+    if not chunk_texts:
+        return []
+
+    chunk_embeds = embedder.encode(
+        chunk_texts,
+        batch_size=EMBED_BATCH_SIZE,
+        normalize_embeddings=True
+    )
+
+    # Both sides are L2-normalized, so the dot product is the cosine
+    sims = chunk_embeds @ topic_embeds.T
 
-documents = cur.fetchall()
-print(f"Found {len(documents)} documents to chunk")
+    return select_topics(sims)
 
 # =========================
-# CHUNK + MAP
+# CHUNKING
 # =========================
 
-for document_id, course_id, role, raw_text in documents:
-    print(f"\nProcessing document {document_id} ({role})")
-
-    # Skip if chunks already exist
-    cur.execute(
-        "SELECT 1 FROM chunks WHERE document_id = %s LIMIT 1",
-        (document_id,)
-    )
-    if cur.fetchone():
-        print("→ Chunks already exist, skipping")
-        continue
-
-    paragraphs = [p.strip() for p in raw_text.split("\n") if p.strip()]
+def iter_batches(items, size):
+    items = iter(items)
+    while True:
+        batch = list(itertools.islice(items, size))
+        if not batch:
+            return
+        yield batch
+
+
+def iter_paragraphs(raw_text):
+    """Stripped non-empty lines of raw_text, without splitting it into a list."""
+    start = 0
+    while start < len(raw_text):
+        end = raw_text.find("\n", start)
+        if end == -1:
+            end = len(raw_text)
+
+        line = raw_text[start:end].strip()
+        if line:
+            yield line
+        start = end + 1
+
+
+def tokenize_paragraphs(paragraphs):
+    """Stream (paragraph, tokens), tokenizing TOKENIZE_BATCH_SIZE paragraphs per call."""
+    encoder = get_encoder()
+    for batch in iter_batches(paragraphs, TOKENIZE_BATCH_SIZE):
+        yield from zip(batch, encoder.encode_ordinary_batch(batch))
+
+
+def split_paragraph(para, tokens):
+    """
+    An oversize paragraph as sentences, and over-long sentences as runs of
+    TARGET_TOKENS tokens. Pieces are cut from `para` at the tokens' character
+    offsets, so nothing is encoded or decoded again.
+    """
+    if len(tokens) <= MAX_TOKENS:
+        yield para, len(tokens)
+        return
+
+    _, offsets = get_encoder().decode_with_offsets(tokens)
+
+    # Sentence i spans characters cuts[i]:cuts[i + 1] and tokens starts[i]:starts[i + 1]
+    cuts = [0] + [m.start() for m in SENTENCE_RE.finditer(para)] + [len(para)]
+    starts = [bisect.bisect_left(offsets, cut) for cut in cuts[:-1]] + [len(tokens)]
+
+    for i in range(len(cuts) - 1):
+        first, last = starts[i], starts[i + 1]
+
+        if last - first <= TARGET_TOKENS:
+            piece = para[cuts[i]:cuts[i + 1]].strip()
+            if piece:
+                yield piece, last - first
+            continue
+
+        for run in range(first, last, TARGET_TOKENS):
+            run_end = min(run + TARGET_TOKENS, last)
+            char_start = cuts[i] if run == first else offsets[run]
+            char_end = offsets[run_end] if run_end < len(tokens) else len(para)
+
+            piece = para[char_start:min(char_end, cuts[i + 1])].strip()
+            if piece:
+                yield piece, run_end - run
+
+
+def iter_units(raw_text):
+    """
+    Stream (text, tokens, boundary) packing units: paragraphs, or pieces
+    of oversize ones. `boundary` marks a section start, where a new chunk
+    should begin. Every paragraph is tokenized exactly once.
+    """
+    for para, tokens in tokenize_paragraphs(iter_paragraphs(raw_text)):
+        section_start = para.startswith(SECTION_MARKERS)
+
+        for i, (piece, n_tokens) in enumerate(split_paragraph(para, tokens)):
+            yield piece, n_tokens, section_start and i == 0
+
+
+def mark_semantic_boundaries(units, embedder):
+    """
+    Also mark a boundary where the embedding similarity of adjacent
+    units drops below SEMANTIC_SPLIT_THRESHOLD. Units are embedded in
+    batches as they stream through.
+    """
+    previous = None
+
+    for batch in iter_batches(units, EMBED_BATCH_SIZE):
+        embeds = embedder.encode(
+            [text for text, _, _ in batch],
+            batch_size=EMBED_BATCH_SIZE,
+            normalize_embeddings=True
+        )
+
+        for (text, tokens, boundary), embed in zip(batch, embeds):
+            if previous is not None and float(embed @ previous) < SEMANTIC_SPLIT_THRESHOLD:
+                boundary = True
+            previous = embed
+            yield text, tokens, boundary
+
+
+def chunk_text(raw_text, boundary_embedder=None):
+    """
+    Stream chunks of up to TARGET_TOKENS as (text, tokens) pairs. Nothing
+    is dropped: oversize paragraphs are split, and the last chunk is
+    flushed. With `boundary_embedder`, chunks also break on topic shifts.
+    """
+    units = iter_units(raw_text)
+    if boundary_embedder is not None:
+        units = mark_semantic_boundaries(units, boundary_embedder)
 
     current_chunk = []
     current_tokens = 0
+
+    for text, tokens, boundary in units:
+        if current_chunk and (
+            current_tokens + tokens > TARGET_TOKENS
+            or (boundary and current_tokens >= MIN_CHUNK_TOKENS)
+        ):
+            yield "\n".join(current_chunk), current_tokens
+            current_chunk = []
+            current_tokens = 0
+
+        current_chunk.append(text)
+        current_tokens += tokens
+
+    if current_chunk:
+        yield "\n".join(current_chunk), current_tokens
+
+
+def iter_rows(document_id, course_id, role, raw_text, embedder,
+              topics=None, topic_embeds=None, boundary_embedder=None):
+    """
+    Chunk one document and map its chunks to the course topics, yielding
+    the chunks and chunk_topic_map rows to insert one embedding batch at
+    a time.
+    """
+    chunks = chunk_text(raw_text, boundary_embedder)
     chunk_index = 0
 
-    for para in paragraphs:
-        para_tokens = count_tokens(para)
+    for batch in iter_batches(chunks, EMBED_BATCH_SIZE):
+        # MAP TO TOPICS (ONLY STUDY MATERIAL)
+        if role in TOPIC_MAPPED_ROLES and topics:
+            selections = map_chunks_to_topics(
+                embedder, [text for text, _ in batch], topic_embeds
+            )
+        else:
+            selections = [[] for _ in batch]
 
-        if para_tokens > MAX_TOKENS:
-            continue  # drop pathological paragraphs
+        chunk_rows = []
+        map_rows = []
 
-        if current_tokens + para_tokens <= TARGET_TOKENS:
-            current_chunk.append(para)
-            current_tokens += para_tokens
-        else:
-            chunk_text = "\n".join(current_chunk)
+        for (text, token_count), selected in zip(batch, selections):
             chunk_id = str(uuid.uuid4())
 
-            # INSERT CHUNK
-            cur.execute("""
-                INSERT INTO chunks (
-                    id, document_id, course_id,
-                    chunk_index, text, token_count, created_at
-                )
-                VALUES (%s, %s, %s, %s, %s, %s, %s)
-            """, (
+            chunk_rows.append((
                 chunk_id, document_id, course_id,
-                chunk_index, chunk_text,
-                current_tokens, datetime.now()
+                chunk_index, text,
+                token_count, datetime.now()
             ))
 
-            # MAP TO TOPICS (ONLY STUDY MATERIAL)
-            if ((role == "study_material") or (role == "unknown")) and course_id in topics_by_course:
-                print("DEBUG: INIDE TOPIC CHUNK MAPPING")
-                chunk_embed = embedder.encode(
-                    [chunk_text], normalize_embeddings=True
-                )
-                sims = cosine_similarity(
-                    chunk_embed, topic_embeddings[course_id]
-                )[0]
-
-                ranked = sorted(
-                    enumerate(sims),
-                    key=lambda x: x[1],
-                    reverse=True
-                )
-
-                selected = []
-
-                if ranked and ranked[0][1] >= TOPIC_TOP_1_THRESHOLD:
-                    selected.append(ranked[0])
-
-                if (
-                    len(ranked) > 1
-                    and ranked[1][1] >= TOPIC_TOP_2_THRESHOLD
-                    and abs(ranked[0][1] - ranked[1][1]) <= DELTA_THRESHOLD
-                ):
-                    selected.append(ranked[1])
-
-                print("Ranked similarities:", ranked)
+            if selected:
                 print("Selected topics for chunk", chunk_index, ":", selected)
-                
-                for rank, (idx, score) in enumerate(selected[:MAX_TOPICS_PER_CHUNK], start=1):
-                    topic_id = topics_by_course[course_id][idx]["topic_id"]
-                    cur.execute("""
-                        INSERT INTO chunk_topic_map (
-                            id, chunk_id, topic_id,
-                            similarity_score, rank, inferred, created_at
-                        )
-                        VALUES (%s, %s, %s, %s, %s, TRUE, %s)
-                    """, (
-                        str(uuid.uuid4()),
-                        chunk_id,
-                        topic_id,
-                        float(score),
-                        rank,
-                        datetime.now()
-                    ))
+
+            for rank, (idx, score) in enumerate(selected, start=1):
+                map_rows.append((
+                    str(uuid.uuid4()),
+                    chunk_id,
+                    topics[idx]["topic_id"],
+                    score,
+                    rank,
+                    datetime.now()
+                ))
 
             chunk_index += 1
-            current_chunk = [para]
-            current_tokens = para_tokens
 
-    conn.commit()
-    print("✔ Done")
+        yield chunk_rows, map_rows
+
+
+def build_rows(document_id, course_id, role, raw_text, embedder,
+               topics=None, topic_embeds=None, boundary_embedder=None):
+    """All chunk and chunk_topic_map rows of one document."""
+    chunk_rows = []
+    map_rows = []
+
+    for batch_chunk_rows, batch_map_rows in iter_rows(
+        document_id, course_id, role, raw_text, embedder,
+        topics, topic_embeds, boundary_embedder
+    ):
+        chunk_rows.extend(batch_chunk_rows)
+        map_rows.extend(batch_map_rows)
+
+    return chunk_rows, map_rows
 
 # =========================
-# CLEANUP
+# BULK WRITES
 # =========================
 
-cur.close()
-conn.close()
-print("\nChunking + mapping completed successfully")
+def flush_rows(cur, chunk_rows, map_rows):
+    """
+    Write buffered chunk and chunk_topic_map rows with one multi-row
+    INSERT per table. Chunks go first so the mapping FKs resolve.
+    """
+    if chunk_rows:
+        execute_values(cur, """
+            INSERT INTO chunks (
+                id, document_id, course_id,
+                chunk_index, text, token_count, created_at
+            )
+            VALUES %s
+        """, chunk_rows, page_size=INSERT_BATCH_SIZE)
+        chunk_rows.clear()
+
+    if map_rows:
+        execute_values(cur, """
+            INSERT INTO chunk_topic_map (
+                id, chunk_id, topic_id,
+                similarity_score, rank, inferred, created_at
+            )
+            VALUES %s
+        """, map_rows, template="(%s, %s, %s, %s, %s, TRUE, %s)",
+            page_size=INSERT_BATCH_SIZE)
+        map_rows.clear()
+
+# =========================
+# MAIN
+# =========================
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Chunk parsed documents and map chunks to syllabus topics")
+    parser.add_argument(
+        "--server", default=MODEL_SERVER_URL,
+        help="embed through a running model_server.py instead of loading the model"
+    )
+    parser.add_argument(
+        "--no-lexical-index", action="store_true",
+        help=f"don't update the BM25 index ({LEXICAL_INDEX_PATH}) with the new chunks"
+    )
+    parser.add_argument(
+        "--semantic-boundaries", action="store_true",
+        help="also break chunks where adjacent paragraph embeddings diverge"
+    )
+    args = parser.parse_args(argv)
+
+    conn = psycopg2.connect(**DB_CONFIG)
+    cur = conn.cursor()
+
+    # Vectors computed on earlier runs are read back instead of re-encoded
+    ensure_embeddings_table(cur)
+    conn.commit()
+    embedder = CachedEmbedder(load_embedder(args.server), conn, EMBED_MODEL_NAME)
+
+    # Boundary embeddings are throwaway, so they bypass the store
+    boundary_embedder = embedder.embedder if args.semantic_boundaries else None
+
+    # Opening syncs the saved index with chunks written since it was saved
+    lexical = None if args.no_lexical_index else open_lexical_index(conn)
+
+    topics_by_course, topic_embeddings = load_topics(cur, embedder)
+    print("✔ Topics loaded and embedded")
+
+    # Texts are fetched one document at a time
+    cur.execute("""
+        SELECT id, course_id, role
+        FROM documents
+        WHERE parsed = TRUE
+          AND raw_text IS NOT NULL
+    """)
+
+    documents = cur.fetchall()
+    print(f"Found {len(documents)} documents to chunk")
+
+    # One round-trip instead of a lookup per document
+    cur.execute("SELECT DISTINCT document_id FROM chunks")
+    chunked_document_ids = {row[0] for row in cur.fetchall()}
+
+    for document_id, course_id, role in documents:
+        print(f"\nProcessing document {document_id} ({role})")
+
+        # Skip if chunks already exist
+        if document_id in chunked_document_ids:
+            print("→ Chunks already exist, skipping")
+            continue
+
+        cur.execute("SELECT raw_text FROM documents WHERE id = %s", (document_id,))
+        raw_text = cur.fetchone()[0]
+        n_chunks = 0
+
+        for chunk_rows, map_rows in iter_rows(
+            document_id, course_id, role, raw_text, embedder,
+            topics_by_course.get(course_id), topic_embeddings.get(course_id),
+            boundary_embedder
+        ):
+            if lexical is not None:
+                index_rows(lexical, chunk_rows, map_rows, role)
+            n_chunks += len(chunk_rows)
+
+            # execute_values pages the rows by INSERT_BATCH_SIZE
+            flush_rows(cur, chunk_rows, map_rows)
+
+        conn.commit()
+        print(f"✔ Done ({n_chunks} chunks)")
+
+    print(f"\nEmbeddings: {embedder.hits} reused, {embedder.misses} computed")
+
+    if lexical is not None:
+        lexical.save()
+        print(f"✔ BM25 index saved ({len(lexical)} chunks)")
+
+    cur.close()
+    conn.close()
+    print("\nChunking + mapping completed successfully")
+
 
+if __name__ == "__main__":
+    main()
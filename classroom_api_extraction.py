@@ -1,10 +1,12 @@
 import os
-import json
+import argparse
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from google.auth.transport.requests import Request
-from google.oauth2.credentials import Credentials
-from google_auth_oauthlib.flow import InstalledAppFlow
-from googleapiclient.discovery import build
+
+from drive_download import with_retries
+from jsonl_io import JsonlWriter, iter_records
 
 SCOPES = [
     "https://www.googleapis.com/auth/classroom.courses.readonly",
@@ -14,7 +16,24 @@ SCOPES = [
     "https://www.googleapis.com/auth/drive.readonly"
 ]
 
+OUTPUT_PATH = "classroom_dump.jsonl"
+
+PAGE_SIZE = 100
+FETCH_WORKERS = 8
+
+# dump key -> (courses() sub-resource, response list key)
+COLLECTIONS = {
+    "announcements": ("announcements", "announcements"),
+    "materials": ("courseWorkMaterials", "courseWorkMaterial"),
+    "coursework": ("courseWork", "courseWork"),
+}
+
+
 def authenticate():
+    from google.auth.transport.requests import Request
+    from google.oauth2.credentials import Credentials
+    from google_auth_oauthlib.flow import InstalledAppFlow
+
     creds = None
     if os.path.exists("token.json"):
         creds = Credentials.from_authorized_user_file("token.json", SCOPES)
@@ -31,7 +50,29 @@ def authenticate():
         with open("token.json", "w") as token:
             token.write(creds.to_json())
 
-    return build("classroom", "v1", credentials=creds)
+    return creds
+
+
+class ClassroomServices:
+    """
+    Hands out one Classroom client per thread; the httplib2 transport
+    behind googleapiclient is not thread-safe.
+    """
+
+    def __init__(self, creds):
+        self.creds = creds
+        self._local = threading.local()
+
+    def __call__(self):
+        if not hasattr(self._local, "service"):
+            from googleapiclient.discovery import build
+
+            self._local.service = build(
+                "classroom", "v1",
+                credentials=self.creds,
+                cache_discovery=False
+            )
+        return self._local.service
 
 
 def parse_due_datetime(coursework):
@@ -50,65 +91,185 @@ def parse_due_datetime(coursework):
     )
 
 
-def extract_classroom_data(service):
-    courses = service.courses().list(courseStates=["ACTIVE"]).execute().get("courses", [])
+def parse_update_time(item):
+    return datetime.fromisoformat(item["updateTime"].replace("Z", "+00:00"))
+
+
+def is_tracked_course(course):
+    section = course.get("section", "")
+    name = course.get("name", "")
+
+    return (
+        section == "Sem : IV :  CSE : I"
+        or "open elective" in section.lower()
+        or name.lower().startswith("oe")
+    )
+
+# =========================
+# PAGINATION
+# =========================
+
+def list_all(list_method, key, since=None, **params):
+    """
+    Follow nextPageToken until the collection is exhausted.
+
+    With `since`, items are requested newest first and paging stops at
+    the first item not updated after `since`.
+    """
+    items = []
+    page_token = None
+
+    if since is not None:
+        params["orderBy"] = "updateTime desc"
+
+    while True:
+        request = list_method(pageSize=PAGE_SIZE, pageToken=page_token, **params)
+        response = with_retries(request.execute)
 
-    extracted = []
+        for item in response.get(key, []):
+            if since is not None and parse_update_time(item) <= since:
+                return items
+            items.append(item)
 
-    for course in courses:
-        course_id = course["id"]
+        page_token = response.get("nextPageToken")
+        if not page_token:
+            return items
 
-        section = course.get("section", "")
-        name = course.get("name", "")
+# =========================
+# DELTA SYNC
+# =========================
 
-        if not (
-            section == "Sem : IV :  CSE : I"
-            or "open elective" in section.lower()
-            or name.lower().startswith("oe")
-        ):
-            continue
+def latest_update(items):
+    return max((parse_update_time(item) for item in items), default=None)
 
-        print(f"\n📘 Course: {name}")
 
-        announcements = service.courses().announcements().list(
-            courseId=course_id
-        ).execute().get("announcements", [])
+def merge_delta(previous_items, changed_items):
+    """
+    Replace previous items by ID with their changed versions, newest
+    first. Deletions are not visible through updateTime; a full run
+    picks them up.
+    """
+    changed_ids = {item["id"] for item in changed_items}
+    merged = changed_items + [
+        item for item in previous_items if item["id"] not in changed_ids
+    ]
+    return sorted(merged, key=parse_update_time, reverse=True)
 
-        materials = service.courses().courseWorkMaterials().list(
-            courseId=course_id
-        ).execute().get("courseWorkMaterial", [])
+# =========================
+# EXTRACTION
+# =========================
 
-        coursework_items = service.courses().courseWork().list(
-            courseId=course_id
-        ).execute().get("courseWork", [])
+def fetch_collection(services, course_id, collection, since=None):
+    resource, key = COLLECTIONS[collection]
+    list_method = getattr(services().courses(), resource)().list
+    return list_all(list_method, key, since=since, courseId=course_id)
 
-        extracted.append({
-            "course": course,
-            "announcements": announcements,
-            "materials": materials,
-            "coursework": coursework_items
-        })
 
-        print(f"  Announcements: {len(announcements)}")
-        print(f"  Materials: {len(materials)}")
-        print(f"  Coursework items: {len(coursework_items)}")
+def extract_classroom_data(services, previous=None, workers=FETCH_WORKERS):
+    """
+    Fetch every tracked course with all three collections, fully paginated,
+    running the (course, collection) requests concurrently. Yields one
+    block per course, in course order, as soon as it is complete.
 
-        for cw in coursework_items:
+    `services` is a callable returning a Classroom client for the current
+    thread. With `previous` (course ID -> block from an earlier dump) only
+    items updated since that dump are fetched and merged in.
+    """
+    previous = previous or {}
+
+    courses = list_all(
+        services().courses().list, "courses", courseStates=["ACTIVE"]
+    )
+    courses = [course for course in courses if is_tracked_course(course)]
+
+    def submit(pool, course):
+        previous_block = previous.get(course["id"])
+        futures = {}
+
+        for collection in COLLECTIONS:
+            since = None
+            if previous_block is not None:
+                since = latest_update(previous_block.get(collection, []))
+
+            futures[collection] = pool.submit(
+                fetch_collection, services, course["id"], collection, since
+            )
+
+        return course, futures
+
+    def assemble(course, futures):
+        block = {"course": course}
+        previous_block = previous.get(course["id"])
+
+        for collection, future in futures.items():
+            items = future.result()
+
+            if previous_block is not None:
+                items = merge_delta(previous_block.get(collection, []), items)
+
+            block[collection] = items
+
+        print(f"\n📘 Course: {course.get('name', '')}")
+        print(f"  Announcements: {len(block['announcements'])}")
+        print(f"  Materials: {len(block['materials'])}")
+        print(f"  Coursework items: {len(block['coursework'])}")
+
+        for cw in block["coursework"]:
             due = parse_due_datetime(cw)
             print(f" {cw['title']} | Due: {due}")
 
-    return extracted
+        return block
+
+    # Only a window of courses is in flight, so memory stays flat
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        pending = deque()
+
+        for course in courses:
+            pending.append(submit(pool, course))
+
+            if len(pending) >= workers:
+                yield assemble(*pending.popleft())
+
+        while pending:
+            yield assemble(*pending.popleft())
+
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Dump Google Classroom data")
+    parser.add_argument("--output", default=OUTPUT_PATH)
+    parser.add_argument("--workers", type=int, default=FETCH_WORKERS)
+    parser.add_argument(
+        "--delta", action="store_true",
+        help="only fetch items updated since the existing dump at --output"
+    )
+    args = parser.parse_args(argv)
 
+    previous = None
+    if args.delta and os.path.exists(args.output):
+        # Fully read before the same path is rewritten below
+        previous = {block["course"]["id"]: block for block in iter_records(args.output)}
+        print(f"Delta sync against {len(previous)} courses in {args.output}")
 
+    services = ClassroomServices(authenticate())
 
-def main():
-    service = authenticate()
-    data = extract_classroom_data(service)
+    # One course per line, written as soon as it is fetched, into a temp
+    # file that replaces the dump only once the crawl has finished. The
+    # name keeps the suffix, so .gz / .zst output stays compressed.
+    directory, name = os.path.split(os.path.abspath(args.output))
+    tmp_path = os.path.join(directory, f".tmp-{name}")
 
-    with open("classroom_dump.json", "w") as f:
-        json.dump(data, f, indent=2, default=str)
+    try:
+        with JsonlWriter(tmp_path) as writer:
+            for block in extract_classroom_data(services, previous=previous, workers=args.workers):
+                writer.write(block)
+        os.replace(tmp_path, args.output)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
 
-    print(" Data saved to classroom_dump.json")
+    print(f" {writer.count} courses saved to {args.output}")
 
 
 
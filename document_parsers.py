@@ -0,0 +1,211 @@
+import os
+import re
+import tempfile
+from collections import namedtuple
+
+# pdfplumber and unstructured are imported inside the parsers: unstructured
+# alone takes seconds to import, and most runs never need all three
+
+# =========================
+# CONFIG
+# =========================
+
+# Routed to their own worker pool so they don't hold up quick files
+HEAVY_FILE_TYPES = {"pdf"}
+
+# Fast text-layer tier for PDFs; escalate to hi_res below these
+FAST_PDF_ENABLED = True
+FAST_PDF_MIN_CHARS_PER_PAGE = 200
+FAST_PDF_MAX_GARBLED_RATIO = 0.02
+
+# =========================
+# TEXT FORMAT
+# =========================
+
+def elements_to_text(elements):
+    """
+    Convert unstructured elements into a clean, LLM-friendly text
+    with semantic tags preserved.
+    """
+    lines = []
+
+    for el in elements:
+        text = el.text.strip() if el.text else ""
+        if not text:
+            continue
+
+        category = el.category.upper()
+        lines.append(f"[{category}] {text}")
+
+    return "\n".join(lines)
+
+# =========================
+# FAST PDF TIER (TEXT LAYER)
+# =========================
+
+# Same shape as an unstructured element, enough for elements_to_text
+TextElement = namedtuple("TextElement", ["category", "text"])
+
+LIST_ITEM_RE = re.compile(r"^\s*([•●▪◦\-\*–]|\(?\d{1,2}[.)]|\(?[a-z][.)])\s+")
+SENTENCE_END = (".", ":", ";", "?", "!")
+
+
+def garbled_ratio(text):
+    """Share of characters that are unmapped glyphs or control codes."""
+    if not text:
+        return 1.0
+
+    bad = text.count("\ufffd") + 5 * text.count("(cid:")
+    bad += sum(1 for ch in text if ord(ch) < 32 and ch not in "\n\t")
+    return bad / len(text)
+
+
+def classify_line(line):
+    if LIST_ITEM_RE.match(line):
+        return "ListItem"
+
+    if (
+        len(line) <= 80
+        and len(line.split()) <= 12
+        and not line.endswith(SENTENCE_END + (",",))
+        and line[0].isupper()
+    ):
+        return "Title"
+
+    return "NarrativeText"
+
+
+def lines_to_elements(lines):
+    """
+    Rebuild paragraphs from text-layer lines: a line starting in lower
+    case continues the previous line unless that one ended a sentence.
+    A wrapped "title" is really the first line of a paragraph.
+    """
+    elements = []
+
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+
+        prev = elements[-1] if elements else None
+        if (
+            prev is not None
+            and line[0].islower()
+            and not prev.text.endswith(SENTENCE_END)
+        ):
+            category = "ListItem" if prev.category == "ListItem" else "NarrativeText"
+            elements[-1] = TextElement(category, f"{prev.text} {line}")
+            continue
+
+        elements.append(TextElement(classify_line(line), line))
+
+    return elements
+
+
+def parse_pdf_fast(file_path):
+    """
+    Extract the PDF text layer with pdfplumber. Returns None when the
+    layer looks unusable (scanned, garbled glyphs, or tables that need
+    hi_res structure inference), so the caller can escalate.
+    """
+    import pdfplumber
+
+    lines = []
+    n_chars = 0
+
+    with pdfplumber.open(file_path) as pdf:
+        n_pages = len(pdf.pages)
+
+        for page in pdf.pages:
+            if page.find_tables():
+                return None
+
+            text = page.extract_text() or ""
+            n_chars += len(text.strip())
+            lines.extend(text.splitlines())
+
+    if not n_pages or n_chars / n_pages < FAST_PDF_MIN_CHARS_PER_PAGE:
+        return None
+
+    if garbled_ratio("\n".join(lines)) > FAST_PDF_MAX_GARBLED_RATIO:
+        return None
+
+    return elements_to_text(lines_to_elements(lines))
+
+# =========================
+# PARSERS
+# =========================
+
+def parse_pdf(file_path):
+    if FAST_PDF_ENABLED:
+        try:
+            text = parse_pdf_fast(file_path)
+        except Exception as e:
+            print(f" Fast PDF extraction failed, using hi_res: {e}")
+            text = None
+
+        if text is not None:
+            return text
+
+    return parse_pdf_hi_res(file_path)
+
+
+def parse_pdf_hi_res(file_path):
+    from unstructured.partition.pdf import partition_pdf
+
+    elements = partition_pdf(
+        filename=file_path,
+        strategy="hi_res",                 # IMPORTANT for layout
+        infer_table_structure=True,        # VERY IMPORTANT for syllabus tables
+        extract_images_in_pdf=False,
+    )
+    return elements_to_text(elements)
+
+
+def parse_docx(file_path):
+    from unstructured.partition.docx import partition_docx
+
+    elements = partition_docx(filename=file_path)
+    return elements_to_text(elements)
+
+
+def parse_ppt(file_path):
+    from unstructured.partition.pptx import partition_pptx
+
+    elements = partition_pptx(filename=file_path)
+    return elements_to_text(elements)
+
+
+PARSERS = {
+    "pdf": parse_pdf,
+    "docx": parse_docx,
+    "ppt": parse_ppt,
+}
+
+# =========================
+# ENTRY POINT (ALSO USED BY WORKER PROCESSES)
+# =========================
+
+def parse_bytes(file_type, file_bytes) -> str:
+    """
+    Parse downloaded file bytes. Kept free of DB / Drive state so it can
+    run in a worker process.
+    """
+    parser = PARSERS.get(file_type)
+    if parser is None:
+        raise ValueError(f"Unsupported file type: {file_type}")
+
+    tmp_path = None
+
+    try:
+        # Create temp file (unstructured requires a file path)
+        with tempfile.NamedTemporaryFile(delete=False) as tmp:
+            tmp.write(file_bytes)
+            tmp_path = tmp.name
+
+        return parser(tmp_path)
+
+    finally:
+        if tmp_path and os.path.exists(tmp_path):
+            os.remove(tmp_path)
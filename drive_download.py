@@ -0,0 +1,139 @@
+import io
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+# =========================
+# CONFIG
+# =========================
+
+DOWNLOAD_WORKERS = 4
+PREFETCH_DEPTH = 8              # downloads allowed to run ahead of the parser
+DOWNLOAD_CHUNK_SIZE = 8 * 1024 * 1024
+
+MAX_RETRIES = 5
+BACKOFF_BASE = 1.0              # seconds, doubled per attempt
+BACKOFF_MAX = 32.0
+RETRYABLE_STATUSES = {429, 500, 502, 503, 504}
+
+# =========================
+# RETRIES
+# =========================
+
+def is_retryable(exc) -> bool:
+    if isinstance(exc, (ConnectionError, TimeoutError)):
+        return True
+
+    # googleapiclient HttpError (and the fakes) expose resp.status
+    status = getattr(getattr(exc, "resp", None), "status", None)
+    try:
+        return int(status) in RETRYABLE_STATUSES
+    except (TypeError, ValueError):
+        return False
+
+
+def with_retries(fn, *args, max_retries=MAX_RETRIES, sleep=time.sleep):
+    """
+    Call fn(*args), retrying 429/5xx and connection errors with
+    exponential backoff and jitter.
+    """
+    attempt = 0
+
+    while True:
+        try:
+            return fn(*args)
+        except Exception as e:
+            if attempt >= max_retries or not is_retryable(e):
+                raise
+
+            delay = min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt)
+            delay *= random.uniform(0.5, 1.0)
+            print(f" Retry {attempt + 1}/{max_retries} in {delay:.1f}s: {e}")
+
+            sleep(delay)
+            attempt += 1
+
+# =========================
+# DRIVE FETCHER
+# =========================
+
+class DriveFetcher:
+    """
+    Callable that downloads a Drive file by ID. Each worker thread gets
+    its own API client because the underlying httplib2 transport is not
+    thread-safe.
+    """
+
+    def __init__(self, creds, chunksize=DOWNLOAD_CHUNK_SIZE):
+        self.creds = creds
+        self.chunksize = chunksize
+        self._local = threading.local()
+
+    def service(self):
+        if not hasattr(self._local, "service"):
+            from googleapiclient.discovery import build
+
+            self._local.service = build(
+                "drive", "v3",
+                credentials=self.creds,
+                cache_discovery=False
+            )
+        return self._local.service
+
+    def metadata(self, file_id) -> dict:
+        return self.service().files().get(
+            fileId=file_id,
+            fields="md5Checksum,modifiedTime"
+        ).execute()
+
+    def __call__(self, file_id) -> bytes:
+        from googleapiclient.http import MediaIoBaseDownload
+
+        request = self.service().files().get_media(fileId=file_id)
+        fh = io.BytesIO()
+        downloader = MediaIoBaseDownload(fh, request, chunksize=self.chunksize)
+
+        done = False
+        while not done:
+            _, done = downloader.next_chunk()
+
+        return fh.getvalue()
+
+# =========================
+# PREFETCH POOL
+# =========================
+
+def prefetch_downloads(
+    fetch,
+    items,
+    key=lambda item: item,
+    max_workers=DOWNLOAD_WORKERS,
+    depth=PREFETCH_DEPTH,
+):
+    """
+    Download items on a bounded thread pool, keeping at most `depth`
+    downloads in flight ahead of the consumer.
+
+    Yields (item, data, error) in input order; exactly one of data and
+    error is None.
+    """
+    depth = max(depth, max_workers)
+    pending = deque()
+
+    def result(item, future):
+        try:
+            return item, future.result(), None
+        except Exception as e:
+            return item, None, e
+
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        for item in items:
+            pending.append((item, pool.submit(with_retries, fetch, key(item))))
+
+            if len(pending) >= depth:
+                yield result(*pending.popleft())
+
+        while pending:
+            yield result(*pending.popleft())
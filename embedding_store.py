@@ -0,0 +1,101 @@
+import hashlib
+
+import numpy as np
+from psycopg2.extras import execute_values
+
+# =========================
+# SCHEMA
+# =========================
+
+def ensure_embeddings_table(cur):
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS embeddings (
+            text_hash TEXT NOT NULL,
+            model TEXT NOT NULL,
+            dim INTEGER NOT NULL,
+            vector BYTEA NOT NULL,
+            created_at TIMESTAMP NOT NULL DEFAULT NOW(),
+            PRIMARY KEY (text_hash, model)
+        )
+    """)
+
+
+def text_hash(text):
+    """Same as encode(sha256(convert_to(text, 'UTF8')), 'hex') in SQL."""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def store_model_name(model_name, normalize):
+    # Normalized and raw vectors of one model are different entries
+    return f"{model_name}:normalized" if normalize else model_name
+
+# =========================
+# CACHED EMBEDDER
+# =========================
+
+class CachedEmbedder:
+    """
+    Wraps an embedder (SentenceTransformer or ModelClient) and keeps
+    every vector it computes in the `embeddings` table as float32 bytes,
+    keyed by text hash and model. Only texts never seen before are
+    encoded; callers commit the connection as usual.
+    """
+
+    def __init__(self, embedder, conn, model_name):
+        self.embedder = embedder
+        self.conn = conn
+        self.model_name = model_name
+        self.hits = 0
+        self.misses = 0
+
+    def lookup(self, hashes, model):
+        with self.conn.cursor() as cur:
+            cur.execute("""
+                SELECT text_hash, vector
+                FROM embeddings
+                WHERE model = %s AND text_hash = ANY(%s)
+            """, (model, list(hashes)))
+            return {
+                h: np.frombuffer(bytes(vector), dtype=np.float32)
+                for h, vector in cur.fetchall()
+            }
+
+    def store(self, rows, model):
+        with self.conn.cursor() as cur:
+            execute_values(cur, """
+                INSERT INTO embeddings (text_hash, model, dim, vector)
+                VALUES %s
+                ON CONFLICT (text_hash, model) DO NOTHING
+            """, [
+                (h, model, len(vector), np.asarray(vector, dtype=np.float32).tobytes())
+                for h, vector in rows
+            ])
+
+    def encode(self, texts, batch_size=32, normalize_embeddings=False, **kwargs):
+        model = store_model_name(self.model_name, normalize_embeddings)
+        hashes = [text_hash(text) for text in texts]
+
+        vectors = self.lookup(set(hashes), model) if hashes else {}
+        self.hits += sum(1 for h in hashes if h in vectors)
+
+        # Encode each missing text once, even if repeated in the batch
+        missing = {}
+        for h, text in zip(hashes, texts):
+            if h not in vectors:
+                missing.setdefault(h, text)
+
+        if missing:
+            self.misses += len(missing)
+            encoded = self.embedder.encode(
+                list(missing.values()),
+                batch_size=batch_size,
+                normalize_embeddings=normalize_embeddings
+            )
+            new_rows = list(zip(missing, encoded))
+            self.store(new_rows, model)
+            vectors.update((h, np.asarray(v, dtype=np.float32)) for h, v in new_rows)
+
+        if not hashes:
+            return np.zeros((0, 0), dtype=np.float32)
+
+        return np.stack([vectors[h] for h in hashes])
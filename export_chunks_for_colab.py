@@ -1,7 +1,14 @@
-import json
+import argparse
+from datetime import datetime
+
 import psycopg2
 
-OUTPUT_PATH ="exported_chunks.json"
+from jsonl_io import ShardedJsonlWriter
+
+OUTPUT_PATH = "exported_chunks.jsonl"
+
+# Rows pulled per round-trip from the server-side cursor
+ITERSIZE = 2000
 
 # =========================
 # DB Connection
@@ -15,53 +22,108 @@ DB_CONFIG = {
     "port": "5432"
 }
 
-conn = psycopg2.connect(**DB_CONFIG)
-cursor = conn.cursor()
-
-# =========================
-# FETCH CHUNKS
-# =========================
-
-cursor.execute("""
-    SELECT
-        id,
-        course_id,
-        document_id,
-        chunk_index,
-        text
-    FROM chunks
-    ORDER BY course_id, document_id, chunk_index
-""")
-
-rows = cursor.fetchall()
-print(f"Exporting {len(rows)} chunks")
-
 # =========================
-# BUILD JSON
+# QUERY
 # =========================
 
-chunks = []
-
-for row in rows:
-    chunk_id, course_id, document_id, chunk_index, text = row
-
-    chunks.append({
-        "chunk_id": chunk_id,
-        "course_id": course_id,
-        "document_id": document_id,
-        "chunk_index": chunk_index,
-        "text": text
-    })
+def build_query(course_ids=None, roles=None, since=None):
+    conditions = []
+    params = []
+
+    if course_ids:
+        conditions.append("c.course_id = ANY(%s)")
+        params.append(list(course_ids))
+
+    if roles:
+        conditions.append("d.role = ANY(%s)")
+        params.append(list(roles))
+
+    if since:
+        conditions.append("c.created_at >= %s")
+        params.append(since)
+
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    join = "JOIN documents d ON d.id = c.document_id" if roles else ""
+
+    query = f"""
+        SELECT
+            c.id,
+            c.course_id,
+            c.document_id,
+            c.chunk_index,
+            c.text
+        FROM chunks c
+        {join}
+        {where}
+        ORDER BY c.course_id, c.document_id, c.chunk_index
+    """
+    return query, params
 
 # =========================
-# WRITE FILE
+# EXPORT
 # =========================
 
-with open(OUTPUT_PATH, "w", encoding="utf-8") as f:
-    json.dump(chunks, f, indent=2, ensure_ascii=False)
-
-print(f"Saved to {OUTPUT_PATH}")
-
-
-cursor.close()
-conn.close()
+def export_chunks(conn, output_path, shard_size=0, itersize=ITERSIZE, **filters):
+    """
+    Stream chunks through a named (server-side) cursor, so only `itersize`
+    rows are held in memory at a time, and write them as they arrive.
+    """
+    query, params = build_query(**filters)
+
+    # Named cursors must live inside a transaction
+    with conn:
+        with conn.cursor(name="export_chunks") as cursor:
+            cursor.itersize = itersize
+            cursor.execute(query, params)
+
+            with ShardedJsonlWriter(output_path, shard_size) as writer:
+                for chunk_id, course_id, document_id, chunk_index, text in cursor:
+                    writer.write({
+                        "chunk_id": chunk_id,
+                        "course_id": course_id,
+                        "document_id": document_id,
+                        "chunk_index": chunk_index,
+                        "text": text
+                    })
+
+    return writer
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Export chunks as JSONL")
+    parser.add_argument("--output", default=OUTPUT_PATH, help=".gz / .zst suffix compresses")
+    parser.add_argument("--course", action="append", dest="course_ids", help="course id (repeatable)")
+    parser.add_argument("--role", action="append", dest="roles", help="document role (repeatable)")
+    parser.add_argument(
+        "--since", type=datetime.fromisoformat,
+        help="only chunks created at or after this ISO timestamp"
+    )
+    parser.add_argument(
+        "--shard-size", type=int, default=0,
+        help="chunks per output file; 0 writes a single file"
+    )
+    parser.add_argument("--itersize", type=int, default=ITERSIZE)
+    args = parser.parse_args(argv)
+
+    conn = psycopg2.connect(**DB_CONFIG)
+
+    try:
+        writer = export_chunks(
+            conn,
+            args.output,
+            shard_size=args.shard_size,
+            itersize=args.itersize,
+            course_ids=args.course_ids,
+            roles=args.roles,
+            since=args.since,
+        )
+    finally:
+        conn.close()
+
+    print(f"Saved {writer.count} chunks to {len(writer.paths)} file(s)")
+    for path in writer.paths:
+        print(f"  {path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,182 @@
+import hashlib
+import os
+import threading
+import time
+from datetime import datetime, timezone
+from types import SimpleNamespace
+
+# =========================
+# FAKE HTTP ERRORS
+# =========================
+
+class FakeHttpError(Exception):
+    """
+    Mirrors the shape of googleapiclient.errors.HttpError that the
+    retry logic looks at (exc.resp.status).
+    """
+
+    def __init__(self, status, message=""):
+        super().__init__(f"HTTP {status} {message}".strip())
+        self.resp = SimpleNamespace(status=status)
+
+# =========================
+# LOCAL DRIVE
+# =========================
+
+class LocalDrive:
+    """
+    Fake Drive that serves files from a local directory. A file ID maps
+    to the file whose name (with or without extension) equals the ID.
+
+    Usable anywhere a DriveFetcher is expected. `fail_first` makes the
+    first N requests for every file fail with `fail_status`, and
+    `latency` adds a per-request delay to mimic network time.
+    """
+
+    def __init__(self, root, latency=0.0, fail_first=0, fail_status=503):
+        self.root = root
+        self.latency = latency
+        self.fail_first = fail_first
+        self.fail_status = fail_status
+        self.requests = {}
+        self._lock = threading.Lock()
+
+    def path_for(self, file_id):
+        exact = os.path.join(self.root, file_id)
+        if os.path.isfile(exact):
+            return exact
+
+        for name in os.listdir(self.root):
+            if os.path.splitext(name)[0] == file_id:
+                return os.path.join(self.root, name)
+
+        raise FakeHttpError(404, f"File not found: {file_id}")
+
+    def metadata(self, file_id) -> dict:
+        path = self.path_for(file_id)
+
+        with open(path, "rb") as f:
+            md5 = hashlib.md5(f.read()).hexdigest()
+
+        modified = datetime.fromtimestamp(os.path.getmtime(path), timezone.utc)
+
+        return {
+            "md5Checksum": md5,
+            "modifiedTime": modified.isoformat().replace("+00:00", "Z"),
+        }
+
+    def __call__(self, file_id) -> bytes:
+        with self._lock:
+            seen = self.requests.get(file_id, 0)
+            self.requests[file_id] = seen + 1
+
+        if self.latency:
+            time.sleep(self.latency)
+
+        if seen < self.fail_first:
+            raise FakeHttpError(self.fail_status, "injected failure")
+
+        with open(self.path_for(file_id), "rb") as f:
+            return f.read()
+
+# =========================
+# FAKE CLASSROOM
+# =========================
+
+class _FakeRequest:
+    def __init__(self, execute):
+        self.execute = execute
+
+
+class _FakeCollection:
+    def __init__(self, classroom, collection, key):
+        self.classroom = classroom
+        self.collection = collection
+        self.key = key
+
+    def list(self, courseId, pageSize=None, pageToken=None, orderBy=None, **_):
+        items = self.classroom.items[courseId][self.collection]
+        if orderBy == "updateTime asc":
+            items = items[::-1]
+
+        return _FakeRequest(
+            lambda: self.classroom.page(items, self.key, pageSize, pageToken)
+        )
+
+
+class _FakeCourses:
+    def __init__(self, classroom):
+        self.classroom = classroom
+
+    def list(self, courseStates=None, pageSize=None, pageToken=None, **_):
+        courses = [
+            course for course in self.classroom.course_list
+            if not courseStates or course.get("courseState") in courseStates
+        ]
+        return _FakeRequest(
+            lambda: self.classroom.page(courses, "courses", pageSize, pageToken)
+        )
+
+    def announcements(self):
+        return _FakeCollection(self.classroom, "announcements", "announcements")
+
+    def courseWorkMaterials(self):
+        return _FakeCollection(self.classroom, "materials", "courseWorkMaterial")
+
+    def courseWork(self):
+        return _FakeCollection(self.classroom, "coursework", "courseWork")
+
+
+class FakeClassroom:
+    """
+    In-memory Classroom API built from a dump (the classroom_dump.json
+    block format). Supports the list calls used by the extractor with
+    real pagination: pages are capped at `max_page_size` and collections
+    come back newest updateTime first, like the API.
+
+    Thread-safe, so the same instance can serve every worker thread.
+    """
+
+    def __init__(self, dump, max_page_size=20, latency=0.0):
+        self.max_page_size = max_page_size
+        self.latency = latency
+        self.calls = 0
+        self._lock = threading.Lock()
+
+        self.course_list = [block["course"] for block in dump]
+        self.items = {
+            block["course"]["id"]: {
+                collection: sorted(
+                    block.get(collection, []),
+                    key=lambda item: item.get("updateTime", ""),
+                    reverse=True
+                )
+                for collection in ("announcements", "materials", "coursework")
+            }
+            for block in dump
+        }
+
+    def __call__(self):
+        # Acts as its own per-thread service factory
+        return self
+
+    def courses(self):
+        return _FakeCourses(self)
+
+    def page(self, items, key, page_size, page_token):
+        with self._lock:
+            self.calls += 1
+
+        if self.latency:
+            time.sleep(self.latency)
+
+        size = min(page_size or self.max_page_size, self.max_page_size)
+        start = int(page_token or 0)
+        end = start + size
+
+        response = {}
+        if items[start:end]:
+            response[key] = items[start:end]
+        if end < len(items):
+            response["nextPageToken"] = str(end)
+        return response
@@ -1,12 +1,13 @@
 import os
-from google.auth.transport.requests import Request
-from google.oauth2.credentials import Credentials
-from google_auth_oauthlib.flow import InstalledAppFlow
 
 TOKEN_PATH = "token.json"
 CREDENTIALS_PATH = "credentials.json"
 
 def get_credentials(scopes):
+    from google.auth.transport.requests import Request
+    from google.oauth2.credentials import Credentials
+    from google_auth_oauthlib.flow import InstalledAppFlow
+
     creds = None
 
     if os.path.exists(TOKEN_PATH):
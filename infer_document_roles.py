@@ -1,16 +1,32 @@
 import json
-import torch
-from transformers import AutoTokenizer, AutoModelForCausalLM
+import argparse
+import functools
 import psycopg2
 
+from llm_inference import BACKENDS, backend_id, load_backend
+from llm_cache import LLMCache, make_key
+from model_client import MODEL_SERVER_URL, ModelClient
+
 # =========================
 # CONFIG
 # =========================
 
 MODEL_NAME = "Qwen/Qwen2.5-3B-Instruct"
 MAX_CHARS = 4000
+MAX_PROMPT_TOKENS = 1024
 OUTPUT_JSON = "document_roles.json"
 
+# Documents per generate() call; prompts of similar length are batched
+BATCH_SIZE = 8
+
+# "generate" decodes a few tokens; "score" ranks the role labels in a
+# single forward pass and also yields a confidence
+DEFAULT_MODE = "generate"
+
+# Inference backend (see llm_inference.BACKENDS); "gguf" needs a model file
+LLM_BACKEND = "auto"
+GGUF_MODEL_PATH = None
+
 DB_CONFIG = {
     "dbname": "studybuddy",
     "user": "postgres",
@@ -19,30 +35,23 @@ DB_CONFIG = {
     "port": 5432,
 }
 
-ALLOWED_ROLES = {
+ROLE_LABELS = [
     "syllabus",
     "marks_distribution",
     "study_material",
     "practice_sets",
     "unknown"
-}
-
-PROMPT_TEMPLATE = """
-You are classifying an academic document uploaded by a professor.
-
-You are given the following information:
+]
 
-FILENAME:
-{filename}
-
-FILE TYPE:
-{file_type}
+ALLOWED_ROLES = set(ROLE_LABELS)
 
-DOCUMENT TEXT (BEGINNING ONLY):
-{content}
+# Constant instruction block first, so its KV cache can be computed once
+# and shared by every document; the document-specific part comes last
+PROMPT_PREFIX = """
+You are classifying an academic document uploaded by a professor.
 
 Your task:
-Choose EXACTLY ONE role from the list below that best represents the PURPOSE of this document.
+Choose EXACTLY ONE role from the list below that best represents the PURPOSE of the document given at the end.
 
 ROLES:
 - syllabus
@@ -63,46 +72,37 @@ IMPORTANT:
 - Do NOT output anything except the role name
 - Output must be exactly one of the role strings above
 
-ROLE:
-"""
+You are given the following information:
 
+"""
 
-# =========================
-# LOAD MODEL
-# =========================
+PROMPT_TEMPLATE = """FILENAME:
+{filename}
 
-device = "cuda" if torch.cuda.is_available() else "cpu"
-tokenizer = AutoTokenizer.from_pretrained(MODEL_NAME)
-model = AutoModelForCausalLM.from_pretrained(
-    MODEL_NAME,
-    torch_dtype=torch.float16 if device == "cuda" else torch.float32,
-    device_map="auto"
-)
+FILE TYPE:
+{file_type}
 
-# =========================
-# DB FETCH
-# =========================
+DOCUMENT TEXT (BEGINNING ONLY):
+{content}
 
-conn = psycopg2.connect(**DB_CONFIG)
-cur = conn.cursor()
+ROLE:
+"""
 
-cur.execute("""
-    SELECT id, course_id, title, raw_text, file_type
-    FROM documents
-    WHERE parsed = TRUE
-""")
 
-rows = cur.fetchall()
-cur.close()
-conn.close()
+# =========================
+# LOAD MODEL
+# =========================
 
-print(f"Loaded {len(rows)} documents")
+@functools.lru_cache(maxsize=None)
+def load_model(backend=LLM_BACKEND, gguf_path=GGUF_MODEL_PATH):
+    """Loaded on first use only, so a fully cached run never loads it."""
+    return load_backend(MODEL_NAME, PROMPT_PREFIX, backend, gguf_path)
 
 # =========================
-# INFERENCE FUNCTION
+# INFERENCE FUNCTIONS
 # =========================
 
-def infer_role(title, raw_text, file_type: str) -> str:
+def role_from_title(title):
     title_l = (title or "").lower()
 
     if "syllabus" in title_l:
@@ -113,78 +113,308 @@ def infer_role(title, raw_text, file_type: str) -> str:
 
     if any(k in title_l for k in ["question", "practice", "exercise", "problem"]):
         return "practice_sets"
-    
+
+    return None
+
+
+def build_prompt(title, raw_text, file_type):
     text = (raw_text or "")[:MAX_CHARS]
 
-    prompt = PROMPT_TEMPLATE.format(
-        filename=title, 
+    return PROMPT_TEMPLATE.format(
+        filename=title,
         file_type=file_type,
         content=text
     )
 
-    inputs = tokenizer(
-        prompt,
-        return_tensors="pt",
-        truncation=True,
-        max_length=1024
-    ).to(device)
-
-    with torch.no_grad():
-        outputs = model.generate(
-            **inputs,
-            max_new_tokens=5
-        )
 
-    prediction = tokenizer.decode(outputs[0], skip_special_tokens=True)
+def fit_prompt(prefix_cache, title, raw_text, file_type):
+    """
+    build_prompt with the document text cut to the tokens left after the
+    prefix and the rest of the template, so the FILENAME / FILE TYPE
+    header and the ROLE: cue at the end are never truncated.
+    """
+    overhead = len(prefix_cache.tokenize(build_prompt(title, "", file_type)))
+    budget = MAX_PROMPT_TOKENS - prefix_cache.length - overhead
+
+    text = (raw_text or "")[:MAX_CHARS]
+
+    if len(prefix_cache.tokenize(text)) > budget:
+        # Longest leading slice of the text that fits the budget
+        low, high = 0, len(text)
+        while low < high:
+            mid = (low + high + 1) // 2
+            if len(prefix_cache.tokenize(text[:mid])) <= budget:
+                low = mid
+            else:
+                high = mid - 1
+        text = text[:low]
+
+    return build_prompt(title, text, file_type)
+
+
+def clean_prediction(prediction):
     prediction = prediction.strip().lower()
+    prediction = prediction.split("\n")[0].strip(" \"'`.")
 
     return prediction if prediction in ALLOWED_ROLES else "unknown"
 
-# =========================
-# RUN INFERENCE
-# =========================
 
-results = []
+def generate_batch(prefix_cache, prompts):
+    # Only the generated continuation is decoded, not the echoed prompt
+    return prefix_cache.generate(
+        prompts,
+        max_new_tokens=5
+    )
 
-for doc_id, course_id, title, raw_text, file_type in rows:
-    role = infer_role(title, raw_text, file_type)
-    
-    results.append({
-        "document_id": doc_id,
-        "course_id": course_id,
-        "title": title,
-        "role": role
-    })
 
-    print(f"[{role.upper():18}] {title}")
+def label_first_tokens(prefix_cache):
+    """
+    First token of each role label. Single-step scoring needs them to be
+    distinct, since that is the only token compared.
+    """
+    token_ids = [prefix_cache.tokenize(label)[0] for label in ROLE_LABELS]
+
+    if len(set(token_ids)) != len(token_ids):
+        raise ValueError("Role labels share a first token; use --mode generate")
+
+    return token_ids
+
+
+def score_batch(prefix_cache, prompts, label_token_ids):
+    """
+    One forward pass over the prompts; compare the log-likelihood of each
+    role label's first token as the next token. Returns (role, confidence)
+    per prompt, the confidence being that token's probability renormalized
+    over the five roles.
+
+    Only the first token of each label is scored, not the full label as a
+    continuation; label_first_tokens() checks they are distinct, which
+    makes the ranking well defined but not equal to the labels' full
+    log-likelihoods.
+    """
+    import torch
+
+    # Prompts already fit the budget (fit_prompt)
+    logits = prefix_cache.next_token_logits(prompts)
+
+    label_log_probs = torch.log_softmax(logits.float(), dim=-1)[:, label_token_ids]
+    label_probs = torch.softmax(label_log_probs, dim=-1)
+    confidences, best = label_probs.max(dim=-1)
+
+    return [
+        (ROLE_LABELS[i], float(confidence))
+        for i, confidence in zip(best.tolist(), confidences.tolist())
+    ]
+
+
+def result_cache_key(prompt, mode, backend=LLM_BACKEND, gguf_path=GGUF_MODEL_PATH):
+    return make_key(
+        backend_id(MODEL_NAME, backend, gguf_path),
+        PROMPT_PREFIX + PROMPT_TEMPLATE,
+        {"mode": mode, "max_new_tokens": 5, "max_prompt_tokens": MAX_PROMPT_TOKENS},
+        prompt
+    )
+
+
+def infer_roles(documents, batch_size=BATCH_SIZE, mode=DEFAULT_MODE, cache=None,
+                prefix_cache=None, backend=LLM_BACKEND, gguf_path=GGUF_MODEL_PATH):
+    """
+    Classify (title, raw_text, file_type) tuples into (role, confidence).
+    Title rules are applied first (confidence 1.0), then the result cache;
+    the rest go through the LLM in batches of similar prompt length so
+    little compute is spent on padding. Generation gives no confidence
+    (None).
+
+    Prompts here are the per-document suffixes; the instruction prefix
+    comes from the shared KV cache.
+    """
+    results = []
+    for title, _, _ in documents:
+        role = role_from_title(title)
+        results.append((role, 1.0) if role else None)
+
+    pending = [i for i, result in enumerate(results) if result is None]
+
+    prompts = {i: build_prompt(*documents[i]) for i in pending}
+    cache_keys = {}
+
+    if cache is not None:
+        for i in pending:
+            cache_keys[i] = result_cache_key(prompts[i], mode, backend, gguf_path)
+            cached = cache.get(cache_keys[i])
+            if cached is not None:
+                results[i] = tuple(cached)
+
+        pending = [i for i in pending if results[i] is None]
+
+    if not pending:
+        return results
+
+    prefix_cache = prefix_cache or load_model(backend, gguf_path)
+
+    # Cache keys use the character-capped prompt; the model sees it cut to
+    # its token budget
+    for i in pending:
+        prompts[i] = fit_prompt(prefix_cache, *documents[i])
+
+    lengths = {i: len(prefix_cache.tokenize(prompts[i])) for i in pending}
+    pending.sort(key=lengths.get)
+
+    label_token_ids = label_first_tokens(prefix_cache) if mode == "score" else None
+
+    for start in range(0, len(pending), batch_size):
+        batch = pending[start:start + batch_size]
+        batch_prompts = [prompts[i] for i in batch]
+
+        if mode == "score":
+            batch_results = score_batch(prefix_cache, batch_prompts, label_token_ids)
+        else:
+            batch_results = [
+                (clean_prediction(prediction), None)
+                for prediction in generate_batch(prefix_cache, batch_prompts)
+            ]
+
+        for i, result in zip(batch, batch_results):
+            results[i] = result
+
+            if cache is not None:
+                cache.put(cache_keys[i], list(result))
+
+    return results
+
+
+def infer_role(title, raw_text, file_type: str, mode=DEFAULT_MODE, cache=None,
+               backend=LLM_BACKEND, gguf_path=GGUF_MODEL_PATH) -> str:
+    return infer_roles(
+        [(title, raw_text, file_type)],
+        mode=mode, cache=cache, backend=backend, gguf_path=gguf_path
+    )[0][0]
 
 # =========================
-# SAVE OUTPUT
+# MAIN
 # =========================
 
-with open(OUTPUT_JSON, "w") as f:
-    json.dump(results, f, indent=2)
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Classify document roles with an LLM")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    parser.add_argument("--mode", choices=["generate", "score"], default=DEFAULT_MODE)
+    parser.add_argument(
+        "--min-confidence", type=float, default=0.0,
+        help="in score mode, roles below this confidence are stored as 'unknown'"
+    )
+    parser.add_argument(
+        "--no-llm-cache", action="store_true",
+        help="re-classify every document instead of reusing cached results"
+    )
+    parser.add_argument(
+        "--backend", choices=BACKENDS, default=LLM_BACKEND,
+        help="auto: float16 on GPU, int8-quantized on CPU"
+    )
+    parser.add_argument("--gguf", default=GGUF_MODEL_PATH, help="GGUF model file for --backend gguf")
+    parser.add_argument(
+        "--server", default=MODEL_SERVER_URL,
+        help="classify through a running model_server.py instead of loading the model"
+    )
+    args = parser.parse_args(argv)
+
+    # The server keeps its own result cache
+    cache = None if args.no_llm_cache or args.server else LLMCache()
+
+    # =========================
+    # DB FETCH
+    # =========================
+
+    conn = psycopg2.connect(**DB_CONFIG)
+    cur = conn.cursor()
+
+    cur.execute("""
+        SELECT id, course_id, title, raw_text, file_type
+        FROM documents
+        WHERE parsed = TRUE
+    """)
+
+    rows = cur.fetchall()
+    cur.close()
+    conn.close()
+
+    print(f"Loaded {len(rows)} documents")
+
+    # =========================
+    # RUN INFERENCE
+    # =========================
+
+    documents = [(title, raw_text, file_type) for _, _, title, raw_text, file_type in rows]
+
+    if args.server:
+        predictions = ModelClient(args.server).classify(documents, mode=args.mode)
+    else:
+        predictions = infer_roles(
+            documents,
+            batch_size=args.batch_size,
+            mode=args.mode,
+            cache=cache,
+            backend=args.backend,
+            gguf_path=args.gguf
+        )
 
-print(f"\nSaved results to {OUTPUT_JSON}")
+    if cache is not None:
+        print(f"LLM cache: {cache.stats()}")
+        cache.close()
 
-with open("document_roles.json") as f:
-    roles = json.load(f)
+    results = []
 
-conn = psycopg2.connect(**DB_CONFIG)
-cur = conn.cursor()
+    for (doc_id, course_id, title, _, _), (role, confidence) in zip(rows, predictions):
+        if confidence is not None and confidence < args.min_confidence:
+            role = "unknown"
 
-for r in roles:
-    cur.execute(
-        """
-        UPDATE documents
-        SET role = %s
-        WHERE id = %s
-        """,
-        (r["role"], r["document_id"])
-    )
+        results.append({
+            "document_id": doc_id,
+            "course_id": course_id,
+            "title": title,
+            "role": role,
+            "confidence": confidence
+        })
+
+        shown = f"{confidence:.2f}" if confidence is not None else "  - "
+        print(f"[{role.upper():18}] {shown} {title}")
+
+    # =========================
+    # SAVE OUTPUT
+    # =========================
+
+    with open(OUTPUT_JSON, "w") as f:
+        json.dump(results, f, indent=2)
+
+    print(f"\nSaved results to {OUTPUT_JSON}")
+
+    with open(OUTPUT_JSON) as f:
+        roles = json.load(f)
+
+    conn = psycopg2.connect(**DB_CONFIG)
+    cur = conn.cursor()
+
+    cur.execute("""
+        ALTER TABLE documents
+        ADD COLUMN IF NOT EXISTS role_confidence REAL
+    """)
+
+    for r in roles:
+        cur.execute(
+            """
+            UPDATE documents
+            SET role = %s,
+                role_confidence = %s
+            WHERE id = %s
+            """,
+            (r["role"], r.get("confidence"), r["document_id"])
+        )
+
+    conn.commit()
+    cur.close()
+    conn.close()
+
+    print("Document roles updated successfully.")
 
-conn.commit()
-cur.close()
-conn.close()
 
-print("Document roles updated successfully.")
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,13 @@
+import re
 import json
 import uuid
-import torch
+import argparse
+import functools
 import psycopg2
-from transformers import AutoTokenizer, AutoModelForCausalLM
+
+from llm_inference import BACKENDS, backend_id, load_backend
+from llm_cache import LLMCache, make_key
+from model_client import MODEL_SERVER_URL, ModelClient
 
 
 # =========================
@@ -11,6 +16,23 @@ from transformers import AutoTokenizer, AutoModelForCausalLM
 
 MODEL_NAME = "Qwen/Qwen2.5-7B-Instruct"
 MAX_CHARS = 5000
+MAX_NEW_TOKENS = 1400
+
+# "single" truncates the syllabus to MAX_CHARS and decodes it in one pass;
+# "windowed" extracts from overlapping windows of the full text in
+# batches and merges the results
+DEFAULT_MODE = "windowed"
+WINDOW_CHARS = 2500
+WINDOW_OVERLAP_CHARS = 500
+WINDOW_MAX_NEW_TOKENS = 700
+WINDOW_BATCH_SIZE = 4
+
+# Inference backend (see llm_inference.BACKENDS); "gguf" needs a model file
+LLM_BACKEND = "auto"
+GGUF_MODEL_PATH = None
+
+# Lines that open a new section in elements_to_text output
+SECTION_MARKERS = ("[TITLE]", "[TABLE]")
 
 DB_CONFIG = {
     "dbname": "studybuddy",
@@ -20,46 +42,9 @@ DB_CONFIG = {
     "port": 5432,
 }
 
-# =========================
-# MODEL LOAD
-# =========================
-
-tokenizer = AutoTokenizer.from_pretrained(
-    MODEL_NAME,
-    trust_remote_code=True
-)
-
-model = AutoModelForCausalLM.from_pretrained(
-    MODEL_NAME,
-    torch_dtype=torch.float16,
-    device_map="auto",
-    trust_remote_code=True
-)
-
-model.eval()
-
-# =========================
-# DB CONNECT
-# =========================
-
-conn = psycopg2.connect(**DB_CONFIG)
-cur = conn.cursor()
-
-cur.execute("""
-    SELECT id, course_id, raw_text
-    FROM documents
-    WHERE role = 'syllabus'
-""")
-
-# cur.execute("""
-#     SELECT raw_text FROM documents
-#     where id ='6fa942e1-aef2-4155-82de-1cc341e996fa'
-# """)
-
-syllabus_docs = cur.fetchall()
-print(f"Found {len(syllabus_docs)} syllabus documents")
-
-PROMPT_TEMPLATE = """
+# Constant instruction block; its KV cache is computed once per model
+# load. The syllabus text is appended after it.
+PROMPT_PREFIX = """
 Extract the syllabus structure from the text below.
 
 Task:
@@ -74,22 +59,35 @@ Rules:
 - No explanations, no markdown.
 
 JSON format:
-{{
+{
   "units": [
-    {{
+    {
       "unit_name": "...",
       "order": 1,
       "topics": [
-        {{ "topic_name": "...", "order": 1 }}
+        { "topic_name": "...", "order": 1 }
       ]
-    }}
+    }
   ]
-}}
+}
 
 Syllabus Text:
-{text}
 """
 
+PROMPT_TEMPLATE = """{text}
+"""
+
+# =========================
+# MODEL LOAD
+# =========================
+
+@functools.lru_cache(maxsize=None)
+def load_model(backend=LLM_BACKEND, gguf_path=GGUF_MODEL_PATH):
+    """Loaded on first use only, so a fully cached run never loads it."""
+    return load_backend(
+        MODEL_NAME, PROMPT_PREFIX, backend, gguf_path,
+        trust_remote_code=True
+    )
 
 # =========================
 # INFERENCE FUNCTION
@@ -115,39 +113,264 @@ def safe_json_parse(text):
     return parsed
 
 
-def infer_units_topics(text: str) -> dict:
-    text = text[:MAX_CHARS]
-    full_prompt = PROMPT_TEMPLATE.format(text=text)
+def extraction_cache_key(text, max_new_tokens, backend=LLM_BACKEND, gguf_path=GGUF_MODEL_PATH):
+    return make_key(
+        backend_id(MODEL_NAME, backend, gguf_path),
+        PROMPT_PREFIX + PROMPT_TEMPLATE,
+        {"max_new_tokens": max_new_tokens, "do_sample": False},
+        text
+    )
 
-    # Move inputs to GPU
-    inputs = tokenizer(full_prompt, return_tensors="pt").to(model.device)
 
-    with torch.no_grad():
-        outputs = model.generate(
-            **inputs,
-            max_new_tokens=1400,
-            do_sample=False  
-        )
+def extract_batch(texts, max_new_tokens, cache=None, backend=LLM_BACKEND, gguf_path=GGUF_MODEL_PATH):
+    """
+    Run the extraction prompt over several texts in one batched generate.
+    Returns one parsed result per text, or None where the model output
+    was not valid JSON. Only well-formed results are cached.
+    """
+    results = [None] * len(texts)
+    keys = [
+        extraction_cache_key(text, max_new_tokens, backend, gguf_path)
+        for text in texts
+    ]
+
+    pending = []
+    for i, key in enumerate(keys):
+        cached = cache.get(key) if cache is not None else None
+        if cached is not None:
+            results[i] = cached
+        else:
+            pending.append(i)
+
+    if not pending:
+        return results
+
+    decoded = load_model(backend, gguf_path).generate(
+        [PROMPT_TEMPLATE.format(text=texts[i]) for i in pending],
+        max_new_tokens=max_new_tokens
+    )
 
-    input_len = inputs.input_ids.shape[1]
-    new_tokens = outputs[0][input_len:]
-    decoded = tokenizer.decode(new_tokens, skip_special_tokens=True)
-    
-    print("=========Raw Model Output=========")
-    print(decoded)
-    print("==================================")
+    for i, output in zip(pending, decoded):
+        print("=========Raw Model Output=========")
+        print(output)
+        print("==================================")
+
+        try:
+            results[i] = safe_json_parse(output)
+        except ValueError as e:
+            print(f"Skipping unparseable extraction: {e}")
+            continue
+
+        if cache is not None:
+            cache.put(keys[i], results[i])
+
+    return results
+
+# =========================
+# WINDOWING
+# =========================
 
-    return safe_json_parse(decoded)
+def split_sections(text):
+    """
+    Split elements_to_text output into sections, each starting at a
+    [TITLE] or [TABLE] line, so a window never cuts a unit heading off
+    from the topics under it.
+    """
+    sections = []
+    current = []
+
+    for line in text.splitlines():
+        if current and line.startswith(SECTION_MARKERS):
+            sections.append("\n".join(current))
+            current = []
+        current.append(line)
+
+    if current:
+        sections.append("\n".join(current))
+
+    return sections
+
+
+def split_long_section(section, window_chars):
+    """Break a section longer than a window along line boundaries."""
+    pieces = []
+    current = ""
+
+    lines = []
+    for line in section.splitlines():
+        lines.extend(line[i:i + window_chars] for i in range(0, len(line), window_chars))
+
+    for line in lines:
+        if current and len(current) + 1 + len(line) > window_chars:
+            pieces.append(current)
+            current = ""
+        current = f"{current}\n{line}" if current else line
+
+    if current:
+        pieces.append(current)
+
+    return pieces
+
+
+def section_tail(section, limit):
+    """
+    Trailing lines of a section within `limit` chars, led by the section's
+    heading line so the carried-over topics keep their unit.
+    """
+    lines = section.splitlines()
+    heading = lines[0] if lines[0].startswith(SECTION_MARKERS) else None
+    body = lines[1:] if heading else lines
+
+    tail = []
+    size = len(heading) if heading else 0
+    for line in reversed(body):
+        if size + len(line) + 1 > limit:
+            break
+        tail.insert(0, line)
+        size += len(line) + 1
+
+    if not tail:
+        return None
+
+    return "\n".join([heading] + tail if heading else tail)
+
+
+def make_windows(text, window_chars=WINDOW_CHARS, overlap_chars=WINDOW_OVERLAP_CHARS):
+    """
+    Pack whole sections into windows of up to window_chars. Each window
+    after the first repeats the end of the previous one (up to
+    overlap_chars), so content near a boundary is seen with its context
+    at least once.
+    """
+    sections = []
+    for section in split_sections(text):
+        if len(section) > window_chars:
+            sections.extend(split_long_section(section, window_chars))
+        else:
+            sections.append(section)
+
+    windows = []
+    current = []
+
+    for section in sections:
+        if current and len("\n".join(current + [section])) > window_chars:
+            windows.append("\n".join(current))
+
+            # Carry over the tail of this window as overlap, as long as
+            # the new section still fits next to it
+            overlap = []
+            for prev in reversed(current):
+                candidate = [prev] + overlap
+                if (len("\n".join(candidate)) > overlap_chars
+                        or len("\n".join(candidate + [section])) > window_chars):
+                    break
+                overlap = candidate
+
+            # Sections too long to repeat whole contribute their tail
+            if not overlap:
+                tail = section_tail(current[-1], overlap_chars)
+                if tail and len(tail) + 1 + len(section) <= window_chars:
+                    overlap = [tail]
+
+            current = overlap
+
+        current.append(section)
+
+    if current:
+        windows.append("\n".join(current))
 
-# debug_result = infer_units_topics(syllabus_docs)
-# print("=========Parsed JSON Output=========")
-# print(debug_result)
+    return windows
+
+# =========================
+# MERGING
+# =========================
+
+def normalize_name(name):
+    """Case/punctuation-insensitive key used to spot duplicates."""
+    return re.sub(r"[^a-z0-9]+", " ", name.lower()).strip()
+
+
+def merge_units(results):
+    """
+    Merge per-window results into one hierarchy. Units are matched by
+    normalized name and kept in first-seen order; topics are unioned
+    within each unit, also in first-seen order. Orders are renumbered.
+    """
+    units = {}
+
+    for result in results:
+        if not result:
+            continue
+
+        for unit in result.get("units", []):
+            unit_name = (unit.get("unit_name") or "").strip()
+            if not unit_name:
+                continue
+
+            merged = units.setdefault(
+                normalize_name(unit_name),
+                {"unit_name": unit_name, "topics": {}}
+            )
+
+            for topic in unit.get("topics") or []:
+                topic_name = (topic.get("topic_name") or "").strip()
+                if topic_name:
+                    merged["topics"].setdefault(normalize_name(topic_name), topic_name)
+
+    return {
+        "units": [
+            {
+                "unit_name": unit["unit_name"],
+                "order": unit_order,
+                "topics": [
+                    {"topic_name": topic_name, "order": topic_order}
+                    for topic_order, topic_name in enumerate(unit["topics"].values(), start=1)
+                ]
+            }
+            for unit_order, unit in enumerate(units.values(), start=1)
+        ]
+    }
+
+# =========================
+# EXTRACTION
+# =========================
+
+def extraction_inputs(text, mode=DEFAULT_MODE):
+    """Texts to run the extraction prompt on, and their decode budget."""
+    if mode == "single":
+        return [text[:MAX_CHARS]], MAX_NEW_TOKENS
+
+    return make_windows(text), WINDOW_MAX_NEW_TOKENS
+
+
+def combine_results(results, mode=DEFAULT_MODE):
+    if not any(results):
+        raise ValueError("Extraction failed for every window")
+
+    if mode == "single":
+        return results[0]
+
+    return merge_units(results)
+
+
+def infer_units_topics(text: str, cache=None, mode=DEFAULT_MODE, batch_size=WINDOW_BATCH_SIZE,
+                       backend=LLM_BACKEND, gguf_path=GGUF_MODEL_PATH) -> dict:
+    texts, max_new_tokens = extraction_inputs(text, mode)
+    print(f"  {len(texts)} windows")
+
+    results = []
+    for start in range(0, len(texts), batch_size):
+        results.extend(extract_batch(
+            texts[start:start + batch_size], max_new_tokens, cache, backend, gguf_path
+        ))
+
+    return combine_results(results, mode)
 
 # =========================
 # INSERT HELPERS
 # =========================
 
-def get_or_create_unit(course_id, name, order):
+def get_or_create_unit(cur, course_id, name, order):
     cur.execute(
         """
         SELECT id FROM units
@@ -171,7 +394,7 @@ def get_or_create_unit(course_id, name, order):
     return unit_id
 
 
-def get_or_create_topic(course_id, unit_id, name, order):
+def get_or_create_topic(cur, course_id, unit_id, name, order):
     cur.execute(
         """
         SELECT id FROM topics
@@ -195,42 +418,125 @@ def get_or_create_topic(course_id, unit_id, name, order):
     return topic_id
 
 
+def store_units_topics(cur, course_id, result):
+    """Insert missing units/topics; returns the IDs of all stored ones."""
+    unit_ids = set()
+    topic_ids = set()
+
+    for unit in result.get("units", []):
+        unit_name = unit.get("unit_name")
+        unit_order = unit.get("order")
+
+        if not unit_name:
+            continue
+
+        unit_id = get_or_create_unit(cur, course_id, unit_name, unit_order)
+        unit_ids.add(unit_id)
+
+        for topic in unit.get("topics", []):
+            topic_name = topic.get("topic_name")
+            topic_order = topic.get("order")
+
+            if topic_name:
+                topic_ids.add(get_or_create_topic(cur, course_id, unit_id, topic_name, topic_order))
+
+    return unit_ids, topic_ids
+
+
+def prune_units_topics(cur, course_id, unit_ids, topic_ids):
+    """
+    Delete the course's units and topics not in the given sets (left over
+    from an older syllabus), with their chunk mappings first.
+    """
+    cur.execute("""
+        DELETE FROM chunk_topic_map
+        WHERE topic_id IN (
+            SELECT id FROM topics
+            WHERE course_id = %s AND NOT (id::text = ANY(%s::text[]))
+        )
+    """, (course_id, list(topic_ids)))
+
+    cur.execute("""
+        DELETE FROM topics
+        WHERE course_id = %s AND NOT (id::text = ANY(%s::text[]))
+    """, (course_id, list(topic_ids)))
+    removed = cur.rowcount
+
+    cur.execute("""
+        DELETE FROM units
+        WHERE course_id = %s AND NOT (id::text = ANY(%s::text[]))
+    """, (course_id, list(unit_ids)))
+
+    return removed
+
 # =========================
 # MAIN LOOP
 # =========================
 
-for doc_id, course_id, raw_text in syllabus_docs:
-    print(doc_id)
-    
-    try:
-        
-        result = infer_units_topics(raw_text)
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Extract syllabus units and topics with an LLM")
+    parser.add_argument(
+        "--no-llm-cache", action="store_true",
+        help="re-extract every syllabus instead of reusing cached results"
+    )
+    parser.add_argument(
+        "--mode", choices=["single", "windowed"], default=DEFAULT_MODE,
+        help="'single' truncates to MAX_CHARS; 'windowed' covers the whole syllabus"
+    )
+    parser.add_argument("--batch-size", type=int, default=WINDOW_BATCH_SIZE)
+    parser.add_argument(
+        "--backend", choices=BACKENDS, default=LLM_BACKEND,
+        help="auto: float16 on GPU, int8-quantized on CPU"
+    )
+    parser.add_argument("--gguf", default=GGUF_MODEL_PATH, help="GGUF model file for --backend gguf")
+    parser.add_argument(
+        "--server", default=MODEL_SERVER_URL,
+        help="extract through a running model_server.py instead of loading the model"
+    )
+    args = parser.parse_args(argv)
 
-        for unit in result.get("units", []):
-            unit_name = unit.get("unit_name")
-            unit_order = unit.get("order")
+    # The server keeps its own result cache
+    cache = None if args.no_llm_cache or args.server else LLMCache()
+    client = ModelClient(args.server) if args.server else None
 
-            if not unit_name:
-                continue
+    conn = psycopg2.connect(**DB_CONFIG)
+    cur = conn.cursor()
 
-            unit_id = get_or_create_unit(course_id, unit_name, unit_order)
+    cur.execute("""
+        SELECT id, course_id, raw_text
+        FROM documents
+        WHERE role = 'syllabus'
+    """)
 
-            for topic in unit.get("topics", []):
-                topic_name = topic.get("topic_name")
-                topic_order = topic.get("order")
+    syllabus_docs = cur.fetchall()
+    print(f"Found {len(syllabus_docs)} syllabus documents")
 
-                if topic_name:
-                    get_or_create_topic(course_id, unit_id, topic_name, topic_order)
-    except Exception as e:
-        print(f"Error processing document {doc_id}: {e}")
+    for doc_id, course_id, raw_text in syllabus_docs:
+        print(doc_id)
 
-    conn.commit()
+        try:
+            if client is not None:
+                result = client.extract(raw_text, mode=args.mode)
+            else:
+                result = infer_units_topics(
+                    raw_text, cache=cache, mode=args.mode, batch_size=args.batch_size,
+                    backend=args.backend, gguf_path=args.gguf
+                )
+            store_units_topics(cur, course_id, result)
+        except Exception as e:
+            print(f"Error processing document {doc_id}: {e}")
 
-# =========================
-# CLEANUP
-# =========================
+        conn.commit()
+
+    cur.close()
+    conn.close()
+
+    if cache is not None:
+        print(f"LLM cache: {cache.stats()}")
+        cache.close()
+
+    print("Unit & topic extraction complete.")
 
-cur.close()
-conn.close()
 
-print("Unit & topic extraction complete.")
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,157 @@
+import gzip
+import io
+import json
+
+try:
+    import zstandard
+except ImportError:  # optional, only needed for .zst files
+    zstandard = None
+
+# =========================
+# CONFIG
+# =========================
+
+# Compressed streams are flushed every N records so readers can follow
+# along without wrecking the compression ratio
+COMPRESSED_FLUSH_EVERY = 1000
+
+# =========================
+# FILE HANDLES
+# =========================
+
+def open_text(path, mode="r"):
+    """
+    Open a text stream, compressed according to the suffix:
+    .gz (gzip), .zst (zstandard) or plain.
+    """
+    if path.endswith(".gz"):
+        return gzip.open(path, mode + "t", encoding="utf-8")
+
+    if path.endswith(".zst"):
+        if zstandard is None:
+            raise RuntimeError("Reading/writing .zst files requires the zstandard package")
+
+        raw = open(path, mode + "b")
+        if mode == "r":
+            stream = zstandard.ZstdDecompressor().stream_reader(raw, closefd=True)
+        else:
+            stream = zstandard.ZstdCompressor().stream_writer(raw, closefd=True)
+        return io.TextIOWrapper(stream, encoding="utf-8")
+
+    # Line buffered, so every record is visible as soon as it is written
+    buffering = 1 if mode != "r" else -1
+    return open(path, mode, encoding="utf-8", buffering=buffering)
+
+# =========================
+# WRITER
+# =========================
+
+class JsonlWriter:
+    """
+    Writes one JSON record per line. Use as a context manager:
+
+        with JsonlWriter("out.jsonl.gz") as writer:
+            for record in records:
+                writer.write(record)
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.count = 0
+        self._compressed = path.endswith((".gz", ".zst"))
+        self._f = open_text(path, "w")
+
+    def write(self, record):
+        self._f.write(json.dumps(record, ensure_ascii=False, default=str))
+        self._f.write("\n")
+        self.count += 1
+
+        if self._compressed and self.count % COMPRESSED_FLUSH_EVERY == 0:
+            self._f.flush()
+
+    def close(self):
+        self._f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+# =========================
+# READER
+# =========================
+
+def iter_records(path):
+    """
+    Lazily yield records from a JSONL file (optionally compressed).
+    Legacy .json files holding one array are still accepted, but are
+    loaded whole.
+    """
+    if path.endswith(".json"):
+        with open(path, "r", encoding="utf-8") as f:
+            yield from json.load(f)
+        return
+
+    with open_text(path, "r") as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                yield json.loads(line)
+
+# =========================
+# SHARDED WRITER
+# =========================
+
+def shard_path(path, index):
+    """exported.jsonl.gz -> exported-00003.jsonl.gz"""
+    marker = path.find(".jsonl")
+    if marker == -1:
+        marker = len(path)
+    return f"{path[:marker]}-{index:05d}{path[marker:]}"
+
+
+class ShardedJsonlWriter:
+    """
+    JsonlWriter that starts a new file every `shard_size` records, so
+    consumers can load the shards in parallel. shard_size=0 writes a
+    single file at `path`.
+    """
+
+    def __init__(self, path, shard_size):
+        self.path = path
+        self.shard_size = shard_size
+        self.count = 0
+        self.paths = []
+        self._writer = None
+
+        # A single-file export always produces its file, even when empty
+        if not shard_size:
+            self._next_shard()
+
+    def write(self, record):
+        if self._writer is None or (
+            self.shard_size and self._writer.count >= self.shard_size
+        ):
+            self._next_shard()
+
+        self._writer.write(record)
+        self.count += 1
+
+    def _next_shard(self):
+        if self._writer is not None:
+            self._writer.close()
+
+        path = shard_path(self.path, len(self.paths)) if self.shard_size else self.path
+        self.paths.append(path)
+        self._writer = JsonlWriter(path)
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
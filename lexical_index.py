@@ -0,0 +1,341 @@
+import os
+import re
+import tempfile
+import unicodedata
+from array import array
+from collections import Counter
+
+import numpy as np
+
+# =========================
+# CONFIG
+# =========================
+
+LEXICAL_INDEX_PATH = ".lexical_index.npz"
+
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+LOAD_BATCH_SIZE = 1000
+
+STOPWORDS = frozenset("""
+a an and are as at be by for from has have in is it its of on or that the
+this to was were will with which what when where who how not but if then
+than so such can may these those their there been being into also
+""".split())
+
+TOKEN_RE = re.compile(r"[a-z0-9]+(?:\.\d+)*")
+# Course codes ("PHY 265", "CS-101", "MA102") also index as one token
+CODE_RE = re.compile(r"\b([a-z]{2,5})[\s-]?(\d{2,4})\b")
+
+# =========================
+# TOKENIZER
+# =========================
+
+def tokenize(text):
+    """Lowercased, accent-folded word and number tokens, plus joined course codes."""
+    text = unicodedata.normalize("NFKD", text).encode("ascii", "ignore").decode("ascii").lower()
+
+    tokens = [t for t in TOKEN_RE.findall(text) if t not in STOPWORDS]
+    tokens.extend(letters + digits for letters, digits in CODE_RE.findall(text))
+    return tokens
+
+# =========================
+# BM25 INDEX
+# =========================
+
+class BM25Index:
+    """
+    Inverted index over chunk text with BM25 scoring. Postings are
+    append-only arrays of (row, term frequency) per term, so chunks are
+    added incrementally; removed rows are masked at query time and
+    dropped when the index is saved. Filters by course, role and topic
+    like retrieval.VectorIndex.
+    """
+
+    def __init__(self):
+        self.terms = {}
+        self.postings = []
+        self.freqs = []
+
+        self.doc_len = array("i")
+        self.courses = array("i")
+        self.roles = array("i")
+        self.alive = bytearray()
+        self.total_len = 0
+
+        self.ids = []
+        self.row_of = {}
+        self.course_codes = {}
+        self.role_codes = {}
+        self.topic_rows = {}
+
+    def __len__(self):
+        return len(self.row_of)
+
+    @staticmethod
+    def _code(codes, value):
+        return codes.setdefault(value, len(codes))
+
+    # ---------- updates ----------
+
+    def add(self, ids, texts, course_ids, roles, topic_ids=None):
+        """Insert (or replace) chunks. topic_ids is one list of topic IDs per chunk."""
+        self.remove([chunk_id for chunk_id in ids if chunk_id in self.row_of])
+
+        for chunk_id, text, course_id, role, topics in zip(
+            ids, texts, course_ids, roles, topic_ids or [()] * len(ids)
+        ):
+            row = len(self.ids)
+            tokens = tokenize(text)
+
+            for token, tf in Counter(tokens).items():
+                term_id = self.terms.get(token)
+                if term_id is None:
+                    term_id = self.terms[token] = len(self.postings)
+                    self.postings.append(array("i"))
+                    self.freqs.append(array("i"))
+                self.postings[term_id].append(row)
+                self.freqs[term_id].append(tf)
+
+            self.ids.append(chunk_id)
+            self.row_of[chunk_id] = row
+            self.doc_len.append(len(tokens))
+            self.courses.append(self._code(self.course_codes, course_id))
+            self.roles.append(self._code(self.role_codes, role))
+            self.alive.append(1)
+            self.total_len += len(tokens)
+
+            for topic_id in topics or ():
+                self.topic_rows.setdefault(topic_id, array("i")).append(row)
+
+    def remove(self, ids):
+        for chunk_id in ids:
+            row = self.row_of.pop(chunk_id, None)
+            if row is not None:
+                self.alive[row] = 0
+                self.total_len -= self.doc_len[row]
+
+    # ---------- search ----------
+
+    def search(self, query, k=10, course_id=None, role=None, topic_id=None):
+        """Top-k (chunk_id, BM25 score) for a text query, with optional filters."""
+        term_ids = [self.terms[t] for t in set(tokenize(query)) if t in self.terms]
+        if not term_ids or not len(self):
+            return []
+
+        if course_id is not None and course_id not in self.course_codes:
+            return []
+        if role is not None and role not in self.role_codes:
+            return []
+
+        # Copies, so the arrays stay free to grow after the query
+        doc_len = np.array(self.doc_len, dtype=np.float32)
+        alive = np.frombuffer(bytes(self.alive), dtype=np.uint8).astype(bool)
+        n_docs = len(self)
+        avgdl = max(self.total_len / n_docs, 1.0)
+
+        rows_parts = []
+        weight_parts = []
+
+        for term_id in term_ids:
+            rows = np.array(self.postings[term_id], dtype=np.int64)
+            tf = np.array(self.freqs[term_id], dtype=np.float32)
+
+            # Removed rows stay in the postings until the next save; drop
+            # them first so df, like n_docs, counts live chunks only
+            live = alive[rows]
+            rows = rows[live]
+            tf = tf[live]
+
+            df = len(rows)
+            idf = np.log(1.0 + (n_docs - df + 0.5) / (df + 0.5))
+            norm = BM25_K1 * (1.0 - BM25_B + BM25_B * doc_len[rows] / avgdl)
+
+            rows_parts.append(rows)
+            weight_parts.append(idf * tf * (BM25_K1 + 1.0) / (tf + norm))
+
+        rows = np.concatenate(rows_parts)
+        weights = np.concatenate(weight_parts)
+
+        mask = np.ones(len(rows), dtype=bool)
+        if course_id is not None:
+            mask &= np.array(self.courses, dtype=np.int32)[rows] == self.course_codes[course_id]
+        if role is not None:
+            mask &= np.array(self.roles, dtype=np.int32)[rows] == self.role_codes[role]
+        if topic_id is not None:
+            mask &= np.isin(rows, np.array(self.topic_rows.get(topic_id, array("i")), dtype=np.int64))
+
+        rows = rows[mask]
+        if not len(rows):
+            return []
+
+        candidates, inverse = np.unique(rows, return_inverse=True)
+        scores = np.bincount(inverse, weights=weights[mask])
+
+        if len(scores) > k:
+            best = np.argpartition(-scores, k - 1)[:k]
+        else:
+            best = np.arange(len(scores))
+        best = best[np.argsort(-scores[best])]
+
+        return [(self.ids[candidates[i]], float(scores[i])) for i in best]
+
+    # ---------- persistence ----------
+
+    def save(self, path=LEXICAL_INDEX_PATH):
+        """
+        Write the live rows as CSR postings (delta-encoded rows, uint16
+        frequencies) in one compressed .npz, atomically.
+        """
+        alive = np.frombuffer(bytes(self.alive), dtype=np.uint8).astype(bool)
+        live = np.flatnonzero(alive)
+        new_row = np.full(len(alive), -1, dtype=np.int64)
+        new_row[live] = np.arange(len(live))
+
+        terms = []
+        offsets = [0]
+        row_parts = []
+        freq_parts = []
+
+        for term, term_id in self.terms.items():
+            rows = new_row[np.array(self.postings[term_id], dtype=np.int64)]
+            keep = rows >= 0
+            if not keep.any():
+                continue
+
+            terms.append(term)
+            row_parts.append(rows[keep])
+            freq_parts.append(np.array(self.freqs[term_id], dtype=np.int64)[keep])
+            offsets.append(offsets[-1] + int(keep.sum()))
+
+        rows = np.concatenate(row_parts) if row_parts else np.zeros(0, dtype=np.int64)
+        freqs = np.concatenate(freq_parts) if freq_parts else np.zeros(0, dtype=np.int64)
+
+        # Rows ascend within each list: small deltas compress well
+        deltas = np.diff(rows, prepend=0).astype(np.int32)
+
+        topic_pairs = [
+            (int(new_row[row]), topic_id)
+            for topic_id, rows_ in self.topic_rows.items()
+            for row in rows_
+            if new_row[row] >= 0
+        ]
+
+        arrays = {
+            "terms": np.array(terms, dtype=str),
+            "offsets": np.array(offsets, dtype=np.int64),
+            "row_deltas": deltas,
+            "freqs": np.minimum(freqs, np.iinfo(np.uint16).max).astype(np.uint16),
+            "doc_len": np.array(self.doc_len, dtype=np.int32)[live],
+            "ids": np.array([self.ids[row] for row in live], dtype=str),
+            "courses": np.array(self.courses, dtype=np.int32)[live],
+            "course_names": np.array(list(self.course_codes), dtype=str),
+            "roles": np.array(self.roles, dtype=np.int32)[live],
+            "role_names": np.array(list(self.role_codes), dtype=str),
+            "topic_rows": np.array([row for row, _ in topic_pairs], dtype=np.int64),
+            "topic_ids": np.array([topic for _, topic in topic_pairs], dtype=str),
+        }
+
+        directory = os.path.dirname(os.path.abspath(path))
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".npz")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                np.savez_compressed(f, **arrays)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+
+    @classmethod
+    def load(cls, path=LEXICAL_INDEX_PATH):
+        data = np.load(path)
+        index = cls()
+
+        offsets = data["offsets"]
+        rows = np.cumsum(data["row_deltas"], dtype=np.int64).astype(np.int32)
+        freqs = data["freqs"].astype(np.int32)
+
+        for term_id, term in enumerate(data["terms"].tolist()):
+            start, end = offsets[term_id], offsets[term_id + 1]
+            index.terms[term] = term_id
+            index.postings.append(array("i", rows[start:end].tobytes()))
+            index.freqs.append(array("i", freqs[start:end].tobytes()))
+
+        index.doc_len = array("i", data["doc_len"].astype(np.int32).tobytes())
+        index.courses = array("i", data["courses"].astype(np.int32).tobytes())
+        index.roles = array("i", data["roles"].astype(np.int32).tobytes())
+        index.alive = bytearray(b"\x01" * len(index.doc_len))
+        index.total_len = int(data["doc_len"].sum())
+
+        index.ids = data["ids"].tolist()
+        index.row_of = {chunk_id: row for row, chunk_id in enumerate(index.ids)}
+        index.course_codes = {name: code for code, name in enumerate(data["course_names"].tolist())}
+        index.role_codes = {name: code for code, name in enumerate(data["role_names"].tolist())}
+
+        for row, topic_id in zip(data["topic_rows"].tolist(), data["topic_ids"].tolist()):
+            index.topic_rows.setdefault(topic_id, array("i")).append(row)
+
+        return index
+
+# =========================
+# DATABASE SYNC
+# =========================
+
+def index_rows(index, chunk_rows, map_rows, role):
+    """Add freshly built chunk_documents rows (chunks + chunk_topic_map) to the index."""
+    topics = {}
+    for _, chunk_id, topic_id, *_ in map_rows:
+        topics.setdefault(chunk_id, []).append(str(topic_id))
+
+    index.add(
+        [row[0] for row in chunk_rows],
+        [row[4] for row in chunk_rows],
+        [str(row[2]) for row in chunk_rows],
+        [role or "unknown"] * len(chunk_rows),
+        [topics.get(row[0], []) for row in chunk_rows]
+    )
+
+
+def sync_lexical_index(index, conn):
+    """Bring the index in line with the chunks table: drop deleted chunks, add new ones."""
+    with conn.cursor() as cur:
+        cur.execute("SELECT id::text FROM chunks")
+        db_ids = {row[0] for row in cur.fetchall()}
+
+    removed = set(index.row_of) - db_ids
+    index.remove(removed)
+
+    new_ids = sorted(db_ids - set(index.row_of))
+    if not new_ids:
+        return 0, len(removed)
+
+    with conn.cursor(name="lexical_chunks") as cur:
+        cur.itersize = LOAD_BATCH_SIZE
+        cur.execute("""
+            SELECT c.id::text, c.text, c.course_id::text, d.role,
+                   ARRAY(SELECT m.topic_id::text FROM chunk_topic_map m WHERE m.chunk_id = c.id)
+            FROM chunks c
+            JOIN documents d ON d.id = c.document_id
+            WHERE c.id::text = ANY(%s)
+        """, (new_ids,))
+
+        while True:
+            rows = cur.fetchmany(LOAD_BATCH_SIZE)
+            if not rows:
+                break
+            index.add(*zip(*[(r[0], r[1], r[2], r[3] or "unknown", r[4]) for r in rows]))
+
+    conn.commit()
+    return len(new_ids), len(removed)
+
+
+def open_lexical_index(conn, path=LEXICAL_INDEX_PATH):
+    """Load the saved index (or start one) and sync it with the database."""
+    index = BM25Index.load(path) if os.path.exists(path) else BM25Index()
+
+    added, removed = sync_lexical_index(index, conn)
+    if added or removed:
+        index.save(path)
+
+    return index
@@ -0,0 +1,135 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+
+# =========================
+# CONFIG
+# =========================
+
+LLM_CACHE_PATH = ".llm_cache.sqlite"
+LLM_CACHE_MAX_BYTES = 256 * 1024 * 1024
+
+# =========================
+# KEYS
+# =========================
+
+def sha256(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def make_key(model_name, prompt_template, params, input_text):
+    """
+    A result is reusable only for the same model, the same prompt
+    template, the same generation parameters and the same (truncated)
+    input text.
+    """
+    return sha256(json.dumps([
+        model_name,
+        sha256(prompt_template),
+        params,
+        sha256(input_text),
+    ], sort_keys=True))
+
+# =========================
+# SQLITE CACHE
+# =========================
+
+class LLMCache:
+    """
+    Disk-backed LLM result cache with size-based LRU eviction. Values
+    are stored as JSON. Safe to share between threads.
+    """
+
+    def __init__(self, path=LLM_CACHE_PATH, max_bytes=LLM_CACHE_MAX_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS entries (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                last_access REAL NOT NULL
+            )
+        """)
+        self.conn.execute("""
+            CREATE INDEX IF NOT EXISTS entries_last_access
+            ON entries (last_access)
+        """)
+        self.conn.commit()
+
+        self._total = self.conn.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM entries"
+        ).fetchone()[0]
+
+    def get(self, key):
+        with self._lock:
+            row = self.conn.execute(
+                "SELECT value FROM entries WHERE key = ?", (key,)
+            ).fetchone()
+
+            if row is None:
+                self.misses += 1
+                return None
+
+            self.conn.execute(
+                "UPDATE entries SET last_access = ? WHERE key = ?",
+                (time.time(), key)
+            )
+            self.conn.commit()
+            self.hits += 1
+
+        return json.loads(row[0])
+
+    def put(self, key, value):
+        data = json.dumps(value)
+        size = len(data.encode("utf-8"))
+
+        with self._lock:
+            old = self.conn.execute(
+                "SELECT size FROM entries WHERE key = ?", (key,)
+            ).fetchone()
+
+            self.conn.execute(
+                "INSERT OR REPLACE INTO entries (key, value, size, last_access) VALUES (?, ?, ?, ?)",
+                (key, data, size, time.time())
+            )
+            self._total += size - (old[0] if old else 0)
+
+            self._evict()
+            self.conn.commit()
+
+    def _evict(self):
+        """Drop least recently used entries until under max_bytes."""
+        while self._total > self.max_bytes:
+            rows = self.conn.execute(
+                "SELECT key, size FROM entries ORDER BY last_access LIMIT 100"
+            ).fetchall()
+            if not rows:
+                break
+
+            for key, size in rows:
+                if self._total <= self.max_bytes:
+                    break
+                self.conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+                self._total -= size
+                self.evictions += 1
+
+    def stats(self):
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "bytes": self._total,
+        }
+
+    def close(self):
+        self.conn.close()
@@ -0,0 +1,310 @@
+import os
+import copy
+
+# torch, transformers and numpy are imported where they are used, so the
+# stage scripts importing this module still start (and print --help) fast
+
+# =========================
+# CONFIG
+# =========================
+
+# "auto" runs float16 on a GPU and int8 dynamic quantization on CPU;
+# "transformers" is the unquantized model (float32 on CPU); "gguf" runs
+# an int4/int8 GGUF file through llama.cpp
+BACKENDS = ("auto", "transformers", "int8", "gguf")
+DEFAULT_BACKEND = "auto"
+
+LLAMA_CPP_N_CTX = 8192
+
+# =========================
+# PREFIX KV CACHE
+# =========================
+
+class PrefixCache:
+    """
+    KV cache of a constant prompt prefix (the instruction block), computed
+    once per model load and reused for every document. Only the variable
+    suffix of each prompt is run through the model.
+
+    The prefix should end on a token boundary (e.g. a newline) so that
+    tokenizing prefix and suffix separately matches tokenizing them joined.
+
+    Suffixes are run whole: callers cut the variable content to their
+    token budget before formatting, since truncating the encoded suffix
+    would drop the task cue at its end.
+    """
+
+    def __init__(self, tokenizer, model, prefix):
+        import torch
+
+        self.tokenizer = tokenizer
+        self.model = model
+
+        self.prefix_ids = tokenizer(
+            prefix, return_tensors="pt"
+        )["input_ids"].to(model.device)
+        self.length = self.prefix_ids.shape[1]
+
+        with torch.no_grad():
+            self.past_key_values = model(
+                input_ids=self.prefix_ids, use_cache=True
+            ).past_key_values
+
+    def tokenize(self, text):
+        return self.tokenizer.encode(text, add_special_tokens=False)
+
+    def expanded(self, batch_size):
+        """Fresh copy of the prefix cache for a batch (the model mutates it)."""
+        cache = copy.deepcopy(self.past_key_values)
+
+        if batch_size == 1:
+            return cache
+
+        if hasattr(cache, "batch_repeat_interleave"):
+            cache.batch_repeat_interleave(batch_size)
+            return cache
+
+        # Legacy tuple-of-tuples cache
+        return tuple(
+            tuple(t.repeat_interleave(batch_size, dim=0) for t in layer)
+            for layer in cache
+        )
+
+    def encode(self, suffixes, left_pad):
+        """Tokenize suffixes and pad them by hand to a common width."""
+        import torch
+
+        sequences = self.tokenizer(suffixes, add_special_tokens=False)["input_ids"]
+
+        width = max(len(seq) for seq in sequences)
+        pad_id = self.tokenizer.pad_token_id
+
+        input_ids, attention_mask = [], []
+        for seq in sequences:
+            padding = width - len(seq)
+            if left_pad:
+                input_ids.append([pad_id] * padding + seq)
+                attention_mask.append([0] * padding + [1] * len(seq))
+            else:
+                input_ids.append(seq + [pad_id] * padding)
+                attention_mask.append([1] * len(seq) + [0] * padding)
+
+        device = self.model.device
+        return (
+            torch.tensor(input_ids, device=device),
+            torch.tensor(attention_mask, device=device),
+        )
+
+    def generate(self, suffixes, max_new_tokens, **generate_kwargs):
+        """
+        Greedy-generate a continuation of prefix + suffix for a batch.
+        Suffixes are left-padded, so the padding sits between prefix and
+        suffix; generate() derives position IDs from the attention mask.
+        """
+        import torch
+
+        batch_size = len(suffixes)
+        suffix_ids, suffix_mask = self.encode(suffixes, left_pad=True)
+
+        input_ids = torch.cat([self.prefix_ids.expand(batch_size, -1), suffix_ids], dim=1)
+        attention_mask = torch.cat([
+            torch.ones(batch_size, self.length, dtype=suffix_mask.dtype, device=suffix_mask.device),
+            suffix_mask
+        ], dim=1)
+
+        with torch.no_grad():
+            outputs = self.model.generate(
+                input_ids=input_ids,
+                attention_mask=attention_mask,
+                past_key_values=self.expanded(batch_size),
+                max_new_tokens=max_new_tokens,
+                do_sample=False,
+                pad_token_id=self.tokenizer.pad_token_id,
+                **generate_kwargs
+            )
+
+        new_tokens = outputs[:, input_ids.shape[1]:]
+        return self.tokenizer.batch_decode(new_tokens, skip_special_tokens=True)
+
+    def next_token_logits(self, suffixes):
+        """
+        One forward pass over the suffixes; returns the next-token logits
+        after each full prompt, shape (batch, vocab).
+        """
+        import torch
+
+        batch_size = len(suffixes)
+        suffix_ids, suffix_mask = self.encode(suffixes, left_pad=False)
+
+        attention_mask = torch.cat([
+            torch.ones(batch_size, self.length, dtype=suffix_mask.dtype, device=suffix_mask.device),
+            suffix_mask
+        ], dim=1)
+
+        # Right padding keeps every real token at prefix_len + offset
+        position_ids = (
+            self.length + torch.arange(suffix_ids.shape[1], device=suffix_ids.device)
+        ).expand(batch_size, -1)
+
+        with torch.no_grad():
+            logits = self.model(
+                input_ids=suffix_ids,
+                attention_mask=attention_mask,
+                position_ids=position_ids,
+                past_key_values=self.expanded(batch_size),
+                use_cache=True
+            ).logits
+
+        last = suffix_mask.sum(dim=1) - 1
+        return logits[torch.arange(batch_size, device=logits.device), last]
+
+# =========================
+# LLAMA.CPP BACKEND
+# =========================
+
+class LlamaCppBackend:
+    """
+    PrefixCache interface over a GGUF model run by llama.cpp (optional
+    llama-cpp-python package). Prompts are evaluated one at a time;
+    llama.cpp keeps the KV cache of the previous prompt and only evaluates
+    the tokens after the longest common prefix, so the instruction prefix
+    is computed once.
+    """
+
+    def __init__(self, model_path, prefix, n_ctx=LLAMA_CPP_N_CTX, n_threads=None):
+        try:
+            from llama_cpp import Llama
+        except ImportError:
+            raise RuntimeError("The gguf backend requires the llama-cpp-python package")
+
+        self.llm = Llama(
+            model_path=model_path,
+            n_ctx=n_ctx,
+            n_threads=n_threads,
+            verbose=False
+        )
+        self.prefix_ids = self.llm.tokenize(prefix.encode("utf-8"), add_bos=True)
+        self.length = len(self.prefix_ids)
+
+    def tokenize(self, text):
+        return self.llm.tokenize(text.encode("utf-8"), add_bos=False)
+
+    def prompt_ids(self, suffix):
+        return self.prefix_ids + self.tokenize(suffix)
+
+    def generate(self, suffixes, max_new_tokens):
+        outputs = []
+
+        for suffix in suffixes:
+            completion = self.llm.create_completion(
+                self.prompt_ids(suffix),
+                max_tokens=max_new_tokens,
+                temperature=0.0
+            )
+            outputs.append(completion["choices"][0]["text"])
+
+        return outputs
+
+    def next_token_logits(self, suffixes):
+        import numpy as np
+        import torch
+        import llama_cpp
+
+        rows = []
+
+        for suffix in suffixes:
+            tokens = self.prompt_ids(suffix)
+
+            # Same prefix reuse as Llama.generate: keep the longest common
+            # prefix of what was evaluated, minus the last prompt token so
+            # at least one is evaluated; eval() drops the KV entries past
+            # n_tokens before decoding
+            evaluated = self.llm.input_ids[:self.llm.n_tokens].tolist()
+            self.llm.n_tokens = self.llm.longest_token_prefix(evaluated, tokens[:-1])
+            self.llm.eval(tokens[self.llm.n_tokens:])
+
+            # Llama.scores is only filled with logits_all=True (an
+            # n_ctx x n_vocab buffer); read the last token's logits from
+            # the context instead
+            logits = llama_cpp.llama_get_logits_ith(self.llm.ctx, -1)
+            rows.append(np.ctypeslib.as_array(logits, shape=(self.llm.n_vocab(),)).copy())
+
+        return torch.from_numpy(np.stack(rows))
+
+# =========================
+# BACKEND SELECTION
+# =========================
+
+def resolve_backend(backend):
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown backend {backend!r}; expected one of {BACKENDS}")
+
+    if backend == "auto":
+        import torch
+        return "transformers" if torch.cuda.is_available() else "int8"
+
+    return backend
+
+
+def backend_id(model_name, backend, gguf_path=None):
+    """Identifies the weights actually run, for result cache keys."""
+    backend = resolve_backend(backend)
+
+    if backend == "gguf":
+        return f"gguf:{os.path.basename(gguf_path or '')}"
+
+    return f"{model_name}:{backend}"
+
+
+def quantize_int8(model):
+    """
+    Dynamic int8 quantization of every linear layer: weights are stored
+    as int8 and activations quantized on the fly, roughly quartering the
+    weight memory of a float32 CPU model.
+    """
+    import torch
+
+    return torch.ao.quantization.quantize_dynamic(
+        model, {torch.nn.Linear}, dtype=torch.qint8
+    )
+
+
+def load_backend(model_name, prefix, backend=DEFAULT_BACKEND, gguf_path=None, **model_kwargs):
+    """
+    Load a model behind the PrefixCache interface (tokenize, generate,
+    next_token_logits, length) with the instruction prefix precomputed.
+    """
+    import torch
+    from transformers import AutoTokenizer, AutoModelForCausalLM
+
+    backend = resolve_backend(backend)
+
+    if backend == "gguf":
+        if not gguf_path:
+            raise ValueError("The gguf backend needs the path of a GGUF model file")
+        return LlamaCppBackend(gguf_path, prefix)
+
+    tokenizer = AutoTokenizer.from_pretrained(model_name, **model_kwargs)
+
+    if tokenizer.pad_token is None:
+        tokenizer.pad_token = tokenizer.eos_token
+
+    if backend == "int8":
+        model = AutoModelForCausalLM.from_pretrained(
+            model_name,
+            torch_dtype=torch.float32,
+            **model_kwargs
+        )
+        model = quantize_int8(model)
+    else:
+        cuda = torch.cuda.is_available()
+        model = AutoModelForCausalLM.from_pretrained(
+            model_name,
+            torch_dtype=torch.float16 if cuda else torch.float32,
+            device_map="auto",
+            **model_kwargs
+        )
+
+    model.eval()
+
+    return PrefixCache(tokenizer, model, prefix)
@@ -0,0 +1,85 @@
+import json
+import os
+import urllib.error
+import urllib.request
+
+# =========================
+# CONFIG
+# =========================
+
+# Scripts use the model server when this is set (or passed as --server)
+MODEL_SERVER_URL = os.getenv("MODEL_SERVER_URL")
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+
+CLIENT_TIMEOUT = 1800  # seconds; a long syllabus can take minutes on CPU
+CLIENT_BATCH_SIZE = 64  # items per HTTP request
+
+# =========================
+# CLIENT
+# =========================
+
+class ModelClient:
+    """
+    Thin client for model_server.py. Requests from concurrent clients
+    are micro-batched together on the server side.
+
+    encode() mirrors SentenceTransformer.encode, so a client can stand in
+    for a locally loaded embedder.
+    """
+
+    def __init__(self, url=None, timeout=CLIENT_TIMEOUT):
+        self.url = (url or MODEL_SERVER_URL or f"http://{DEFAULT_HOST}:{DEFAULT_PORT}").rstrip("/")
+        self.timeout = timeout
+
+    def _request(self, path, payload=None):
+        data = json.dumps(payload).encode("utf-8") if payload is not None else None
+        request = urllib.request.Request(
+            self.url + path,
+            data=data,
+            headers={"Content-Type": "application/json"}
+        )
+
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                return json.loads(response.read())
+        except urllib.error.HTTPError as e:
+            try:
+                detail = json.loads(e.read()).get("error", "")
+            except ValueError:
+                detail = ""
+            raise RuntimeError(f"Model server returned {e.code} for {path}: {detail}") from None
+
+    def health(self):
+        return self._request("/health")
+
+    def classify(self, documents, mode="generate"):
+        """(title, raw_text, file_type) tuples -> (role, confidence) tuples."""
+        predictions = []
+
+        for start in range(0, len(documents), CLIENT_BATCH_SIZE):
+            response = self._request("/classify", {
+                "documents": [list(doc) for doc in documents[start:start + CLIENT_BATCH_SIZE]],
+                "mode": mode,
+            })
+            predictions.extend(tuple(p) for p in response["predictions"])
+
+        return predictions
+
+    def extract(self, text, mode="windowed"):
+        return self._request("/extract", {"text": text, "mode": mode})["result"]
+
+    def encode(self, texts, batch_size=CLIENT_BATCH_SIZE, normalize_embeddings=False, **kwargs):
+        import numpy as np
+
+        embeddings = []
+
+        for start in range(0, len(texts), batch_size):
+            response = self._request("/embed", {
+                "texts": list(texts[start:start + batch_size]),
+                "normalize": normalize_embeddings,
+            })
+            embeddings.extend(response["embeddings"])
+
+        return np.asarray(embeddings, dtype=np.float32)
@@ -0,0 +1,292 @@
+import json
+import time
+import queue
+import argparse
+import threading
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import infer_document_roles
+import infer_units_topics
+from chunk_documents import EMBED_MODEL_NAME
+from llm_cache import LLMCache
+from llm_inference import BACKENDS
+from model_client import DEFAULT_HOST, DEFAULT_PORT
+
+# =========================
+# CONFIG
+# =========================
+
+# A batch is dispatched when it is full or this long after its first
+# item, whichever comes first
+MAX_BATCH_WAIT = 0.02  # seconds
+
+CLASSIFY_MAX_BATCH = 32  # split further into length-sorted batches by infer_roles
+EXTRACT_MAX_BATCH = infer_units_topics.WINDOW_BATCH_SIZE
+EMBED_MAX_BATCH = 64
+
+# =========================
+# MICRO-BATCHING
+# =========================
+
+class MicroBatcher:
+    """
+    Collects items submitted by concurrent request threads and runs them
+    through `fn(items) -> results` on one worker thread, in batches of up
+    to max_batch_size. `lock` serializes batchers sharing one model.
+    """
+
+    def __init__(self, fn, max_batch_size, max_wait=MAX_BATCH_WAIT, lock=None):
+        self.fn = fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.lock = lock or threading.Lock()
+        self.batches = 0
+        self.items = 0
+
+        self._queue = queue.Queue()
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def submit(self, item):
+        future = Future()
+        self._queue.put((item, future))
+        return future
+
+    def map(self, items):
+        futures = [self.submit(item) for item in items]
+        return [future.result() for future in futures]
+
+    def _next_batch(self):
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait
+
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+
+            try:
+                with self.lock:
+                    results = self.fn([item for item, _ in batch])
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+
+            self.batches += 1
+            self.items += len(batch)
+
+            for (_, future), result in zip(batch, results):
+                future.set_result(result)
+
+# =========================
+# MODELS
+# =========================
+
+class ModelServer:
+    """
+    Keeps the role classifier, the syllabus extractor and the embedder
+    resident, loading each on first use (or up front with preload()).
+    """
+
+    def __init__(self, backend="auto", roles_gguf=None, units_gguf=None, cache=None):
+        self.backend = backend
+        self.roles_gguf = roles_gguf
+        self.units_gguf = units_gguf
+        self.cache = cache
+
+        self._batchers = {}
+        self._batchers_lock = threading.Lock()
+        self._model_locks = {name: threading.Lock() for name in ("roles", "units", "embed")}
+        self._embedder = None
+
+    def preload(self):
+        infer_document_roles.load_model(self.backend, self.roles_gguf)
+        print("✔ Role classifier loaded")
+        infer_units_topics.load_model(self.backend, self.units_gguf)
+        print("✔ Syllabus extractor loaded")
+        self.embedder()
+        print("✔ Embedder loaded")
+
+    def embedder(self):
+        if self._embedder is None:
+            from sentence_transformers import SentenceTransformer
+            self._embedder = SentenceTransformer(EMBED_MODEL_NAME)
+        return self._embedder
+
+    def batcher(self, key, model, fn, max_batch_size):
+        with self._batchers_lock:
+            if key not in self._batchers:
+                self._batchers[key] = MicroBatcher(
+                    fn, max_batch_size, lock=self._model_locks[model]
+                )
+            return self._batchers[key]
+
+    def classify(self, documents, mode):
+        if mode not in ("generate", "score"):
+            raise ValueError(f"Unknown mode {mode!r}")
+
+        batcher = self.batcher(
+            ("classify", mode), "roles",
+            lambda docs: infer_document_roles.infer_roles(
+                docs,
+                mode=mode,
+                cache=self.cache,
+                backend=self.backend,
+                gguf_path=self.roles_gguf
+            ),
+            CLASSIFY_MAX_BATCH
+        )
+        return batcher.map([tuple(doc) for doc in documents])
+
+    def extract(self, text, mode):
+        if mode not in ("single", "windowed"):
+            raise ValueError(f"Unknown mode {mode!r}")
+
+        texts, max_new_tokens = infer_units_topics.extraction_inputs(text, mode)
+
+        # Windows of concurrent requests share generate() batches
+        batcher = self.batcher(
+            ("extract", mode), "units",
+            lambda batch: infer_units_topics.extract_batch(
+                batch, max_new_tokens, self.cache, self.backend, self.units_gguf
+            ),
+            EXTRACT_MAX_BATCH
+        )
+        return infer_units_topics.combine_results(batcher.map(texts), mode)
+
+    def embed(self, texts, normalize):
+        batcher = self.batcher(
+            ("embed", normalize), "embed",
+            lambda batch: self.embedder().encode(
+                batch,
+                batch_size=EMBED_MAX_BATCH,
+                normalize_embeddings=normalize
+            ).tolist(),
+            EMBED_MAX_BATCH
+        )
+        return batcher.map(texts)
+
+    def stats(self):
+        with self._batchers_lock:
+            batchers = {
+                "/".join(str(part) for part in key): {"batches": b.batches, "items": b.items}
+                for key, b in self._batchers.items()
+            }
+        return {
+            "batchers": batchers,
+            "llm_cache": self.cache.stats() if self.cache is not None else None,
+        }
+
+# =========================
+# HTTP
+# =========================
+
+ROUTES = {
+    "/classify": lambda models, body: {
+        "predictions": models.classify(body["documents"], body.get("mode", "generate"))
+    },
+    "/extract": lambda models, body: {
+        "result": models.extract(body["text"], body.get("mode", infer_units_topics.DEFAULT_MODE))
+    },
+    "/embed": lambda models, body: {
+        "embeddings": models.embed(body["texts"], bool(body.get("normalize", False)))
+    },
+}
+
+
+class Handler(BaseHTTPRequestHandler):
+    def send_json(self, status, payload):
+        data = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if self.path != "/health":
+            self.send_json(404, {"error": f"Unknown path {self.path}"})
+            return
+
+        self.send_json(200, {"status": "ok", **self.server.models.stats()})
+
+    def do_POST(self):
+        route = ROUTES.get(self.path)
+        if route is None:
+            self.send_json(404, {"error": f"Unknown path {self.path}"})
+            return
+
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            body = json.loads(self.rfile.read(length) or b"{}")
+            payload = route(self.server.models, body)
+        except (KeyError, TypeError, json.JSONDecodeError) as e:
+            self.send_json(400, {"error": f"Bad request: {e!r}"})
+            return
+        except ValueError as e:
+            self.send_json(422, {"error": str(e)})
+            return
+        except Exception as e:
+            print(f"Error serving {self.path}: {e!r}")
+            self.send_json(500, {"error": repr(e)})
+            return
+
+        self.send_json(200, payload)
+
+    def log_message(self, format, *args):
+        pass  # one line per request is too noisy under micro-batching
+
+
+def make_server(models, host=DEFAULT_HOST, port=DEFAULT_PORT):
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    server.models = models
+    return server
+
+# =========================
+# MAIN
+# =========================
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve the pipeline's models over localhost HTTP")
+    parser.add_argument("--host", default=DEFAULT_HOST)
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--backend", choices=BACKENDS, default="auto")
+    parser.add_argument("--roles-gguf", help="GGUF model file for role classification")
+    parser.add_argument("--units-gguf", help="GGUF model file for syllabus extraction")
+    parser.add_argument("--preload", action="store_true", help="load every model before serving")
+    parser.add_argument("--no-llm-cache", action="store_true")
+    args = parser.parse_args(argv)
+
+    cache = None if args.no_llm_cache else LLMCache()
+    models = ModelServer(args.backend, args.roles_gguf, args.units_gguf, cache)
+
+    if args.preload:
+        models.preload()
+
+    server = make_server(models, args.host, args.port)
+    print(f"✔ Model server listening on http://{args.host}:{args.port}")
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if cache is not None:
+            cache.close()
+
+
+if __name__ == "__main__":
+    main()
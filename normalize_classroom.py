@@ -1,13 +1,17 @@
+import argparse
 import json
 import uuid
 import psycopg2
-from datetime import datetime
+from datetime import date, datetime
+from psycopg2.extras import execute_values
+
+from jsonl_io import iter_records
 
 # =========================
 # CONFIG
 # =========================
 
-JSON_PATH = "classroom_dump.json"
+JSON_PATH = "classroom_dump.jsonl"
 
 DB_CONFIG = {
     "dbname": "studybuddy",
@@ -17,66 +21,69 @@ DB_CONFIG = {
     "port": "5432"
 }
 
-# =========================
-# DB CONNECTION
-# =========================
+BATCH_SIZE = 500
+
+# Namespace for stable IDs derived from Classroom / Drive identifiers
+ID_NAMESPACE = uuid.UUID("8f0d5c4e-2b7a-4c59-9a51-3f1f6f0e7a10")
 
-conn = psycopg2.connect(**DB_CONFIG)
-cursor = conn.cursor()
+# Columns compared to decide whether an existing row changed
+COURSE_FIELDS = ("name", "section", "course_state", "is_open_elective")
+DOCUMENT_FIELDS = ("course_id", "gc_material_id", "drive_file_id", "title", "file_type")
+ASSESSMENT_FIELDS = ("course_id", "type", "title", "due_date", "max_points", "source", "inferred")
 
 # =========================
 # SCHEMA CREATION
 # =========================
 
-cursor.execute("""
-CREATE TABLE IF NOT EXISTS courses (
-    id TEXT PRIMARY KEY,
-    gc_course_id TEXT UNIQUE NOT NULL,
-    name TEXT NOT NULL,
-    section TEXT,
-    course_state TEXT,
-    is_open_elective BOOLEAN,
-    created_at TIMESTAMP,
-    updated_at TIMESTAMP
-);
-""")
-
-cursor.execute("""
-CREATE TABLE IF NOT EXISTS documents (
-    id TEXT PRIMARY KEY,
-    course_id TEXT REFERENCES courses(id) ON DELETE CASCADE,
-    gc_material_id TEXT,
-    drive_file_id TEXT,
-    title TEXT,
-    file_type TEXT,
-    source TEXT,
-    parsed BOOLEAN,
-    created_at TIMESTAMP
-);
-""")
-
-cursor.execute("""
-CREATE TABLE IF NOT EXISTS assessments (
-    id TEXT PRIMARY KEY,
-    course_id TEXT REFERENCES courses(id) ON DELETE CASCADE,
-    type TEXT,
-    title TEXT,
-    due_date DATE,
-    max_points INTEGER,
-    source TEXT,
-    inferred BOOLEAN,
-    created_at TIMESTAMP
-);
-""")
-
-conn.commit()
+def ensure_schema(cursor):
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS courses (
+        id TEXT PRIMARY KEY,
+        gc_course_id TEXT UNIQUE NOT NULL,
+        name TEXT NOT NULL,
+        section TEXT,
+        course_state TEXT,
+        is_open_elective BOOLEAN,
+        created_at TIMESTAMP,
+        updated_at TIMESTAMP
+    );
+    """)
+
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS documents (
+        id TEXT PRIMARY KEY,
+        course_id TEXT REFERENCES courses(id) ON DELETE CASCADE,
+        gc_material_id TEXT,
+        drive_file_id TEXT,
+        title TEXT,
+        file_type TEXT,
+        source TEXT,
+        parsed BOOLEAN,
+        created_at TIMESTAMP
+    );
+    """)
+
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS assessments (
+        id TEXT PRIMARY KEY,
+        course_id TEXT REFERENCES courses(id) ON DELETE CASCADE,
+        type TEXT,
+        title TEXT,
+        due_date DATE,
+        max_points INTEGER,
+        source TEXT,
+        inferred BOOLEAN,
+        created_at TIMESTAMP
+    );
+    """)
 
 # =========================
 # HELPERS
 # =========================
 
-def gen_uuid():
-    return str(uuid.uuid4())
+def stable_id(kind, *parts):
+    """Same Classroom / Drive identifiers always map to the same row ID."""
+    return str(uuid.uuid5(ID_NAMESPACE, ":".join([kind, *map(str, parts)])))
 
 
 def safe_lower(text):
@@ -100,7 +107,18 @@ def extract_due_date(coursework):
     due = coursework.get("dueDate")
     if not due:
         return None
-    return f"{due.get('year')}-{due.get('month'):02d}-{due.get('day'):02d}"
+    return date(due.get("year"), due.get("month"), due.get("day"))
+
+
+def extract_max_points(coursework):
+    """
+    maxPoints as the INTEGER column stores it; Postgres rounds a
+    fractional value half to even, like round(), so diffs stay stable.
+    """
+    max_points = coursework.get("maxPoints")
+    if max_points is None:
+        return None
+    return round(max_points)
 
 
 def contains_exam_keywords(text):
@@ -115,152 +133,335 @@ def contains_exam_keywords(text):
     text = safe_lower(text)
     return any(k in text for k in keywords)
 
-with open(JSON_PATH, "r") as f:
-    classroom_data = json.load(f)
-
-print(f"Loaded {len(classroom_data)} courses")
-
 # =========================
-# NORMALIZATION
+# NORMALIZATION (PURE)
 # =========================
 
-course_id_map = {}  # gc_course_id -> db_course_id
+def build_rows(classroom_data, existing_course_ids=None):
+    """
+    Turn the Classroom dump into rows for courses, documents and
+    assessments, keyed by their stable IDs. Courses that already exist
+    keep their current ID (rows from before stable IDs were introduced).
+    """
+    existing_course_ids = existing_course_ids or {}
+    rows = {"courses": {}, "documents": {}, "assessments": {}}
 
-for course_block in classroom_data:
+    for course_block in classroom_data:
 
-    # -------------------------
-    # COURSES
-    # -------------------------
-    course = course_block["course"]
+        # -------------------------
+        # COURSES
+        # -------------------------
+        course = course_block["course"]
 
-    db_course_id = gen_uuid()
-    gc_course_id = course["id"]
+        gc_course_id = course["id"]
+        db_course_id = existing_course_ids.get(gc_course_id) or stable_id("course", gc_course_id)
 
-    course_name = course["name"]
-    section = course.get("section", "")
-    course_state = course["courseState"]
+        course_name = course["name"]
+        section = course.get("section", "")
 
-    is_open_elective = (
-        "open elective" in safe_lower(course_name)
-        or safe_lower(section) == "open elective"
-        or course_name.lower().startswith("oe")
-    )
+        is_open_elective = (
+            "open elective" in safe_lower(course_name)
+            or safe_lower(section) == "open elective"
+            or course_name.lower().startswith("oe")
+        )
 
-    cursor.execute("""
+        rows["courses"][gc_course_id] = {
+            "id": db_course_id,
+            "gc_course_id": gc_course_id,
+            "name": course_name,
+            "section": section,
+            "course_state": course["courseState"],
+            "is_open_elective": is_open_elective,
+        }
+
+        # -------------------------
+        # DOCUMENTS (MATERIALS)
+        # -------------------------
+        for material in course_block.get("materials", []):
+            gc_material_id = material["id"]
+
+            for item in material.get("materials", []):
+                drive = item.get("driveFile", {}).get("driveFile")
+                if not drive:
+                    continue
+
+                title = drive.get("title", "")
+                drive_file_id = drive["id"]
+                doc_id = stable_id("document", gc_material_id, drive_file_id)
+
+                rows["documents"][doc_id] = {
+                    "id": doc_id,
+                    "course_id": db_course_id,
+                    "gc_material_id": gc_material_id,
+                    "drive_file_id": drive_file_id,
+                    "title": title,
+                    "file_type": infer_file_type(title),
+                }
+
+        # -------------------------
+        # ASSESSMENTS (COURSEWORK)
+        # -------------------------
+        for work in course_block.get("coursework", []):
+            assessment_id = stable_id("coursework", work["id"])
+
+            rows["assessments"][assessment_id] = {
+                "id": assessment_id,
+                "course_id": db_course_id,
+                "type": work.get("workType", "unknown").lower(),
+                "title": work.get("title", ""),
+                "due_date": extract_due_date(work),
+                "max_points": extract_max_points(work),
+                "source": "coursework",
+                "inferred": False,
+            }
+
+        # -------------------------
+        # ASSESSMENTS (ANNOUNCEMENTS - INFERRED)
+        # -------------------------
+        for announcement in course_block.get("announcements", []):
+            text = announcement.get("text", "")
+
+            if not contains_exam_keywords(text):
+                continue
+
+            assessment_id = stable_id("announcement", announcement["id"])
+
+            rows["assessments"][assessment_id] = {
+                "id": assessment_id,
+                "course_id": db_course_id,
+                "type": "class_test",
+                "title": "Inferred from announcement",
+                "due_date": None,
+                "max_points": None,
+                "source": "announcement",
+                "inferred": True,
+            }
+
+    return rows
+
+
+def diff_rows(new_rows, existing_rows, fields):
+    """Split rows into added / changed / removed against what is stored."""
+    added = [key for key in new_rows if key not in existing_rows]
+    changed = [
+        key for key in new_rows
+        if key in existing_rows
+        and any(new_rows[key][f] != existing_rows[key][f] for f in fields)
+    ]
+    removed = [key for key in existing_rows if key not in new_rows]
+    return {"added": added, "changed": changed, "removed": removed}
+
+# =========================
+# DB STATE
+# =========================
+
+def load_existing(cursor, table, key, fields, course_ids=None):
+    columns = ", ".join((key,) + tuple(f for f in fields if f != key))
+    query = f"SELECT {columns} FROM {table}"
+    params = None
+
+    if course_ids is not None:
+        query += " WHERE course_id = ANY(%s)"
+        params = (list(course_ids),)
+
+    cursor.execute(query, params)
+    names = [desc[0] for desc in cursor.description]
+    return {row[0]: dict(zip(names, row)) for row in cursor.fetchall()}
+
+# =========================
+# BATCHED UPSERTS
+# =========================
+
+def upsert_courses(cursor, rows):
+    now = datetime.utcnow()
+    execute_values(cursor, """
         INSERT INTO courses (
             id, gc_course_id, name, section,
             course_state, is_open_elective,
             created_at, updated_at
         )
-        VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
-    """, (
-        db_course_id,
-        gc_course_id,
-        course_name,
-        section,
-        course_state,
-        is_open_elective,
-        datetime.utcnow(),
-        datetime.utcnow()
-    ))
-
-    course_id_map[gc_course_id] = db_course_id
-
-    # -------------------------
-    # DOCUMENTS (MATERIALS)
-    # -------------------------
-    for material in course_block.get("materials", []):
-        gc_material_id = material["id"]
-
-        for item in material.get("materials", []):
-            drive = item.get("driveFile", {}).get("driveFile")
-            if not drive:
-                continue
+        VALUES %s
+        ON CONFLICT (gc_course_id) DO UPDATE SET
+            name = EXCLUDED.name,
+            section = EXCLUDED.section,
+            course_state = EXCLUDED.course_state,
+            is_open_elective = EXCLUDED.is_open_elective,
+            updated_at = EXCLUDED.updated_at
+    """, [
+        (
+            r["id"], r["gc_course_id"], r["name"], r["section"],
+            r["course_state"], r["is_open_elective"], now, now
+        )
+        for r in rows
+    ], page_size=BATCH_SIZE)
+
+
+def upsert_documents(cursor, rows):
+    # parsed / raw_text / role are left alone so unchanged files are not
+    # re-processed downstream
+    now = datetime.utcnow()
+    execute_values(cursor, """
+        INSERT INTO documents (
+            id, course_id, gc_material_id,
+            drive_file_id, title,
+            file_type, source, parsed, created_at
+        )
+        VALUES %s
+        ON CONFLICT (id) DO UPDATE SET
+            course_id = EXCLUDED.course_id,
+            title = EXCLUDED.title,
+            file_type = EXCLUDED.file_type
+    """, [
+        (
+            r["id"], r["course_id"], r["gc_material_id"],
+            r["drive_file_id"], r["title"],
+            r["file_type"], "classroom", False, now
+        )
+        for r in rows
+    ], page_size=BATCH_SIZE)
+
+
+def upsert_assessments(cursor, rows):
+    now = datetime.utcnow()
+    execute_values(cursor, """
+        INSERT INTO assessments (
+            id, course_id, type, title,
+            due_date, max_points,
+            source, inferred, created_at
+        )
+        VALUES %s
+        ON CONFLICT (id) DO UPDATE SET
+            course_id = EXCLUDED.course_id,
+            type = EXCLUDED.type,
+            title = EXCLUDED.title,
+            due_date = EXCLUDED.due_date,
+            max_points = EXCLUDED.max_points
+    """, [
+        (
+            r["id"], r["course_id"], r["type"], r["title"],
+            r["due_date"], r["max_points"],
+            r["source"], r["inferred"], now
+        )
+        for r in rows
+    ], page_size=BATCH_SIZE)
+
+
+def delete_rows(cursor, table, key, values):
+    if not values:
+        return
+    cursor.execute(f"DELETE FROM {table} WHERE {key} = ANY(%s)", (list(values),))
+
+# =========================
+# SYNC
+# =========================
 
-            doc_id = gen_uuid()
-            title = drive.get("title", "")
-            drive_file_id = drive["id"]
-            file_type = infer_file_type(title)
-
-            cursor.execute("""
-                INSERT INTO documents (
-                    id, course_id, gc_material_id,
-                    drive_file_id, title,
-                    file_type, source, parsed, created_at
-                )
-                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
-            """, (
-                doc_id,
-                db_course_id,
-                gc_material_id,
-                drive_file_id,
-                title,
-                file_type,
-                "classroom",
-                False,
-                datetime.utcnow()
-            ))
-
-    # -------------------------
-    # ASSESSMENTS (COURSEWORK)
-    # -------------------------
-    for work in course_block.get("coursework", []):
-        assessment_id = gen_uuid()
-
-        due_date = extract_due_date(work)
-
-        cursor.execute("""
-            INSERT INTO assessments (
-                id, course_id, type, title,
-                due_date, max_points,
-                source, inferred, created_at
-            )
-            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
-        """, (
-            assessment_id,
-            db_course_id,
-            work.get("workType", "unknown").lower(),
-            work.get("title", ""),
-            due_date,
-            work.get("maxPoints"),
-            "coursework",
-            False,
-            datetime.utcnow()
-        ))
-
-    # -------------------------
-    # ASSESSMENTS (ANNOUNCEMENTS - INFERRED)
-    # -------------------------
-    for announcement in course_block.get("announcements", []):
-        text = announcement.get("text", "")
-
-        if not contains_exam_keywords(text):
-            continue
-
-        assessment_id = gen_uuid()
-
-        cursor.execute("""
-            INSERT INTO assessments (
-                id, course_id, type, title,
-                source, inferred, created_at
-            )
-            VALUES (%s, %s, %s, %s, %s, %s, %s)
-        """, (
-            assessment_id,
-            db_course_id,
-            "class_test",
-            "Inferred from announcement",
-            "announcement",
-            True,
-            datetime.utcnow()
-        ))
+def sync(cursor, classroom_data, prune=False, dry_run=False):
+    """
+    Upsert the dump into the DB, writing only added or changed rows.
+    Rows no longer in the dump are reported, and deleted with prune.
+    Returns the diff report.
+    """
+    existing_courses = load_existing(cursor, "courses", "gc_course_id", ("id",) + COURSE_FIELDS)
+    rows = build_rows(
+        classroom_data,
+        {gc_id: row["id"] for gc_id, row in existing_courses.items()}
+    )
+
+    # Documents / assessments are only compared within the synced courses
+    course_ids = [r["id"] for r in rows["courses"].values()]
+    existing_documents = load_existing(cursor, "documents", "id", DOCUMENT_FIELDS, course_ids)
+    existing_assessments = load_existing(cursor, "assessments", "id", ASSESSMENT_FIELDS, course_ids)
+
+    report = {
+        "courses": diff_rows(rows["courses"], existing_courses, COURSE_FIELDS),
+        "documents": diff_rows(rows["documents"], existing_documents, DOCUMENT_FIELDS),
+        "assessments": diff_rows(rows["assessments"], existing_assessments, ASSESSMENT_FIELDS),
+    }
+
+    if dry_run:
+        return report
+
+    writers = {
+        "courses": upsert_courses,
+        "documents": upsert_documents,
+        "assessments": upsert_assessments,
+    }
+
+    # Courses first so the document / assessment FKs resolve
+    for table, upsert in writers.items():
+        diff = report[table]
+        dirty = [rows[table][key] for key in diff["added"] + diff["changed"]]
+        if dirty:
+            upsert(cursor, dirty)
+
+    if prune:
+        delete_rows(cursor, "documents", "id", report["documents"]["removed"])
+        delete_rows(cursor, "assessments", "id", report["assessments"]["removed"])
+        delete_rows(cursor, "courses", "gc_course_id", report["courses"]["removed"])
+
+    return report
+
+
+def print_report(report, prune):
+    for table, diff in report.items():
+        removed_label = "removed" if prune else "stale (use --prune)"
+        print(
+            f"  {table:12} +{len(diff['added'])} added, "
+            f"~{len(diff['changed'])} changed, "
+            f"-{len(diff['removed'])} {removed_label}"
+        )
 
 # =========================
-# COMMIT & CLOSE
+# MAIN
 # =========================
 
-conn.commit()
-cursor.close()
-conn.close()
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Normalize the Classroom dump into PostgreSQL")
+    parser.add_argument(
+        "--input", default=JSON_PATH,
+        help="JSONL dump (.gz / .zst allowed); legacy .json arrays also work"
+    )
+    parser.add_argument(
+        "--prune", action="store_true",
+        help="delete rows that are no longer in the dump"
+    )
+    parser.add_argument(
+        "--dry-run", action="store_true",
+        help="report the diff without writing"
+    )
+    parser.add_argument("--report", help="write the diff report as JSON to this path")
+    args = parser.parse_args(argv)
+
+    # Streamed: course blocks are read one at a time
+    classroom_data = iter_records(args.input)
+
+    conn = psycopg2.connect(**DB_CONFIG)
+    cursor = conn.cursor()
+
+    ensure_schema(cursor)
+    conn.commit()
+
+    try:
+        report = sync(cursor, classroom_data, prune=args.prune, dry_run=args.dry_run)
+        if args.dry_run:
+            conn.rollback()
+        else:
+            conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+        conn.close()
+
+    print_report(report, args.prune)
+
+    if args.report:
+        with open(args.report, "w") as f:
+            json.dump(report, f, indent=2)
+
+    print("Normalization completed successfully")
+
 
-print("Normalization completed successfully")
+if __name__ == "__main__":
+    main()
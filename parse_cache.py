@@ -0,0 +1,117 @@
+import gzip
+import hashlib
+import os
+import tempfile
+
+# =========================
+# CONFIG
+# =========================
+
+PARSE_CACHE_DIR = ".parse_cache"
+
+# Bump when the parsers or elements_to_text change output format
+PARSER_VERSION = "2"
+
+# =========================
+# CACHE KEYS
+# =========================
+
+def metadata_key(drive_file_id, metadata):
+    """
+    Key from Drive metadata, available before downloading. Prefers the
+    md5Checksum; native Google files have none, so fall back to
+    modifiedTime.
+    """
+    version = metadata.get("md5Checksum") or metadata.get("modifiedTime")
+    if not version:
+        return None
+    return f"drive:{PARSER_VERSION}:{drive_file_id}:{version}"
+
+
+def content_key(file_bytes):
+    """Key from the downloaded bytes; also catches copies of one file."""
+    digest = hashlib.sha256(file_bytes).hexdigest()
+    return f"sha256:{PARSER_VERSION}:{digest}"
+
+# =========================
+# DISK CACHE
+# =========================
+
+class ParseCache:
+    """
+    Parsed text (elements_to_text output) stored gzip-compressed on local
+    disk, one file per key.
+    """
+
+    def __init__(self, root=PARSE_CACHE_DIR):
+        self.root = root
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(root, exist_ok=True)
+
+    def _path(self, key):
+        digest = hashlib.sha256(key.encode("utf-8")).hexdigest()
+        return os.path.join(self.root, digest[:2], f"{digest}.txt.gz")
+
+    def get(self, key):
+        if key is None:
+            return None
+
+        try:
+            with gzip.open(self._path(key), "rt", encoding="utf-8") as f:
+                text = f.read()
+        except FileNotFoundError:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        return text
+
+    def put(self, key, text):
+        if key is None:
+            return
+
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        # Write then rename so readers never see a partial entry
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+        try:
+            with os.fdopen(fd, "wb") as raw, gzip.open(raw, "wt", encoding="utf-8") as f:
+                f.write(text)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+
+# =========================
+# CACHED FETCH
+# =========================
+
+def fetch_with_cache(fetcher, cache, file_id, metadata=None):
+    """
+    Look the file up by Drive metadata first and download only on a miss.
+    Pass metadata already fetched for the file to skip a second request.
+
+    Returns (cached_text, file_bytes, keys): cached_text is set on a hit,
+    otherwise file_bytes holds the download and keys are the entries to
+    fill once it has been parsed.
+    """
+    if metadata is None:
+        metadata = fetcher.metadata(file_id)
+
+    meta_key = metadata_key(file_id, metadata)
+
+    cached_text = cache.get(meta_key)
+    if cached_text is not None:
+        return cached_text, None, []
+
+    file_bytes = fetcher(file_id)
+    bytes_key = content_key(file_bytes)
+
+    cached_text = cache.get(bytes_key)
+    if cached_text is not None:
+        cache.put(meta_key, cached_text)
+        return cached_text, None, []
+
+    return None, file_bytes, [meta_key, bytes_key]
@@ -1,16 +1,18 @@
-import io
-import os
-import tempfile
+import argparse
+from collections import deque
+from functools import partial
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
 import psycopg2
 
-from googleapiclient.discovery import build
-from googleapiclient.http import MediaIoBaseDownload
-from google.oauth2.credentials import Credentials
 from google_auth import get_credentials
-
-from unstructured.partition.pdf import partition_pdf
-from unstructured.partition.docx import partition_docx
-from unstructured.partition.pptx import partition_pptx
+from drive_download import DriveFetcher, prefetch_downloads
+from parse_cache import ParseCache, fetch_with_cache
+from document_parsers import (
+    HEAVY_FILE_TYPES,
+    PARSERS,
+    parse_bytes,
+)
 
 # =========================
 # CONFIG
@@ -26,145 +28,229 @@ DB_CONFIG = {
 
 SCOPES = ["https://www.googleapis.com/auth/drive.readonly"]
 
+SUPPORTED_FILE_TYPES = set(PARSERS)
+
+# Parsed-but-unsubmitted files held per worker, bounds memory use
+BACKLOG_PER_WORKER = 2
+
 # =========================
-# DB CONNECTION
+# DB WRITER
 # =========================
 
-conn = psycopg2.connect(**DB_CONFIG)
-cursor = conn.cursor()
+def store_parsed(conn, cursor, doc_id, extracted_text):
+    """Write the parsed text; returns True only if it was committed."""
+    if not extracted_text.strip():
+        print(f" No text extracted for {doc_id}, skipping")
+        return False
+
+    try:
+        cursor.execute("""
+            UPDATE documents
+            SET raw_text = %s,
+                parsed = TRUE
+            WHERE id = %s
+        """, (
+            extracted_text,
+            doc_id
+        ))
+
+        conn.commit()
+        print(f"✔ Parsed and stored {doc_id}")
+        return True
+
+    except Exception as e:
+        conn.rollback()
+        print(f" Failed to store document {doc_id}: {e}")
+        return False
+
+
+def cache_parsed(cache, cache_keys, extracted_text):
+    if cache is None:
+        return
+    for key in cache_keys:
+        cache.put(key, extracted_text)
 
 # =========================
-# GOOGLE DRIVE CLIENT
+# DOWNLOAD (+ CACHE LOOKUP)
 # =========================
 
-creds = get_credentials(SCOPES)
-drive_service = build("drive", "v3", credentials=creds)
+def fetch_uncached(fetcher, file_id):
+    return None, fetcher(file_id), []
 
 # =========================
-# FILE DOWNLOAD
+# SERIAL MODE
 # =========================
 
-def download_drive_file(file_id) -> bytes:
-    request = drive_service.files().get_media(fileId=file_id)
-    fh = io.BytesIO()
-    downloader = MediaIoBaseDownload(fh, request)
+def run_serial(conn, cursor, downloads, cache):
+    for (doc_id, _, file_type), fetched, error in downloads:
+        print(f"\nParsing document {doc_id} ({file_type})")
 
-    done = False
-    while not done:
-        _, done = downloader.next_chunk()
+        if error is not None:
+            print(f" Failed to download document {doc_id}: {error}")
+            continue
+
+        cached_text, file_bytes, cache_keys = fetched
 
-    fh.seek(0)
-    return fh.read()
+        if cached_text is not None:
+            print(" Parse cache hit")
+            store_parsed(conn, cursor, doc_id, cached_text)
+            continue
+
+        try:
+            extracted_text = parse_bytes(file_type, file_bytes)
+        except Exception as e:
+            print(f" Failed to parse document {doc_id}: {e}")
+            continue
+
+        cache_parsed(cache, cache_keys, extracted_text)
+        store_parsed(conn, cursor, doc_id, extracted_text)
 
 # =========================
-# UNSTRUCTURED PARSERS
+# PROCESS POOL MODE
 # =========================
 
-def elements_to_text(elements):
+def run_parallel(conn, cursor, downloads, cache, workers):
     """
-    Convert unstructured elements into a clean, LLM-friendly text
-    with semantic tags preserved.
+    Parse on two process pools: one for heavy hi-res PDFs and one for
+    light DOCX/PPTX files, so a slow PDF never blocks quick files.
+    Results come back to this process, the single DB writer.
     """
-    lines = []
+    light_workers = max(1, workers // 4)
+    heavy_workers = max(1, workers - light_workers)
 
-    for el in elements:
-        text = el.text.strip() if el.text else ""
-        if not text:
-            continue
+    lanes = {
+        "heavy": {"workers": heavy_workers, "queue": deque(), "in_flight": 0},
+        "light": {"workers": light_workers, "queue": deque(), "in_flight": 0},
+    }
+    max_backlog = BACKLOG_PER_WORKER * workers
+    pending = {}  # future -> (doc_id, lane, cache_keys)
 
-        category = el.category.upper()
-        lines.append(f"[{category}] {text}")
+    print(f"Parsing with {heavy_workers} heavy + {light_workers} light workers")
 
-    return "\n".join(lines)
+    with ProcessPoolExecutor(heavy_workers) as heavy_pool, \
+            ProcessPoolExecutor(light_workers) as light_pool:
 
+        lanes["heavy"]["pool"] = heavy_pool
+        lanes["light"]["pool"] = light_pool
 
-def parse_pdf(file_path):
-    elements = partition_pdf(
-        filename=file_path,
-        strategy="hi_res",                 # IMPORTANT for layout
-        infer_table_structure=True,        # VERY IMPORTANT for syllabus tables
-        extract_images_in_pdf=False,
-    )
-    return elements_to_text(elements)
+        def submit_ready():
+            for lane_name, lane in lanes.items():
+                while lane["queue"] and lane["in_flight"] < 2 * lane["workers"]:
+                    doc_id, file_type, file_bytes, cache_keys = lane["queue"].popleft()
+                    future = lane["pool"].submit(parse_bytes, file_type, file_bytes)
+                    pending[future] = (doc_id, lane_name, cache_keys)
+                    lane["in_flight"] += 1
 
+        def collect(timeout):
+            done, _ = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
 
-def parse_docx(file_path):
-    elements = partition_docx(filename=file_path)
-    return elements_to_text(elements)
+            for future in done:
+                doc_id, lane_name, cache_keys = pending.pop(future)
+                lanes[lane_name]["in_flight"] -= 1
 
+                try:
+                    extracted_text = future.result()
+                except Exception as e:
+                    print(f" Failed to parse document {doc_id}: {e}")
+                    continue
 
-def parse_ppt(file_path):
-    elements = partition_pptx(filename=file_path)
-    return elements_to_text(elements)
+                cache_parsed(cache, cache_keys, extracted_text)
+                store_parsed(conn, cursor, doc_id, extracted_text)
 
-# =========================
-# MAIN PIPELINE
-# =========================
+        def backlog():
+            return sum(len(lane["queue"]) for lane in lanes.values())
 
-cursor.execute("""
-    SELECT id, drive_file_id, file_type
-    FROM documents
-    WHERE parsed = FALSE
-""")
+        for (doc_id, _, file_type), fetched, error in downloads:
+            if error is not None:
+                print(f" Failed to download document {doc_id}: {error}")
+                continue
 
-documents = cursor.fetchall()
-print(f"Found {len(documents)} unparsed documents")
+            cached_text, file_bytes, cache_keys = fetched
 
-for doc_id, drive_file_id, file_type in documents:
-    print(f"\nParsing document {doc_id} ({file_type})")
+            if cached_text is not None:
+                print(f"\nParse cache hit for {doc_id}")
+                store_parsed(conn, cursor, doc_id, cached_text)
+                continue
 
-    tmp_path = None
+            lane_name = "heavy" if file_type in HEAVY_FILE_TYPES else "light"
+            lanes[lane_name]["queue"].append((doc_id, file_type, file_bytes, cache_keys))
+            print(f"\nQueued document {doc_id} ({file_type}, {lane_name})")
 
-    try:
-        # Download file bytes
-        file_bytes = download_drive_file(drive_file_id)
-
-        # Create temp file (unstructured requires a file path)
-        with tempfile.NamedTemporaryFile(delete=False) as tmp:
-            tmp.write(file_bytes)
-            tmp_path = tmp.name
-
-        # Parse based on file type
-        if file_type == "pdf":
-            extracted_text = parse_pdf(tmp_path)
-        elif file_type == "docx":
-            extracted_text = parse_docx(tmp_path)
-        elif file_type == "ppt":
-            extracted_text = parse_ppt(tmp_path)
-        else:
-            print(f" Unsupported file type: {file_type}")
-            continue
+            submit_ready()
+            collect(timeout=0)
 
-        if not extracted_text.strip():
-            print(" No text extracted, skipping")
-            continue
+            while backlog() >= max_backlog:
+                collect(timeout=None)
+                submit_ready()
 
-        # Store in DB
-        cursor.execute("""
-            UPDATE documents
-            SET raw_text = %s,
-                parsed = TRUE
-            WHERE id = %s
-        """, (
-            extracted_text,
-            doc_id
-        ))
+        while pending or backlog():
+            submit_ready()
+            collect(timeout=None)
 
-        conn.commit()
-        print("✔ Parsed and stored successfully")
+# =========================
+# MAIN PIPELINE
+# =========================
 
-    except Exception as e:
-        conn.rollback()
-        print(f" Failed to parse document {doc_id}: {e}")
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Download and parse unparsed documents")
+    parser.add_argument(
+        "--workers", type=int, default=1,
+        help="parser processes; 1 parses in this process"
+    )
+    parser.add_argument(
+        "--no-cache", action="store_true",
+        help="always download and re-parse, ignoring the parse cache"
+    )
+    args = parser.parse_args(argv)
+
+    conn = psycopg2.connect(**DB_CONFIG)
+    cursor = conn.cursor()
+
+    creds = get_credentials(SCOPES)
+    fetch_drive_file = DriveFetcher(creds)
+
+    if args.no_cache:
+        cache = None
+        fetch = partial(fetch_uncached, fetch_drive_file)
+    else:
+        # Unchanged Drive files are served from the cache without a download
+        cache = ParseCache()
+        fetch = partial(fetch_with_cache, fetch_drive_file, cache)
+
+    cursor.execute("""
+        SELECT id, drive_file_id, file_type
+        FROM documents
+        WHERE parsed = FALSE
+    """)
+
+    documents = cursor.fetchall()
+    print(f"Found {len(documents)} unparsed documents")
+
+    for doc_id, _, file_type in documents:
+        if file_type not in SUPPORTED_FILE_TYPES:
+            print(f" Unsupported file type for {doc_id}: {file_type}")
+
+    documents = [doc for doc in documents if doc[2] in SUPPORTED_FILE_TYPES]
+
+    # Downloads run ahead on a thread pool while the documents are parsed
+    downloads = prefetch_downloads(
+        fetch,
+        documents,
+        key=lambda doc: doc[1]
+    )
 
-    finally:
-        if tmp_path and os.path.exists(tmp_path):
-            os.remove(tmp_path)
+    if args.workers > 1:
+        run_parallel(conn, cursor, downloads, cache, args.workers)
+    else:
+        run_serial(conn, cursor, downloads, cache)
+
+    if cache is not None:
+        print(f"\nParse cache: {cache.hits} hits, {cache.misses} misses")
+
+    cursor.close()
+    conn.close()
+    print("\nDocument parsing completed")
 
-# =========================
-# CLEANUP
-# =========================
 
-cursor.close()
-conn.close()
-print("\nDocument parsing completed")
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,541 @@
+import json
+import hashlib
+import argparse
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+
+import psycopg2
+
+import chunk_documents
+import infer_document_roles
+import infer_units_topics
+from drive_download import with_retries
+from embedding_store import CachedEmbedder, ensure_embeddings_table
+from lexical_index import index_rows, open_lexical_index
+from llm_cache import LLMCache
+from model_client import MODEL_SERVER_URL, ModelClient
+from parse_cache import ParseCache, fetch_with_cache, metadata_key
+from parse_documents import SUPPORTED_FILE_TYPES, cache_parsed, store_parsed
+
+# =========================
+# CONFIG
+# =========================
+
+DB_CONFIG = {
+    "dbname": "studybuddy",
+    "user": "postgres",
+    "password": "psql@123",
+    "host": "localhost",
+    "port": 5432,
+}
+
+DRIVE_SCOPES = ["https://www.googleapis.com/auth/drive.readonly"]
+
+# Courses processed at the same time
+COURSE_WORKERS = 4
+
+# Stage -> (scope, upstream stages). A stage's input fingerprint is built
+# from the outputs of its upstream stages, so a change re-runs exactly
+# the downstream work that depends on it.
+STAGES = {
+    "parse": ("document", []),
+    "roles": ("document", ["parse"]),
+    "topics": ("course", ["roles"]),
+    "chunk": ("document", ["roles", "topics"]),
+}
+
+# =========================
+# DAG
+# =========================
+
+def stage_order(stages=STAGES):
+    """Topological order of the stage DAG."""
+    order = []
+    visiting = set()
+
+    def visit(stage):
+        if stage in order:
+            return
+        if stage in visiting:
+            raise ValueError(f"Cycle in stage graph at {stage!r}")
+        visiting.add(stage)
+        for upstream in stages[stage][1]:
+            visit(upstream)
+        visiting.discard(stage)
+        order.append(stage)
+
+    for stage in stages:
+        visit(stage)
+
+    return order
+
+# =========================
+# STATE
+# =========================
+
+def ensure_state_table(cur):
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS pipeline_state (
+            stage TEXT NOT NULL,
+            entity_id TEXT NOT NULL,
+            course_id TEXT,
+            fingerprint TEXT NOT NULL,
+            status TEXT NOT NULL,
+            error TEXT,
+            updated_at TIMESTAMP NOT NULL DEFAULT NOW(),
+            PRIMARY KEY (stage, entity_id)
+        )
+    """)
+
+
+def fingerprint(*parts):
+    return hashlib.sha256(
+        json.dumps(parts, sort_keys=True, default=str).encode("utf-8")
+    ).hexdigest()
+
+
+def load_state(cur, stage, course_id):
+    cur.execute("""
+        SELECT entity_id, fingerprint, status
+        FROM pipeline_state
+        WHERE stage = %s AND course_id = %s
+    """, (stage, course_id))
+    return {entity_id: (fp, status) for entity_id, fp, status in cur.fetchall()}
+
+
+def save_state(cur, stage, entity_id, course_id, fp, status="done", error=None):
+    cur.execute("""
+        INSERT INTO pipeline_state (stage, entity_id, course_id, fingerprint, status, error, updated_at)
+        VALUES (%s, %s, %s, %s, %s, %s, NOW())
+        ON CONFLICT (stage, entity_id) DO UPDATE SET
+            course_id = EXCLUDED.course_id,
+            fingerprint = EXCLUDED.fingerprint,
+            status = EXCLUDED.status,
+            error = EXCLUDED.error,
+            updated_at = EXCLUDED.updated_at
+    """, (stage, entity_id, course_id, fp, status, error))
+
+# =========================
+# CONTEXT
+# =========================
+
+class Pipeline:
+    """
+    Shared resources for every course run: Drive fetcher, caches, model
+    access and the options. Models are loaded on first use; without a
+    model server, calls into one model are serialized across courses.
+    """
+
+    def __init__(self, args):
+        self.args = args
+        self.force = set(args.force or [])
+        self.parse_cache = None if args.no_cache else ParseCache()
+        self.llm_cache = None if args.no_llm_cache or args.server else LLMCache()
+        self.client = ModelClient(args.server) if args.server else None
+        self.parse_pool = ProcessPoolExecutor(args.parse_workers) if args.parse_workers > 0 else None
+        self.locks = {name: threading.Lock() for name in ("roles", "topics", "embed", "lexical")}
+        self.lexical = None
+        self._fetcher = None
+        self._fetcher_lock = threading.Lock()
+
+    def fetcher(self):
+        with self._fetcher_lock:
+            if self._fetcher is None:
+                from drive_download import DriveFetcher
+                from google_auth import get_credentials
+                self._fetcher = DriveFetcher(get_credentials(DRIVE_SCOPES))
+            return self._fetcher
+
+    def embedder(self):
+        return chunk_documents.load_embedder(self.args.server)
+
+    def model_lock(self, name):
+        # The model server batches concurrent calls itself
+        return threading.Lock() if self.client is not None else self.locks[name]
+
+    def is_clean(self, stage, state, entity_id, fp):
+        """Skip an entity whose inputs are unchanged since its last run."""
+        if stage in self.force or entity_id not in state:
+            return False
+
+        stored_fp, status = state[entity_id]
+        if stored_fp != fp:
+            return False
+
+        return status == "done" or not self.args.retry_failed
+
+    def update_lexical(self, removed_ids, chunk_rows, map_rows, role):
+        """Replace a re-chunked document's chunks in the BM25 index."""
+        if self.lexical is None:
+            return
+        with self.locks["lexical"]:
+            self.lexical.remove(removed_ids)
+            index_rows(self.lexical, chunk_rows, map_rows, role)
+
+    def close(self):
+        if self.lexical is not None:
+            self.lexical.save()
+        if self.parse_pool is not None:
+            self.parse_pool.shutdown()
+        if self.llm_cache is not None:
+            self.llm_cache.close()
+
+# =========================
+# STAGES
+# =========================
+
+def run_parse(pipeline, conn, cur, course_id):
+    """Re-parse documents whose Drive file (md5Checksum/modifiedTime) changed."""
+    from document_parsers import parse_bytes
+
+    cur.execute("""
+        SELECT id, drive_file_id, file_type
+        FROM documents
+        WHERE course_id = %s AND drive_file_id IS NOT NULL
+    """, (course_id,))
+    documents = [doc for doc in cur.fetchall() if doc[2] in SUPPORTED_FILE_TYPES]
+
+    state = load_state(cur, "parse", course_id)
+    fetcher = pipeline.fetcher()
+    ran = 0
+
+    for doc_id, file_id, file_type in documents:
+        fp = ""
+
+        try:
+            meta = with_retries(fetcher.metadata, file_id)
+            fp = metadata_key(file_id, meta) or fingerprint(file_id, meta)
+
+            if pipeline.is_clean("parse", state, doc_id, fp):
+                continue
+
+            if pipeline.parse_cache is not None:
+                text, file_bytes, cache_keys = with_retries(
+                    fetch_with_cache, fetcher, pipeline.parse_cache, file_id, meta
+                )
+            else:
+                text, file_bytes, cache_keys = None, with_retries(fetcher, file_id), []
+
+            if text is None:
+                if pipeline.parse_pool is not None:
+                    text = pipeline.parse_pool.submit(parse_bytes, file_type, file_bytes).result()
+                else:
+                    text = parse_bytes(file_type, file_bytes)
+
+                cache_parsed(pipeline.parse_cache, cache_keys, text)
+
+            # Only a committed write counts as done; anything else is
+            # recorded as failed so --retry-failed picks it up
+            if not store_parsed(conn, cur, doc_id, text):
+                raise RuntimeError("parsed text was not stored")
+            save_state(cur, "parse", doc_id, course_id, fp)
+
+        except Exception as e:
+            conn.rollback()
+            print(f" Failed to parse document {doc_id}: {e}")
+            save_state(cur, "parse", doc_id, course_id, fp, "failed", str(e))
+
+        conn.commit()
+        ran += 1
+
+    return ran
+
+
+def run_roles(pipeline, conn, cur, course_id):
+    """Re-classify documents whose title, type or parsed text changed."""
+    cur.execute("""
+        SELECT id, title, file_type, md5(raw_text)
+        FROM documents
+        WHERE course_id = %s AND parsed = TRUE AND raw_text IS NOT NULL
+    """, (course_id,))
+
+    state = load_state(cur, "roles", course_id)
+    dirty = {}
+
+    for doc_id, title, file_type, text_hash in cur.fetchall():
+        fp = fingerprint(title, file_type, text_hash, pipeline.args.role_mode)
+        if not pipeline.is_clean("roles", state, doc_id, fp):
+            dirty[doc_id] = fp
+
+    if not dirty:
+        return 0
+
+    cur.execute("""
+        SELECT id, title, raw_text, file_type
+        FROM documents
+        WHERE id = ANY(%s)
+    """, (list(dirty),))
+    rows = cur.fetchall()
+    documents = [(title, raw_text, file_type) for _, title, raw_text, file_type in rows]
+
+    with pipeline.model_lock("roles"):
+        if pipeline.client is not None:
+            predictions = pipeline.client.classify(documents, mode=pipeline.args.role_mode)
+        else:
+            predictions = infer_document_roles.infer_roles(
+                documents,
+                mode=pipeline.args.role_mode,
+                cache=pipeline.llm_cache,
+                backend=pipeline.args.backend
+            )
+
+    for (doc_id, title, _, _), (role, confidence) in zip(rows, predictions):
+        print(f"[{role.upper():18}] {title}")
+        cur.execute("""
+            UPDATE documents
+            SET role = %s,
+                role_confidence = %s
+            WHERE id = %s
+        """, (role, confidence, doc_id))
+        save_state(cur, "roles", doc_id, course_id, dirty[doc_id])
+
+    conn.commit()
+    return len(rows)
+
+
+def run_topics(pipeline, conn, cur, course_id):
+    """Re-extract units/topics when the course's syllabus documents changed."""
+    cur.execute("""
+        SELECT id, md5(raw_text)
+        FROM documents
+        WHERE course_id = %s AND role = 'syllabus' AND raw_text IS NOT NULL
+        ORDER BY id
+    """, (course_id,))
+    syllabi = cur.fetchall()
+
+    fp = fingerprint(syllabi, pipeline.args.topic_mode)
+    state = load_state(cur, "topics", course_id)
+
+    if not syllabi or pipeline.is_clean("topics", state, course_id, fp):
+        return 0
+
+    status, error = "done", None
+    results = []
+
+    for doc_id, _ in syllabi:
+        cur.execute("SELECT raw_text FROM documents WHERE id = %s", (doc_id,))
+        raw_text = cur.fetchone()[0]
+
+        try:
+            with pipeline.model_lock("topics"):
+                if pipeline.client is not None:
+                    result = pipeline.client.extract(raw_text, mode=pipeline.args.topic_mode)
+                else:
+                    result = infer_units_topics.infer_units_topics(
+                        raw_text,
+                        cache=pipeline.llm_cache,
+                        mode=pipeline.args.topic_mode,
+                        backend=pipeline.args.backend
+                    )
+            results.append(result)
+        except Exception as e:
+            print(f"Error processing document {doc_id}: {e}")
+            status, error = "failed", str(e)
+
+    # The new outline replaces the old one in one transaction: units and
+    # topics no syllabus yields any more go, with their chunk mappings,
+    # which changes the topic fingerprint run_chunk re-maps on. After a
+    # failed (or empty) extraction nothing is pruned, so no topics are lost.
+    try:
+        unit_ids, topic_ids = set(), set()
+        for result in results:
+            units, topics = infer_units_topics.store_units_topics(cur, course_id, result)
+            unit_ids |= units
+            topic_ids |= topics
+
+        if status == "done" and topic_ids:
+            removed = infer_units_topics.prune_units_topics(cur, course_id, unit_ids, topic_ids)
+            if removed:
+                print(f"Removed {removed} topics no longer in the syllabus of {course_id}")
+        conn.commit()
+    except Exception as e:
+        conn.rollback()
+        print(f"Error storing topics of {course_id}: {e}")
+        status, error = "failed", str(e)
+
+    save_state(cur, "topics", course_id, course_id, fp, status, error)
+    conn.commit()
+    return len(syllabi)
+
+
+def run_chunk(pipeline, conn, cur, course_id):
+    """
+    Re-chunk documents whose text or role changed, and re-map the
+    topic-mapped ones when the course's topics changed.
+    """
+    cur.execute("""
+        SELECT t.id, u.name, t.name
+        FROM topics t
+        JOIN units u ON t.unit_id = u.id
+        WHERE t.course_id = %s
+        ORDER BY t.id
+    """, (course_id,))
+    topics_fp = fingerprint(cur.fetchall())
+
+    cur.execute("""
+        SELECT id, role, md5(raw_text)
+        FROM documents
+        WHERE course_id = %s AND parsed = TRUE AND raw_text IS NOT NULL
+    """, (course_id,))
+
+    state = load_state(cur, "chunk", course_id)
+    dirty = {}
+
+    for doc_id, role, text_hash in cur.fetchall():
+        mapped = role in chunk_documents.TOPIC_MAPPED_ROLES
+        fp = fingerprint(text_hash, role, topics_fp if mapped else None)
+        if not pipeline.is_clean("chunk", state, doc_id, fp):
+            dirty[doc_id] = fp
+
+    if not dirty:
+        return 0
+
+    embedder = CachedEmbedder(pipeline.embedder(), conn, chunk_documents.EMBED_MODEL_NAME)
+    with pipeline.model_lock("embed"):
+        topics_by_course, topic_embeddings = chunk_documents.load_topics(cur, embedder, course_id)
+
+    for doc_id, fp in dirty.items():
+        cur.execute("SELECT role, raw_text FROM documents WHERE id = %s", (doc_id,))
+        role, raw_text = cur.fetchone()
+
+        try:
+            with pipeline.model_lock("embed"):
+                chunk_rows, map_rows = chunk_documents.build_rows(
+                    doc_id, course_id, role, raw_text, embedder,
+                    topics_by_course.get(course_id), topic_embeddings.get(course_id)
+                )
+
+            # Replace the document's previous chunks
+            cur.execute("""
+                DELETE FROM chunk_topic_map
+                WHERE chunk_id IN (SELECT id FROM chunks WHERE document_id = %s)
+            """, (doc_id,))
+            cur.execute("DELETE FROM chunks WHERE document_id = %s RETURNING id::text", (doc_id,))
+            removed_ids = [row[0] for row in cur.fetchall()]
+
+            new_rows = (list(chunk_rows), list(map_rows))
+            chunk_documents.flush_rows(cur, chunk_rows, map_rows)
+            save_state(cur, "chunk", doc_id, course_id, fp)
+            conn.commit()
+        except Exception as e:
+            conn.rollback()
+            print(f" Failed to chunk document {doc_id}: {e}")
+            save_state(cur, "chunk", doc_id, course_id, fp, "failed", str(e))
+            conn.commit()
+        else:
+            pipeline.update_lexical(removed_ids, *new_rows, role)
+
+    return len(dirty)
+
+
+STAGE_RUNNERS = {
+    "parse": run_parse,
+    "roles": run_roles,
+    "topics": run_topics,
+    "chunk": run_chunk,
+}
+
+# =========================
+# COURSE RUNNER
+# =========================
+
+def run_course(pipeline, course_id, stages):
+    """Run the selected stages for one course in DAG order, on its own connection."""
+    conn = psycopg2.connect(**DB_CONFIG)
+    cur = conn.cursor()
+    report = {}
+
+    try:
+        for stage in stages:
+            report[stage] = STAGE_RUNNERS[stage](pipeline, conn, cur, course_id)
+    finally:
+        cur.close()
+        conn.close()
+
+    return report
+
+# =========================
+# MAIN
+# =========================
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Run the pipeline stages incrementally, re-running only work whose inputs changed"
+    )
+    parser.add_argument(
+        "--stages", nargs="+", choices=list(STAGES), default=list(STAGES),
+        help="subset of stages to run (always executed in DAG order)"
+    )
+    parser.add_argument("--course", action="append", help="limit to these course IDs")
+    parser.add_argument("--workers", type=int, default=COURSE_WORKERS, help="courses processed concurrently")
+    parser.add_argument("--parse-workers", type=int, default=0, help="parser processes (0: parse in-thread)")
+    parser.add_argument("--force", nargs="+", choices=list(STAGES), help="re-run these stages regardless of fingerprints")
+    parser.add_argument("--retry-failed", action="store_true", help="retry failed entities even if unchanged")
+    parser.add_argument("--role-mode", choices=["generate", "score"], default=infer_document_roles.DEFAULT_MODE)
+    parser.add_argument("--topic-mode", choices=["single", "windowed"], default=infer_units_topics.DEFAULT_MODE)
+    parser.add_argument("--backend", default=infer_document_roles.LLM_BACKEND)
+    parser.add_argument("--server", default=MODEL_SERVER_URL, help="use a running model_server.py")
+    parser.add_argument("--no-cache", action="store_true", help="bypass the parse cache")
+    parser.add_argument("--no-llm-cache", action="store_true", help="bypass the LLM result cache")
+    parser.add_argument("--no-lexical-index", action="store_true", help="don't update the BM25 index")
+    args = parser.parse_args(argv)
+
+    stages = [stage for stage in stage_order() if stage in args.stages]
+
+    conn = psycopg2.connect(**DB_CONFIG)
+    cur = conn.cursor()
+    ensure_state_table(cur)
+    ensure_embeddings_table(cur)
+    cur.execute("ALTER TABLE documents ADD COLUMN IF NOT EXISTS role_confidence REAL")
+
+    if args.course:
+        course_ids = args.course
+    else:
+        cur.execute("SELECT id FROM courses ORDER BY id")
+        course_ids = [row[0] for row in cur.fetchall()]
+
+    conn.commit()
+    cur.close()
+
+    pipeline = Pipeline(args)
+    if "chunk" in stages and not args.no_lexical_index:
+        pipeline.lexical = open_lexical_index(conn)
+
+    conn.close()
+
+    print(f"Running {' → '.join(stages)} for {len(course_ids)} courses")
+
+    totals = dict.fromkeys(stages, 0)
+    failed = 0
+
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, args.workers)) as pool:
+            futures = {
+                pool.submit(run_course, pipeline, course_id, stages): course_id
+                for course_id in course_ids
+            }
+
+            for future in as_completed(futures):
+                course_id = futures[future]
+                try:
+                    report = future.result()
+                except Exception as e:
+                    failed += 1
+                    print(f" Course {course_id} failed: {e}")
+                    continue
+
+                for stage, count in report.items():
+                    totals[stage] += count
+
+                summary = ", ".join(f"{stage} {count}" for stage, count in report.items())
+                print(f"✔ Course {course_id}: {summary}")
+    finally:
+        pipeline.close()
+
+    print("\nRe-ran: " + ", ".join(f"{stage} {count}" for stage, count in totals.items()))
+    if failed:
+        print(f"{failed} courses failed")
+
+
+if __name__ == "__main__":
+    main()
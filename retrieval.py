@@ -0,0 +1,556 @@
+import os
+import argparse
+import tempfile
+
+import numpy as np
+import psycopg2
+
+from embedding_store import CachedEmbedder, ensure_embeddings_table, store_model_name
+from lexical_index import LEXICAL_INDEX_PATH, open_lexical_index
+
+# =========================
+# CONFIG
+# =========================
+
+DB_CONFIG = {
+    "dbname": "studybuddy",
+    "user": "postgres",
+    "password": "psql@123",
+    "host": "localhost",
+    "port": 5432,
+}
+
+INDEX_PATH = ".retrieval_index.npz"
+
+# Below this many vectors the index is scanned exactly (no clustering)
+TRAIN_MIN_VECTORS = 4096
+# IVF lists = LISTS_PER_SQRT * sqrt(n); the query probes the N_PROBE nearest
+LISTS_PER_SQRT = 4
+N_PROBE = 16
+KMEANS_ITERATIONS = 10
+KMEANS_SAMPLE_PER_LIST = 64
+# Re-cluster once the index has grown this much since the last training
+RETRAIN_GROWTH = 4
+
+# Filtered subsets (one course / one topic) up to this size are scanned
+# exactly, which is both exact and faster than probing
+EXACT_SEARCH_MAX = 20000
+
+LOAD_BATCH_SIZE = 1000
+
+# Hybrid search: each index contributes its top FUSION_DEPTH (at least k)
+# hits, fused by reciprocal rank 1 / (RRF_K + rank)
+SEARCH_MODES = ("hybrid", "dense", "lexical")
+FUSION_DEPTH = 50
+RRF_K = 60
+
+# =========================
+# HELPERS
+# =========================
+
+def normalize(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+def top_k(scores, rows, k):
+    """Best k (row, score) pairs, highest first."""
+    if len(scores) > k:
+        best = np.argpartition(-scores, k - 1)[:k]
+    else:
+        best = np.arange(len(scores))
+    best = best[np.argsort(-scores[best])]
+    return rows[best], scores[best]
+
+
+def assign_lists(vectors, centroids, batch_size=65536):
+    """Nearest centroid (by cosine) of each vector, in bounded-memory batches."""
+    out = np.empty(len(vectors), dtype=np.int32)
+    for start in range(0, len(vectors), batch_size):
+        out[start:start + batch_size] = np.argmax(
+            vectors[start:start + batch_size] @ centroids.T, axis=1
+        )
+    return out
+
+
+def spherical_kmeans(vectors, n_lists, iterations=KMEANS_ITERATIONS, seed=0):
+    rng = np.random.default_rng(seed)
+    centroids = vectors[rng.choice(len(vectors), n_lists, replace=False)].copy()
+
+    for _ in range(iterations):
+        labels = assign_lists(vectors, centroids)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, labels, vectors)
+        counts = np.bincount(labels, minlength=n_lists)
+
+        # Empty lists are re-seeded from random points
+        empty = counts == 0
+        sums[empty] = vectors[rng.choice(len(vectors), int(empty.sum()))]
+        centroids = normalize(sums)
+
+    return centroids
+
+# =========================
+# VECTOR INDEX
+# =========================
+
+class VectorIndex:
+    """
+    In-process IVF-flat index over L2-normalized chunk embeddings, scored
+    by inner product (= cosine). Rows carry a course, a role and the
+    chunk's mapped topics for filtering. Supports incremental add and
+    remove; removed rows are dropped when the index is saved.
+    """
+
+    def __init__(self, dim=None):
+        self.dim = dim
+        self.size = 0
+        self.vectors = np.zeros((0, dim or 0), dtype=np.float32)
+        self.courses = np.zeros(0, dtype=np.int32)
+        self.roles = np.zeros(0, dtype=np.int32)
+        self.lists = np.zeros(0, dtype=np.int32)
+        self.alive = np.zeros(0, dtype=bool)
+
+        self.ids = []
+        self.row_of = {}
+        self.course_codes = {}
+        self.role_codes = {}
+        self.topic_rows = {}
+
+        self.centroids = None
+        self.trained_size = 0
+        self._list_rows = []
+        self._course_rows = {}
+        self._cache = {}
+
+    def __len__(self):
+        return len(self.row_of)
+
+    # ---------- storage ----------
+
+    def _reserve(self, extra):
+        needed = self.size + extra
+        capacity = len(self.vectors)
+        if needed <= capacity:
+            return
+
+        capacity = max(needed, 2 * capacity, 1024)
+        for name in ("vectors", "courses", "roles", "lists", "alive"):
+            old = getattr(self, name)
+            new = np.zeros((capacity,) + old.shape[1:], dtype=old.dtype)
+            new[:self.size] = old[:self.size]
+            setattr(self, name, new)
+
+    @staticmethod
+    def _code(codes, value):
+        return codes.setdefault(value, len(codes))
+
+    def _rows(self, key, python_rows):
+        """Cached array view of a row list; invalidated when the list grows."""
+        cached = self._cache.get(key)
+        if cached is None or len(cached) != len(python_rows):
+            cached = np.asarray(python_rows, dtype=np.int64)
+            self._cache[key] = cached
+        return cached
+
+    # ---------- updates ----------
+
+    def add(self, ids, vectors, course_ids, roles, topic_ids=None):
+        """Insert (or replace) rows. topic_ids is one list of topic IDs per row."""
+        if not len(ids):
+            return
+
+        self.remove([chunk_id for chunk_id in ids if chunk_id in self.row_of])
+
+        vectors = normalize(vectors)
+        if not self.size and self.dim is None:
+            # Dimension is taken from the first vectors added
+            self.dim = vectors.shape[1]
+            self.vectors = np.zeros((0, self.dim), dtype=np.float32)
+
+        n = len(ids)
+        self._reserve(n)
+        rows = np.arange(self.size, self.size + n)
+
+        self.vectors[rows] = vectors
+        self.courses[rows] = [self._code(self.course_codes, c) for c in course_ids]
+        self.roles[rows] = [self._code(self.role_codes, r) for r in roles]
+        self.alive[rows] = True
+
+        for row, chunk_id, course_code in zip(rows.tolist(), ids, self.courses[rows].tolist()):
+            self.ids.append(chunk_id)
+            self.row_of[chunk_id] = row
+            self._course_rows.setdefault(course_code, []).append(row)
+
+        for row, topics in zip(rows.tolist(), topic_ids or [()] * n):
+            for topic_id in topics or ():
+                self.topic_rows.setdefault(topic_id, []).append(row)
+
+        self.size += n
+
+        if self.centroids is not None:
+            labels = assign_lists(vectors, self.centroids)
+            self.lists[rows] = labels
+            for row, label in zip(rows.tolist(), labels.tolist()):
+                self._list_rows[label].append(row)
+
+        if (self.centroids is None and len(self) >= TRAIN_MIN_VECTORS) or (
+            self.centroids is not None and len(self) >= RETRAIN_GROWTH * self.trained_size
+        ):
+            self.train()
+
+    def remove(self, ids):
+        for chunk_id in ids:
+            row = self.row_of.pop(chunk_id, None)
+            if row is not None:
+                self.alive[row] = False
+
+    def train(self):
+        """(Re-)cluster the live vectors into IVF lists."""
+        live = np.flatnonzero(self.alive[:self.size])
+        n_lists = max(1, int(LISTS_PER_SQRT * np.sqrt(len(live))))
+
+        rng = np.random.default_rng(0)
+        sample_size = min(len(live), n_lists * KMEANS_SAMPLE_PER_LIST)
+        sample = self.vectors[rng.choice(live, sample_size, replace=False)]
+
+        self.centroids = spherical_kmeans(sample, n_lists)
+        self.lists[live] = assign_lists(self.vectors[live], self.centroids)
+
+        self._list_rows = [[] for _ in range(n_lists)]
+        for row, label in zip(live.tolist(), self.lists[live].tolist()):
+            self._list_rows[label].append(row)
+
+        self._cache = {key: value for key, value in self._cache.items() if key[0] != "list"}
+        self.trained_size = len(live)
+
+    # ---------- search ----------
+
+    def search(self, query_vector, k=10, course_id=None, role=None, topic_id=None):
+        """Top-k (chunk_id, score) by cosine similarity, with optional filters."""
+        query = normalize(query_vector).reshape(-1)
+
+        if course_id is not None and course_id not in self.course_codes:
+            return []
+        if role is not None and role not in self.role_codes:
+            return []
+
+        # Start from the smallest filter subset available
+        if topic_id is not None:
+            candidates = self._rows(("topic", topic_id), self.topic_rows.get(topic_id, []))
+        elif course_id is not None:
+            code = self.course_codes[course_id]
+            candidates = self._rows(("course", code), self._course_rows.get(code, []))
+        else:
+            candidates = None
+
+        if candidates is None and self.centroids is None:
+            candidates = np.arange(self.size)
+        elif candidates is None or len(candidates) > EXACT_SEARCH_MAX:
+            candidates = self._probe(query, candidates)
+
+        mask = self.alive[candidates]
+        if course_id is not None:
+            mask &= self.courses[candidates] == self.course_codes[course_id]
+        if role is not None:
+            mask &= self.roles[candidates] == self.role_codes[role]
+        candidates = candidates[mask]
+
+        if not len(candidates):
+            return []
+
+        scores = self.vectors[candidates] @ query
+        rows, scores = top_k(scores, candidates, k)
+        return [(self.ids[row], float(score)) for row, score in zip(rows, scores)]
+
+    def _probe(self, query, subset=None):
+        n_probe = min(N_PROBE, len(self.centroids))
+        nearest = np.argpartition(-(self.centroids @ query), n_probe - 1)[:n_probe]
+        rows = np.concatenate([
+            self._rows(("list", int(label)), self._list_rows[label]) for label in nearest
+        ])
+        if subset is not None:
+            rows = rows[np.isin(rows, subset)]
+        return rows
+
+    # ---------- persistence ----------
+
+    def save(self, path=INDEX_PATH):
+        """Write the live rows (compacted) atomically as one .npz file."""
+        live = np.flatnonzero(self.alive[:self.size])
+        new_row = np.full(self.size, -1, dtype=np.int64)
+        new_row[live] = np.arange(len(live))
+
+        topic_pairs = [
+            (int(new_row[row]), topic_id)
+            for topic_id, rows in self.topic_rows.items()
+            for row in rows
+            if new_row[row] >= 0
+        ]
+
+        arrays = {
+            "vectors": self.vectors[live],
+            "ids": np.array([self.ids[row] for row in live], dtype=str),
+            "courses": self.courses[live],
+            "course_names": np.array(list(self.course_codes), dtype=str),
+            "roles": self.roles[live],
+            "role_names": np.array(list(self.role_codes), dtype=str),
+            "topic_rows": np.array([row for row, _ in topic_pairs], dtype=np.int64),
+            "topic_ids": np.array([topic for _, topic in topic_pairs], dtype=str),
+            "lists": self.lists[live],
+            "centroids": self.centroids if self.centroids is not None else np.zeros((0, self.dim or 0), np.float32),
+            "trained_size": np.array(self.trained_size),
+        }
+
+        directory = os.path.dirname(os.path.abspath(path))
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".npz")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                np.savez(f, **arrays)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+
+    @classmethod
+    def load(cls, path=INDEX_PATH):
+        data = np.load(path)
+        index = cls(data["vectors"].shape[1])
+        n = len(data["ids"])
+
+        index._reserve(n)
+        index.size = n
+        index.vectors[:n] = data["vectors"]
+        index.courses[:n] = data["courses"]
+        index.roles[:n] = data["roles"]
+        index.lists[:n] = data["lists"]
+        index.alive[:n] = True
+
+        index.ids = data["ids"].tolist()
+        index.row_of = {chunk_id: row for row, chunk_id in enumerate(index.ids)}
+        index.course_codes = {name: code for code, name in enumerate(data["course_names"].tolist())}
+        index.role_codes = {name: code for code, name in enumerate(data["role_names"].tolist())}
+
+        for row, topic_id in zip(data["topic_rows"].tolist(), data["topic_ids"].tolist()):
+            index.topic_rows.setdefault(topic_id, []).append(row)
+
+        for row, code in enumerate(index.courses[:n].tolist()):
+            index._course_rows.setdefault(code, []).append(row)
+
+        if len(data["centroids"]):
+            index.centroids = data["centroids"]
+            index.trained_size = int(data["trained_size"])
+            index._list_rows = [[] for _ in range(len(index.centroids))]
+            for row, label in enumerate(index.lists[:n].tolist()):
+                index._list_rows[label].append(row)
+
+        return index
+
+# =========================
+# DATABASE SYNC
+# =========================
+
+def iter_chunk_batches(conn, model, chunk_ids=None, batch_size=LOAD_BATCH_SIZE):
+    """
+    Stream chunks with their role, mapped topics and stored embedding
+    (None when not embedded yet) through a server-side cursor.
+    """
+    with conn.cursor(name="retrieval_chunks") as cur:
+        cur.itersize = batch_size
+        cur.execute("""
+            SELECT c.id::text, c.course_id::text, d.role, c.text, e.vector,
+                   ARRAY(SELECT m.topic_id::text FROM chunk_topic_map m WHERE m.chunk_id = c.id)
+            FROM chunks c
+            JOIN documents d ON d.id = c.document_id
+            LEFT JOIN embeddings e
+                   ON e.model = %(model)s
+                  AND e.text_hash = encode(sha256(convert_to(c.text, 'UTF8')), 'hex')
+            WHERE %(ids)s::text[] IS NULL OR c.id::text = ANY(%(ids)s::text[])
+        """, {"model": model, "ids": chunk_ids})
+
+        while True:
+            rows = cur.fetchmany(batch_size)
+            if not rows:
+                break
+            yield rows
+
+
+def add_from_db(index, conn, embedder, chunk_ids=None):
+    """
+    Add chunks from the database to the index. Chunks without a stored
+    embedding are encoded through the (caching) embedder, which stores them.
+    """
+    model = store_model_name(embedder.model_name, True)
+    added = 0
+
+    for rows in iter_chunk_batches(conn, model, chunk_ids):
+        missing = [i for i, row in enumerate(rows) if row[4] is None]
+        vectors = [
+            np.frombuffer(bytes(row[4]), dtype=np.float32) if row[4] is not None else None
+            for row in rows
+        ]
+
+        if missing:
+            encoded = embedder.encode([rows[i][3] for i in missing], normalize_embeddings=True)
+            for i, vector in zip(missing, encoded):
+                vectors[i] = vector
+
+        index.add(
+            [row[0] for row in rows],
+            np.stack(vectors),
+            [row[1] for row in rows],
+            [row[2] or "unknown" for row in rows],
+            [row[5] for row in rows]
+        )
+        added += len(rows)
+
+    conn.commit()
+    return added
+
+
+def sync_index(index, conn, embedder):
+    """Bring the index in line with the chunks table: drop deleted chunks, add new ones."""
+    with conn.cursor() as cur:
+        cur.execute("SELECT id::text FROM chunks")
+        db_ids = {row[0] for row in cur.fetchall()}
+
+    indexed = set(index.row_of)
+    removed = indexed - db_ids
+    index.remove(removed)
+
+    new_ids = sorted(db_ids - indexed)
+    added = add_from_db(index, conn, embedder, new_ids) if new_ids else 0
+    return added, len(removed)
+
+
+def open_index(conn, embedder, path=INDEX_PATH):
+    """Load the saved index (or build it) and sync it with the database."""
+    if os.path.exists(path):
+        index = VectorIndex.load(path)
+        added, removed = sync_index(index, conn, embedder)
+    else:
+        index = VectorIndex()
+        added = add_from_db(index, conn, embedder)
+        removed = 0
+
+    if added or removed:
+        index.save(path)
+
+    return index
+
+# =========================
+# QUERY API
+# =========================
+
+def reciprocal_rank_fusion(result_lists, k=10, rrf_k=RRF_K):
+    """Fuse ranked (chunk_id, score) lists by summing 1 / (rrf_k + rank)."""
+    fused = {}
+    for results in result_lists:
+        for rank, (chunk_id, _) in enumerate(results, start=1):
+            fused[chunk_id] = fused.get(chunk_id, 0.0) + 1.0 / (rrf_k + rank)
+
+    return sorted(fused.items(), key=lambda item: -item[1])[:k]
+
+
+class Retriever:
+    """
+    One query API over the vector index and (optionally) the BM25 index.
+    Hybrid search fuses both rankings, so exact terms such as course codes
+    and formula names are found even when the embedding misses them.
+    """
+
+    def __init__(self, index, embedder, lexical=None):
+        self.index = index
+        self.embedder = embedder
+        self.lexical = lexical
+
+    def search(self, query, k=10, course_id=None, role=None, topic_id=None, mode="hybrid"):
+        if mode not in SEARCH_MODES:
+            raise ValueError(f"Unknown search mode: {mode}")
+        if self.lexical is None:
+            mode = "dense"
+
+        filters = {"course_id": course_id, "role": role, "topic_id": topic_id}
+        depth = k if mode != "hybrid" else max(k, FUSION_DEPTH)
+        result_lists = []
+
+        if mode in ("hybrid", "dense"):
+            query_vector = self.embedder.encode([query], normalize_embeddings=True)[0]
+            result_lists.append(self.index.search(query_vector, depth, **filters))
+
+        if mode in ("hybrid", "lexical"):
+            result_lists.append(self.lexical.search(query, depth, **filters))
+
+        if mode != "hybrid":
+            return result_lists[0]
+
+        return reciprocal_rank_fusion(result_lists, k)
+
+    def add(self, ids, texts, vectors, course_ids, roles, topic_ids=None):
+        self.index.add(ids, vectors, course_ids, roles, topic_ids)
+        if self.lexical is not None:
+            self.lexical.add(ids, texts, course_ids, roles, topic_ids)
+
+
+def fetch_chunk_texts(conn, chunk_ids):
+    with conn.cursor() as cur:
+        cur.execute("SELECT id::text, text FROM chunks WHERE id::text = ANY(%s)", (list(chunk_ids),))
+        return dict(cur.fetchall())
+
+# =========================
+# MAIN
+# =========================
+
+def main(argv=None):
+    from chunk_documents import EMBED_MODEL_NAME, load_embedder
+    from model_client import MODEL_SERVER_URL
+
+    parser = argparse.ArgumentParser(description="Build, update and query the chunk search indexes")
+    parser.add_argument("command", choices=["build", "update", "search"])
+    parser.add_argument("query", nargs="?", help="query text for `search`")
+    parser.add_argument("-k", type=int, default=5)
+    parser.add_argument("--course")
+    parser.add_argument("--role")
+    parser.add_argument("--topic")
+    parser.add_argument("--mode", choices=SEARCH_MODES, default="hybrid")
+    parser.add_argument("--index", default=INDEX_PATH)
+    parser.add_argument("--lexical-index", default=LEXICAL_INDEX_PATH)
+    parser.add_argument("--server", default=MODEL_SERVER_URL)
+    args = parser.parse_args(argv)
+
+    conn = psycopg2.connect(**DB_CONFIG)
+    with conn.cursor() as cur:
+        ensure_embeddings_table(cur)
+    conn.commit()
+
+    embedder = CachedEmbedder(load_embedder(args.server), conn, EMBED_MODEL_NAME)
+
+    if args.command == "build":
+        for path in (args.index, args.lexical_index):
+            if os.path.exists(path):
+                os.remove(path)
+
+    index = open_index(conn, embedder, args.index)
+    lexical = open_lexical_index(conn, args.lexical_index)
+    print(f"✔ Indexes ready: {len(index)} chunks (vector), {len(lexical)} chunks (BM25)")
+
+    if args.command == "search":
+        if not args.query:
+            parser.error("search needs a query")
+
+        results = Retriever(index, embedder, lexical).search(
+            args.query, args.k, course_id=args.course, role=args.role,
+            topic_id=args.topic, mode=args.mode
+        )
+        texts = fetch_chunk_texts(conn, [chunk_id for chunk_id, _ in results])
+
+        for chunk_id, score in results:
+            print(f"\n[{score:.3f}] {chunk_id}")
+            print(texts.get(chunk_id, "")[:300])
+
+    conn.close()
+
+
+if __name__ == "__main__":
+    main()